@@ -1,7 +1,15 @@
 import os
-import requests
+import json
+import time
 from dotenv import load_dotenv
 
+from answer_cache import SemanticAnswerCache
+from http_client import post_json
+from embedding_cache import normalize_query
+from single_flight import SingleFlight
+from upstream_scheduler import SchedulerBusyError
+from tracing import tracer
+
 # Load API key from .env file
 load_dotenv()
 ALEM_API_KEY = os.getenv("ALEM_API_KEY")
@@ -9,22 +17,35 @@ ALEM_API_KEY = os.getenv("ALEM_API_KEY")
 if not ALEM_API_KEY:
     raise ValueError("ALEM_API_KEY не найден в вашем .env файле!")
 
-ALEM_LLM_URL = "https://llm.alem.ai/v1/chat/completions"
+# Base URL can be overridden (env or .env), e.g. with the stand-in server of benchmarks/fake_alem.py
+ALEM_BASE_URL = os.getenv("ALEM_BASE_URL", "https://llm.alem.ai")
+ALEM_LLM_URL = f"{ALEM_BASE_URL}/v1/chat/completions"
 
 HEADERS = {
     "Authorization": f"Bearer {ALEM_API_KEY}",
     "Content-Type": "application/json"
 }
 
-def _call_alem_api(prompt_string):
-    """
-    Internal function to call AlemLLM API.
-    Uses OpenAI-compatible payload structure.
-    """
-    if not ALEM_API_KEY:
-        return "Ошибка: ALEM_API_KEY не найден."
+# Shown instead of an answer when the LLM quota is saturated (see upstream_scheduler)
+BUSY_MESSAGE = "Сейчас очень много запросов. Пожалуйста, повторите вопрос через минуту."
+MISSING_KEY_MESSAGE = "Ошибка: ALEM_API_KEY не найден."
 
-    # Wrap prompt string in OpenAI-compatible message format
+# Semantic answer cache: near-duplicate questions answered from the same contexts skip the LLM
+ANSWER_CACHE_THRESHOLD = 0.95  # Minimum cosine similarity between query embeddings
+ANSWER_CACHE_SIZE = 2000
+ANSWER_CACHE_TTL_SECONDS = 24 * 3600
+
+answer_cache = SemanticAnswerCache(
+    threshold=ANSWER_CACHE_THRESHOLD,
+    max_size=ANSWER_CACHE_SIZE,
+    ttl_seconds=ANSWER_CACHE_TTL_SECONDS,
+)
+
+# Concurrent identical questions over the same contexts share one LLM completion
+answer_flight = SingleFlight()
+
+def _completion_payload(prompt_string, stream=False):
+    """OpenAI-compatible chat payload with the prompt as a single user message."""
     payload = {
         "model": "alemllm",
         "messages": [
@@ -34,26 +55,94 @@ def _call_alem_api(prompt_string):
             }
         ]
     }
+    if stream:
+        payload["stream"] = True
+    return payload
 
-    try:
-        response = requests.post(ALEM_LLM_URL, json=payload, headers=HEADERS, timeout=60)
-        response.raise_for_status()  # Check for HTTP errors (4xx, 5xx)
-        
-        data = response.json()
-        return data["choices"][0]["message"]["content"]
+def _request_completion(prompt_string):
+    """
+    Sends one prompt to AlemLLM and returns the completion text.
+    Uses OpenAI-compatible payload structure. Raises on HTTP and network errors.
+    """
+    # Wrap prompt string in OpenAI-compatible message format
+    payload = _completion_payload(prompt_string)
+
+    # Raises for HTTP errors (4xx, 5xx)
+    response = post_json("llm", ALEM_LLM_URL, payload, HEADERS)
     
-    except requests.exceptions.HTTPError as errh:
-        print(f"Http Error: {errh}")
-        return f"(API Ошибка Alem: {errh})"
+    data = response.json()
+    return data["choices"][0]["message"]["content"]
+
+def _parse_sse_line(line):
+    """
+    Parses one SSE line of a streamed completion.
+    Returns the text delta ("" for lines without content), or None at the end of the stream.
+    """
+    if not line or not line.startswith("data:"):
+        return ""
+    data = line[len("data:"):].strip()
+    if data == "[DONE]":
+        return None
+    chunk = json.loads(data)
+    choices = chunk.get("choices") or [{}]
+    return choices[0].get("delta", {}).get("content") or ""
+
+def _stream_completion(prompt_string):
+    """
+    Streams one AlemLLM completion ("stream": true, OpenAI-compatible SSE).
+    Yields text deltas as they arrive. Raises on HTTP and network errors.
+    """
+    payload = _completion_payload(prompt_string, stream=True)
+
+    response = post_json("llm", ALEM_LLM_URL, payload, HEADERS, stream=True)
+    # SSE responses often omit charset; the body is UTF-8
+    response.encoding = "utf-8"
+    try:
+        for line in response.iter_lines(decode_unicode=True):
+            delta = _parse_sse_line(line)
+            if delta is None:
+                break
+            if delta:
+                yield delta
+    finally:
+        response.close()
+
+def completion_error(e):
+    """
+    Maps a failed completion call (sync or async, streamed or not) to
+    (message for the user, error label for the "llm" span).
+    """
+    if isinstance(e, SchedulerBusyError):
+        print(f"LLM: очередь переполнена ({e})")
+        return BUSY_MESSAGE, "busy"
+    print(f"Ошибка при вызове Alem API: {e}")
+    return f"(API Ошибка Alem: {e})", type(e).__name__
+
+def _call_alem_api_checked(prompt_string):
+    """
+    Calls AlemLLM API and reports whether the call succeeded.
+    Returns (text, ok): the completion, or an error message for the user instead of raising.
+    """
+    if not ALEM_API_KEY:
+        return MISSING_KEY_MESSAGE, False
+
+    try:
+        return _request_completion(prompt_string), True
     except Exception as e:
-        print(f"Ошибка при вызове Alem API: {e}")
-        return f"(API Ошибка Alem: {e})"
+        return completion_error(e)[0], False
 
-def generate_llm_answer(user_question, found_contexts_list):
+def _call_alem_api(prompt_string):
     """
-    Generates answer using RAG approach with AlemLLM.
-    Formats contexts and sends to LLM for synthesis.
+    Internal function to call AlemLLM API.
+    Uses OpenAI-compatible payload structure.
+    """
+    return _call_alem_api_checked(prompt_string)[0]
+
+def build_rag_prompt(user_question, found_contexts_list):
+    """
+    Formats retrieved contexts and the user question into the RAG prompt.
     """
+    start_time = time.perf_counter()
     context_text = ""
     for i, context in enumerate(found_contexts_list):
         context_text += f"\n--- КОНТЕКСТ {i+1} ---\n"
@@ -76,7 +165,133 @@ def generate_llm_answer(user_question, found_contexts_list):
     ОТВЕТ АССИСТЕНТА:
     """
     
-    return _call_alem_api(prompt_template)
+    tracer.record("prompt_build", time.perf_counter() - start_time,
+                  contexts=len(found_contexts_list), prompt_chars=len(prompt_template))
+    return prompt_template
+
+class CompletionStream:
+    """
+    Bookkeeping of one streamed completion, shared by _stream_llm_answer() and
+    async_pipeline._generate_stream(). The "llm" and "llm_first_token" spans are recorded
+    manually (with the caller's `trace_id`): the stream may be consumed by another thread.
+    """
+
+    def __init__(self, prompt_template, query_vector, doc_keys, trace_id=None):
+        self.prompt_template = prompt_template
+        self.query_vector = query_vector
+        self.doc_keys = doc_keys
+        self.trace_id = trace_id
+        self.start_time = time.perf_counter()
+        self.chunks = []
+        self.error = None
+
+    def add(self, delta):
+        """Records one received delta and returns it."""
+        if not self.chunks:
+            first_token_seconds = time.perf_counter() - self.start_time
+            print(f"LLM: первый токен через {first_token_seconds:.2f} с")
+            tracer.record("llm_first_token", first_token_seconds, trace_id=self.trace_id)
+        self.chunks.append(delta)
+        return delta
+
+    def fail(self, e):
+        """Returns the message shown instead of the rest of the answer (see completion_error())."""
+        message, self.error = completion_error(e)
+        return message
+
+    def record(self):
+        """Records the "llm" span; called once the stream ended, failed or was abandoned."""
+        tracer.record("llm", time.perf_counter() - self.start_time, trace_id=self.trace_id, stream=True,
+                      prompt_chars=len(self.prompt_template),
+                      answer_chars=sum(len(chunk) for chunk in self.chunks), error=self.error)
+
+    def complete(self):
+        """Caches the answer of a stream that ran to its end."""
+        if self.query_vector is not None and self.doc_keys and self.chunks:
+            answer_cache.store(self.query_vector, self.doc_keys, "".join(self.chunks),
+                               time.perf_counter() - self.start_time)
+
+def lookup_cached_answer(query_vector, doc_keys):
+    """Semantic answer cache lookup shared with async_pipeline; None on a miss or without contexts."""
+    if query_vector is None or not doc_keys:
+        return None
+    cached_answer = answer_cache.lookup(query_vector, doc_keys)
+    tracer.annotate(answer_cache_hit=cached_answer is not None)
+    if cached_answer is not None:
+        print(f"LLM: ответ из семантического кэша ({answer_cache.stats()})")
+    return cached_answer
+
+def _stream_llm_answer(prompt_template, query_vector, doc_keys, trace_id=None):
+    """
+    Generator behind generate_llm_answer(stream=True).
+    Yields the answer chunk by chunk; the full text is cached once the stream completes.
+    """
+    if not ALEM_API_KEY:
+        yield MISSING_KEY_MESSAGE
+        return
+
+    completion = CompletionStream(prompt_template, query_vector, doc_keys, trace_id)
+    try:
+        for delta in _stream_completion(prompt_template):
+            yield completion.add(delta)
+    except Exception as e:
+        yield completion.fail(e)
+        return
+    finally:
+        completion.record()
+    completion.complete()
+
+def generate_llm_answer(user_question, found_contexts_list, stream=False):
+    """
+    Generates answer using RAG approach with AlemLLM.
+    Formats contexts and sends to LLM for synthesis.
+    If the contexts come from find_best_match_alem (RetrievalResult), near-duplicate
+    questions with the same contexts are answered from answer_cache.
+    With stream=True returns a generator of text chunks (for st.write_stream) instead of a string.
+    Concurrent identical questions over the same contexts share one completion (answer_flight).
+    """
+    query_vector = getattr(found_contexts_list, "query_vector", None)
+    doc_keys = getattr(found_contexts_list, "doc_keys", None)
+    use_cache = query_vector is not None and bool(doc_keys)
+
+    cached_answer = lookup_cached_answer(query_vector, doc_keys)
+    if cached_answer is not None:
+        return iter([cached_answer]) if stream else cached_answer
+
+    prompt_template = build_rag_prompt(user_question, found_contexts_list)
+
+    if stream:
+        trace_id = tracer.current_trace_id()
+        if use_cache:
+            # Every concurrent caller gets its own full copy of the shared stream
+            flight_key = (normalize_query(user_question), tuple(doc_keys))
+            return answer_flight.stream(
+                flight_key, lambda: _stream_llm_answer(prompt_template, query_vector, doc_keys, trace_id))
+        return _stream_llm_answer(prompt_template, query_vector, doc_keys, trace_id)
+
+    if use_cache:
+        flight_key = (normalize_query(user_question), tuple(doc_keys))
+        return answer_flight.do(flight_key, _complete_llm_answer, prompt_template, query_vector, doc_keys)
+    return _complete_llm_answer(prompt_template, query_vector, doc_keys)
+
+def _complete_llm_answer(prompt_template, query_vector, doc_keys):
+    """Non-streaming completion behind generate_llm_answer(); caches successful answers."""
+    start_time = time.perf_counter()
+    with tracer.span("llm", stream=False, prompt_chars=len(prompt_template)) as span:
+        answer, ok = _call_alem_api_checked(prompt_template)
+        span.set(answer_chars=len(answer), ok=ok)
+
+    # Only successful completions are cached
+    if ok and query_vector is not None and doc_keys:
+        answer_cache.store(query_vector, doc_keys, answer, time.perf_counter() - start_time)
+    return answer
+
+def build_clarification_message(topic):
+    """
+    Plan C: message asking the user to clarify a topic the search could not resolve.
+    """
+    return f"Я вижу, вас интересует тема: **'{topic}'**. \n\n" \
+           "Не могли бы вы уточнить, что именно вы хотите узнать?"
 
 def generate_fallback_answer(user_question):
     """
@@ -0,0 +1,138 @@
+import os
+import numpy as np
+
+from search_engine import normalize_rows, top_k_from_scores
+
+# IVF files stored next to vectors.npy in the index directory
+IVF_CENTROIDS_FILE = "ivf_centroids.npy"
+IVF_LIST_OFFSETS_FILE = "ivf_list_offsets.npy"
+IVF_LIST_IDS_FILE = "ivf_list_ids.npy"
+
+KMEANS_ITERATIONS = 20
+KMEANS_POINTS_PER_LIST = 256  # Training sample size per list; more brings little for k-means
+ASSIGN_CHUNK_SIZE = 65536  # Rows scored against centroids at once
+
+
+def default_n_lists(n_docs):
+    """Rule of thumb for the number of inverted lists: ~4*sqrt(N)."""
+    return max(1, int(4 * np.sqrt(n_docs)))
+
+
+def _assign(vectors, centroids):
+    """Nearest centroid (by inner product) for every row, computed in chunks to bound memory."""
+    assignments = np.empty(vectors.shape[0], dtype=np.int64)
+    for start in range(0, vectors.shape[0], ASSIGN_CHUNK_SIZE):
+        chunk = np.asarray(vectors[start:start + ASSIGN_CHUNK_SIZE], dtype=np.float32)
+        assignments[start:start + len(chunk)] = np.argmax(chunk @ centroids.T, axis=1)
+    return assignments
+
+
+def train_centroids(vectors, n_lists, iterations=KMEANS_ITERATIONS, seed=0):
+    """
+    Spherical k-means on a sample of L2-normalized vectors (the coarse quantizer).
+    Returns normalized centroids shaped (n_lists, dim).
+    """
+    rng = np.random.default_rng(seed)
+    n_docs = vectors.shape[0]
+    n_lists = min(n_lists, n_docs)
+    sample_size = min(n_docs, n_lists * KMEANS_POINTS_PER_LIST)
+    sample_ids = np.sort(rng.choice(n_docs, size=sample_size, replace=False))
+    sample = np.asarray(vectors[sample_ids], dtype=np.float32)
+
+    centroids = sample[rng.choice(sample_size, size=n_lists, replace=False)].copy()
+    for _ in range(iterations):
+        assignments = _assign(sample, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, sample)
+        counts = np.bincount(assignments, minlength=n_lists)
+        # Re-seed empty lists with random sample points
+        empty = counts == 0
+        if empty.any():
+            sums[empty] = sample[rng.choice(sample_size, size=int(empty.sum()), replace=False)]
+        centroids = normalize_rows(sums)
+    return centroids
+
+
+class IVFIndex:
+    """
+    Inverted-file ANN index over L2-normalized vectors.
+    A query is scored against the centroids first; only the `nprobe` closest lists are scanned
+    exactly. Larger nprobe means higher recall and higher latency.
+    """
+
+    def __init__(self, vectors, centroids, list_offsets, list_ids, nprobe=8):
+        self.vectors = vectors
+        self.centroids = np.asarray(centroids, dtype=np.float32)
+        self.list_offsets = list_offsets
+        self.list_ids = list_ids
+        self.nprobe = nprobe
+
+    @classmethod
+    def build(cls, vectors, n_lists=None, nprobe=8, seed=0):
+        """Trains the coarse quantizer and groups row ids by their nearest centroid."""
+        n_lists = n_lists or default_n_lists(vectors.shape[0])
+        centroids = train_centroids(vectors, n_lists, seed=seed)
+        assignments = _assign(vectors, centroids)
+        list_ids = np.argsort(assignments, kind='stable').astype(np.int64)
+        counts = np.bincount(assignments, minlength=len(centroids))
+        list_offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+        return cls(vectors, centroids, list_offsets, list_ids, nprobe=nprobe)
+
+    @property
+    def n_lists(self):
+        return len(self.centroids)
+
+    def __len__(self):
+        return self.vectors.shape[0]
+
+    def _candidates(self, query, nprobe):
+        probe_lists, _ = top_k_from_scores(self.centroids @ query, nprobe)
+        return np.concatenate([
+            self.list_ids[self.list_offsets[l]:self.list_offsets[l + 1]] for l in probe_lists[0]
+        ])
+
+    def search(self, query_vectors, k, nprobe=None):
+        """
+        Approximate top-k, same contract as ExactSearchIndex.search().
+        Accepts one query (dim,) or a matrix of queries (batch, dim).
+        The probed lists may hold fewer than k rows: a single query then gets fewer hits,
+        and a batch is cut to the shortest hit count so every returned id is a real row.
+        """
+        nprobe = min(nprobe or self.nprobe, self.n_lists)
+        queries = np.asarray(query_vectors, dtype=np.float32)
+        single = queries.ndim == 1
+        queries = normalize_rows(np.atleast_2d(queries))
+
+        hits = []
+        for query in queries:
+            candidates = np.sort(self._candidates(query, nprobe))
+            scores = np.asarray(self.vectors[candidates], dtype=np.float32) @ query
+            local, top_scores = top_k_from_scores(scores, k)
+            hits.append((candidates[local[0]], top_scores[0]))
+
+        if single:
+            return hits[0]
+        found = min((len(indices) for indices, _ in hits), default=min(k, len(self)))
+        return (np.array([indices[:found] for indices, _ in hits], dtype=np.int64).reshape(len(hits), found),
+                np.array([scores[:found] for _, scores in hits], dtype=np.float32).reshape(len(hits), found))
+
+    def arrays(self):
+        """Files to persist in the index directory, see vector_store.save_vector_store()."""
+        return {
+            IVF_CENTROIDS_FILE: self.centroids,
+            IVF_LIST_OFFSETS_FILE: self.list_offsets,
+            IVF_LIST_IDS_FILE: self.list_ids,
+        }
+
+
+def load_ivf_index(path, vectors, nprobe=8):
+    """Opens a persisted IVF index memory-mapped. Returns None if the index directory has none."""
+    if not os.path.exists(os.path.join(path, IVF_CENTROIDS_FILE)):
+        return None
+    return IVFIndex(
+        vectors,
+        np.load(os.path.join(path, IVF_CENTROIDS_FILE)),
+        np.load(os.path.join(path, IVF_LIST_OFFSETS_FILE), mmap_mode='r'),
+        np.load(os.path.join(path, IVF_LIST_IDS_FILE), mmap_mode='r'),
+        nprobe=nprobe,
+    )
@@ -0,0 +1,69 @@
+import time
+import threading
+import numpy as np
+
+from search_engine import normalize_rows
+
+
+class SemanticAnswerCache:
+    """
+    Cache of LLM answers indexed by query embedding.
+    A lookup hits when a cached question is at least `threshold` cosine-similar to the new one
+    AND was answered from the same reranked contexts. Contexts are compared by content key,
+    so editing or deleting any source FAQ row makes its old answers unreachable.
+    Stored in fixed slots; when full, the oldest entry is overwritten.
+    """
+
+    def __init__(self, threshold=0.95, max_size=2000, ttl_seconds=24 * 3600):
+        self.threshold = threshold
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._vectors = None  # (max_size, dim) float32, allocated on first store
+        self._entries = [None] * max_size  # (doc_keys, answer, created, generation_seconds)
+        self._next_slot = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+
+    def lookup(self, query_vector, doc_keys):
+        """Returns the cached answer or None."""
+        doc_keys = tuple(doc_keys)
+        now = time.time()
+        with self._lock:
+            if self._vectors is not None:
+                query = normalize_rows(np.atleast_2d(query_vector))[0]
+                scores = self._vectors @ query
+                above = np.flatnonzero(scores >= self.threshold)
+                for slot in above[np.argsort(-scores[above])]:
+                    entry = self._entries[slot]
+                    if entry is None or now - entry[2] >= self.ttl_seconds:
+                        continue
+                    if entry[0] == doc_keys:
+                        self.hits += 1
+                        self.saved_seconds += entry[3]
+                        return entry[1]
+            self.misses += 1
+            return None
+
+    def store(self, query_vector, doc_keys, answer, generation_seconds):
+        query = normalize_rows(np.atleast_2d(query_vector))[0]
+        with self._lock:
+            if self._vectors is None:
+                self._vectors = np.zeros((self.max_size, len(query)), dtype=np.float32)
+            slot = self._next_slot
+            self._vectors[slot] = query
+            self._entries[slot] = (tuple(doc_keys), answer, time.time(), generation_seconds)
+            self._next_slot = (slot + 1) % self.max_size
+
+    def stats(self):
+        """Hit rate and total LLM latency avoided by hits."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "saved_seconds": round(self.saved_seconds, 3),
+                "size": sum(1 for entry in self._entries if entry is not None),
+            }
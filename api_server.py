@@ -0,0 +1,231 @@
+import json
+import asyncio
+import itertools
+from contextlib import asynccontextmanager, contextmanager
+from typing import Optional
+
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+
+import async_pipeline
+from chatbot_logic_alem import load_precomputed_data, get_cache_stats
+from alem_llm_handler import build_clarification_message, answer_cache
+from http_client import upstream_stats
+from upstream_scheduler import scheduler_stats
+from tracing import tracer
+
+# Headless ASGI service for the RAG pipeline.
+# Stateless: the index is loaded once per worker process and no chat state is kept
+# on the server, so workers can be scaled out behind a load balancer.
+# The only per-conversation bookkeeping is the turn in flight (see conversation_turn()); it is
+# per worker, so a load balancer should route requests of one conversation_id to the same worker.
+#
+#   uvicorn api_server:app --host 0.0.0.0 --port 8000 --workers 4
+
+index = {}
+
+# conversation_id -> (turn number, task serving it) while a turn of the conversation is in flight
+active_turns = {}
+turn_numbers = itertools.count()
+
+
+@asynccontextmanager
+async def lifespan(app):
+    print("--- API: ЗАГРУЗКА ИНДЕКСА (ALEM) ---")
+    texts, vectors, data = await asyncio.to_thread(load_precomputed_data)
+    if texts is not None:
+        index.update(texts=texts, vectors=vectors, data=data)
+        print("--- API: ИНДЕКС ГОТОВ ---")
+    yield
+    await async_pipeline.close_async_client()
+    index.clear()
+
+
+app = FastAPI(title="AITU FAQ Bot API", lifespan=lifespan)
+
+
+class AskRequest(BaseModel):
+    question: str
+    # Plan C: topic returned as `pending_topic` by the previous answer, merged with this question
+    pending_topic: Optional[str] = None
+    stream: bool = False
+    # Client-chosen chat id: a new question cancels the conversation's previous turn still in flight
+    conversation_id: Optional[str] = None
+
+
+class SearchRequest(BaseModel):
+    query: str
+
+
+def _require_index():
+    if not index:
+        raise HTTPException(status_code=503, detail="Индекс не загружен")
+    return index["texts"], index["vectors"], index["data"]
+
+
+def _contexts_payload(contexts):
+    """JSON view of a RetrievalResult."""
+    return [
+        {
+            "id": doc_id,
+            "score": score,
+            "question": context.get("questions", ""),
+            "answer": context.get("answers", ""),
+        }
+        for doc_id, score, context in zip(contexts.doc_ids, contexts.scores, contexts)
+    ]
+
+
+class TurnSuperseded(Exception):
+    """The conversation got a newer question while this turn was in flight."""
+
+
+@contextmanager
+def conversation_turn(conversation_id, turn):
+    """
+    Serves `turn` (a number from turn_numbers) of a conversation in the current task, cancelling
+    the task of an older turn still in flight: a user who sends a new message stops waiting for
+    the old answer, and its own upstream calls are stopped (work shared with other requests
+    through single-flight keeps running). The cancelled turn raises TurnSuperseded.
+    """
+    if conversation_id is None:
+        yield
+        return
+    task = asyncio.current_task()
+    latest = active_turns.get(conversation_id)
+    if latest is not None and latest[0] > turn:
+        raise TurnSuperseded()
+    if latest is not None and latest[0] < turn:
+        print(f"API: новое сообщение в диалоге {conversation_id}, отменяю предыдущий ответ.")
+        latest[1].cancel()
+    active_turns[conversation_id] = (turn, task)
+    try:
+        yield
+    except asyncio.CancelledError:
+        newest = active_turns.get(conversation_id)
+        if newest is None or newest[0] <= turn:
+            raise  # Client disconnect or shutdown
+        task.uncancel()
+        raise TurnSuperseded() from None
+    finally:
+        if active_turns.get(conversation_id) == (turn, task):
+            del active_turns[conversation_id]
+
+
+def _sse(event):
+    return f"data: {json.dumps(event, ensure_ascii=False)}\n\n"
+
+
+@app.get("/healthz")
+async def healthz():
+    """Liveness: the process is up."""
+    return {"status": "ok"}
+
+
+@app.get("/readyz")
+async def readyz():
+    """Readiness: the index is loaded and requests can be served."""
+    if not index:
+        raise HTTPException(status_code=503, detail="Индекс не загружен")
+    return {"status": "ready", "documents": len(index["texts"])}
+
+
+@app.get("/stats")
+async def stats():
+    """
+    Cache and single-flight counters, upstream latency, hedging and circuit breaker state,
+    and scheduler admission counters.
+    """
+    return {
+        "retrieval": get_cache_stats(),
+        "answers": answer_cache.stats(),
+        "upstreams": upstream_stats(),
+        "schedulers": scheduler_stats(),
+    }
+
+
+@app.get("/metrics")
+async def metrics():
+    """Latency histograms per pipeline stage (p50/p95/p99 in ms, see tracing.py)."""
+    return tracer.metrics()
+
+
+@app.post("/search")
+async def search(request: SearchRequest):
+    """Retrieval only: embed -> coarse search -> rerank."""
+    texts, vectors, data = _require_index()
+    contexts = await async_pipeline.retrieve(request.query, texts, vectors, data)
+    return {
+        "query": request.query,
+        "served_by": contexts.served_by if contexts else None,
+        "degraded": contexts.degraded if contexts else None,
+        "results": _contexts_payload(contexts) if contexts else [],
+    }
+
+
+@app.post("/ask")
+async def ask(request: AskRequest):
+    """
+    Full RAG turn. JSON by default; with "stream": true the answer is sent as SSE events
+    {"delta": ...}, followed by a final {"done": true, ...} event.
+    With a `conversation_id`, a newer question of the same conversation cancels this turn:
+    409 for a JSON answer, a final {"done": true, "superseded": true} event for a streamed one.
+    """
+    texts, vectors, data = _require_index()
+    turn_number = next(turn_numbers)
+
+    # Plan C: combine clarification with the pending topic, as app.py does
+    if request.pending_topic:
+        final_question = f"{request.question} {request.pending_topic}"
+    else:
+        final_question = request.question
+
+    try:
+        return await _ask_turn(request, final_question, turn_number, texts, vectors, data)
+    except TurnSuperseded:
+        raise HTTPException(status_code=409, detail="Вопрос заменен новым сообщением")
+
+
+async def _ask_turn(request, final_question, turn_number, texts, vectors, data):
+    # "turn" covers retrieval and, for JSON answers, generation; a streamed answer is
+    # traced as "answer_stream" in the same trace
+    with conversation_turn(request.conversation_id, turn_number), \
+            tracer.span("turn", source="api", stream=request.stream) as turn:
+        contexts = await async_pipeline.retrieve(final_question, texts, vectors, data)
+
+        if not contexts:
+            # Plan C: Disambiguation - the client sends the topic back with the next question
+            turn.set(plan="C")
+            clarification = {
+                "found": False,
+                "answer": build_clarification_message(request.question),
+                "pending_topic": request.question,
+                "contexts": [],
+            }
+            if request.stream:
+                return StreamingResponse(iter([_sse({"done": True, **clarification})]),
+                                         media_type="text/event-stream")
+            return clarification
+
+        turn.set(plan="A", served_by=contexts.served_by)
+        if request.stream:
+            async def event_stream():
+                # The response is sent from another task: the turn continues there
+                try:
+                    with conversation_turn(request.conversation_id, turn_number), \
+                            tracer.span("answer_stream", trace_id=turn.trace_id):
+                        async for delta in async_pipeline.generate_stream(request.question, contexts):
+                            yield _sse({"delta": delta})
+                except TurnSuperseded:
+                    yield _sse({"done": True, "superseded": True})
+                    return
+                yield _sse({"done": True, "found": True, "served_by": contexts.served_by, "degraded": contexts.degraded,
+                            "contexts": _contexts_payload(contexts)})
+
+            return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+        answer = await async_pipeline.generate(request.question, contexts)
+        return {"found": True, "answer": answer, "pending_topic": None, "served_by": contexts.served_by,
+                "degraded": contexts.degraded,
+                "contexts": _contexts_payload(contexts)}
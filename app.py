@@ -1,6 +1,7 @@
 import streamlit as st
-from alem_llm_handler import generate_llm_answer
-from chatbot_logic_alem import load_precomputed_data, find_best_match_alem
+from alem_llm_handler import generate_llm_answer, build_clarification_message
+from chatbot_logic_alem import load_precomputed_data, find_best_match_alem, SERVED_BY_ALEM, DEGRADED_TIMEOUT
+from tracing import tracer
 
 # Cache models to prevent reloading on every interaction
 @st.cache_resource
@@ -13,7 +14,7 @@ def load_all_models():
     texts, vectors, data = load_precomputed_data()
     
     if texts is None:
-        st.error("Ошибка: не удалось загрузить файл alem_embeddings.pkl!")
+        st.error("Ошибка: не удалось загрузить индекс alem_index! Запустите generate_embeddings.py")
         return None, None, None
     
     print("--- МОДЕЛИ ГОТОВЫ (ALEM) ---")
@@ -57,34 +58,39 @@ if prompt := st.chat_input("Спросите что-нибудь о AITU..."):
 
     # Note: Query expansion removed - Reranker handles relevance ranking
     
-    # Plan A: Run Alem search pipeline
-    print(f"Alem-Пайплайн: Ищу по запросу: '{final_prompt}'")
-    
-    found_contexts_list = find_best_match_alem(
-        final_prompt, 
-        precomputed_texts, 
-        precomputed_vectors, 
-        faq_data
-    )
-    
-    # Generate response (Plan A: RAG or Plan C: Disambiguation)
-    with st.chat_message("assistant"):
+    # Generate response (Plan A: RAG or Plan C: Disambiguation), traced as one "turn" span
+    with st.chat_message("assistant"), tracer.span("turn", source="streamlit") as turn_span:
         with st.spinner("Думаю (Alem.ai)..."):
+            # Plan A: Run Alem search pipeline
+            print(f"Alem-Пайплайн: Ищу по запросу: '{final_prompt}'")
+            
+            found_contexts_list = find_best_match_alem(
+                final_prompt, 
+                precomputed_texts, 
+                precomputed_vectors, 
+                faq_data
+            )
+            
+        if found_contexts_list:
+            # Plan A: RAG - use original prompt for LLM, stream tokens as they arrive
+            print(f"ПЛАН А: Alem-Поиск нашел {len(found_contexts_list)} контекста "
+                  f"(served_by={found_contexts_list.served_by}). Запускаю RAG.")
+            turn_span.set(plan="A", served_by=found_contexts_list.served_by)
+            if found_contexts_list.served_by != SERVED_BY_ALEM:
+                if found_contexts_list.degraded == DEGRADED_TIMEOUT:
+                    st.caption("Поиск Alem отвечает медленно, контекст подобран упрощенным поиском.")
+                else:
+                    st.caption("Поиск Alem недоступен, контекст подобран упрощенным поиском.")
+            llm_answer = st.write_stream(generate_llm_answer(prompt, found_contexts_list, stream=True))
             
-            if found_contexts_list:
-                # Plan A: RAG - use original prompt for LLM
-                print(f"ПЛАН А: Alem-Поиск нашел {len(found_contexts_list)} контекста. Запускаю RAG.")
-                llm_answer = generate_llm_answer(prompt, found_contexts_list)
-                st.markdown(llm_answer)
-                
-            else:
-                # Plan C: Disambiguation - ask for clarification
-                print("ПЛАН C: Alem-Поиск не нашел. Запрашиваю уточнение.")
-                response_text = f"Я вижу, вас интересует тема: **'{prompt}'**. \n\n" \
-                                "Не могли бы вы уточнить, что именно вы хотите узнать?"
-                st.markdown(response_text)
-                # Store topic in memory for next interaction
-                st.session_state.pending_topic = prompt
+        else:
+            # Plan C: Disambiguation - ask for clarification
+            print("ПЛАН C: Alem-Поиск не нашел. Запрашиваю уточнение.")
+            turn_span.set(plan="C")
+            response_text = build_clarification_message(prompt)
+            st.markdown(response_text)
+            # Store topic in memory for next interaction
+            st.session_state.pending_topic = prompt
 
     # Save assistant response to chat history
     if 'llm_answer' in locals():
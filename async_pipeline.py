@@ -0,0 +1,258 @@
+import time
+import asyncio
+import httpx
+
+import chatbot_logic_alem as logic
+import alem_llm_handler as llm
+from http_client import ENDPOINTS, POOL_MAXSIZE, health, hedged_send_steps, post_json_steps
+from upstream_scheduler import INTERACTIVE, schedulers
+from tracing import tracer
+from embedding_cache import normalize_query
+from single_flight import SingleFlight
+from stages import run_stage_async
+
+# Async version of the RAG pipeline (embed -> coarse search -> rerank -> generate).
+# The stage logic (caches, deadlines and fallbacks, retry/hedging policy, error mapping) is the
+# shared stage code of the sync modules (see stages.py), so both paths return identical results;
+# only the network I/O is awaited instead of blocking a thread.
+# A cancelled caller (client disconnect, or a newer message in the same conversation, see
+# api_server.py) releases its scheduler slots and stops its own hedged and streamed requests.
+# Upstream calls shared through single-flight keep running and fill the caches for the next
+# identical request.
+
+_client = None
+
+# Concurrent identical requests share one retrieval run / one LLM stream
+retrieval_flight = SingleFlight()
+answer_flight = SingleFlight()
+
+
+def get_async_client():
+    """
+    Process-wide httpx.AsyncClient with keep-alive pools per host.
+    Must be used from a single event loop (the one of the server worker).
+    """
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=POOL_MAXSIZE * 4, max_keepalive_connections=POOL_MAXSIZE),
+        )
+    return _client
+
+
+async def close_async_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def _timeout(endpoint):
+    config = ENDPOINTS[endpoint]
+    return httpx.Timeout(config["read_timeout"], connect=config["connect_timeout"])
+
+
+async def _send(endpoint, url, payload, headers, stream=False):
+    """
+    One timed HTTP attempt, recorded in http_client.health like the sync path.
+    A streamed response is returned once its headers arrive; the caller must aclose() it.
+    """
+    client = get_async_client()
+    start = time.perf_counter()
+    try:
+        request = client.build_request("POST", url, json=payload, headers=headers, timeout=_timeout(endpoint))
+        response = await client.send(request, stream=stream)
+    except httpx.TransportError:
+        health[endpoint].record_error()
+        raise
+    health[endpoint].record(response.status_code, time.perf_counter() - start)
+    return response
+
+
+def _release_on_aclose(response, permit):
+    """Keeps a streamed response's scheduler slot until the caller closes the response."""
+    aclose = response.aclose
+
+    async def aclose_and_release():
+        try:
+            await aclose()
+        finally:
+            permit.release()
+
+    response.aclose = aclose_and_release
+
+
+async def post_json(endpoint, url, payload, headers, stream=False, priority=INTERACTIVE, token_cost=0):
+    """
+    Async counterpart of http_client.post_json(), driving the same http_client.post_json_steps()
+    and hedged_send_steps(): same per-endpoint timeouts, retry and hedging policy, and the same
+    circuit breakers and upstream schedulers.
+    Returns the httpx response (a streamed one holds its scheduler slot until aclose());
+    raises httpx exceptions once retries are exhausted
+    (http_client.CircuitOpenError while the breaker is open, SchedulerBusyError when saturated).
+    """
+    scheduler = schedulers[ENDPOINTS[endpoint]["upstream"]]
+
+    async def wait(tasks, seconds):
+        return await asyncio.wait(tasks, timeout=seconds, return_when=asyncio.FIRST_COMPLETED)
+
+    def send(hedge):
+        if not hedge:
+            return _send(endpoint, url, payload, headers, stream)
+        # The losing attempt is cancelled
+        return run_stage_async(hedged_send_steps(health[endpoint], scheduler, priority, token_cost), {
+            "send": lambda: _send(endpoint, url, payload, headers),
+            "start": lambda: asyncio.ensure_future(_send(endpoint, url, payload, headers)),
+            "wait": wait,
+            "discard": lambda task: task.cancel(),
+        })
+
+    return await run_stage_async(post_json_steps(endpoint, stream, transport_errors=(httpx.TransportError,)), {
+        "acquire": lambda: scheduler.acquire_async(priority, token_cost),
+        "send": send,
+        "hold": _release_on_aclose,
+        "close": lambda response: response.aclose(),
+        "sleep": asyncio.sleep,
+    })
+
+
+async def _embed_query(text):
+    if logic.QUERY_BATCHING:
+        return await logic.query_embedder.embed_async(text)
+    response = await post_json("embed", logic.EMBEDDER_URL, logic.embed_payload([text]), logic.EMBEDDER_HEADERS)
+    return logic.parse_embeddings(response.json())[0]
+
+
+async def _request_rerank(query, documents_list):
+    response = await post_json("rerank", logic.RERANKER_URL, logic.rerank_payload(query, documents_list),
+                               logic.RERANKER_HEADERS)
+    return response.json().get("results", [])
+
+
+async def embed(text):
+    """
+    Awaitable query embedding (chatbot_logic_alem.embed_query_steps()); shares query_embedding_cache
+    and the micro-batcher with the sync path, so concurrent API requests are merged into one embedder call.
+    """
+    return await run_stage_async(logic.embed_query_steps(text), {"embed": _embed_query})
+
+
+async def rerank(query, candidate_ids, candidate_texts):
+    """
+    Awaitable reranking of candidates (chatbot_logic_alem.rerank_steps()); shares rerank_cache
+    with the sync path. Returns like rerank_candidates(): [] when nothing is relevant, None when the call failed.
+    """
+    return await run_stage_async(logic.rerank_steps(query, candidate_ids, candidate_texts),
+                                 {"rerank": _request_rerank})
+
+
+async def retrieve(query, precomputed_texts, precomputed_vectors, original_data):
+    """
+    Async find_best_match_alem(). Concurrent calls with the same normalized query share
+    one run. Returns RetrievalResult or None.
+    """
+    with tracer.span("retrieve") as span:
+        result = await retrieval_flight.do_async(
+            normalize_query(query),
+            lambda: _retrieve(query, precomputed_texts, precomputed_vectors, original_data),
+        )
+        span.set(found=bool(result), served_by=getattr(result, "served_by", None),
+                 rerank_branch=getattr(result, "rerank_branch", None))
+        return result
+
+
+async def _before_deadline(deadline, coro):
+    """
+    Async call_before_deadline(): (result, True), or (None, False) once the time.monotonic()
+    `deadline` passes. Shielded: a call that misses the deadline keeps running and still fills the caches.
+    """
+    try:
+        return await asyncio.wait_for(asyncio.shield(coro), max(0.0, deadline - time.monotonic())), True
+    except asyncio.TimeoutError:
+        return None, False
+
+
+async def _retrieve(query, precomputed_texts, precomputed_vectors, original_data):
+    """
+    Single retrieval run (chatbot_logic_alem.retrieval_steps()). Coarse search runs in a worker
+    thread so large corpora do not stall the event loop.
+    """
+    return await run_stage_async(
+        logic.retrieval_steps(query, precomputed_texts, precomputed_vectors, original_data), {
+            "embed": lambda text, deadline: _before_deadline(deadline, embed(text)),
+            "rerank": lambda text, ids, texts, deadline: _before_deadline(deadline, rerank(text, ids, texts)),
+            "local": asyncio.to_thread,
+        })
+
+
+def generate_stream(user_question, found_contexts_list):
+    """
+    Async iterator of answer chunks (async generate_llm_answer(stream=True)).
+    Concurrent identical questions over the same contexts share one upstream stream;
+    every caller receives all chunks.
+    """
+    doc_keys = getattr(found_contexts_list, "doc_keys", None)
+    if not doc_keys:
+        return _generate_stream(user_question, found_contexts_list)
+    return answer_flight.stream_async(
+        (normalize_query(user_question), tuple(doc_keys)),
+        lambda: _generate_stream(user_question, found_contexts_list),
+    )
+
+
+async def _generate_stream(user_question, found_contexts_list):
+    """
+    Single LLM stream. Uses the same semantic answer cache, spans and error messages
+    as the sync path (alem_llm_handler.CompletionStream).
+    """
+    query_vector = getattr(found_contexts_list, "query_vector", None)
+    doc_keys = getattr(found_contexts_list, "doc_keys", None)
+
+    cached_answer = llm.lookup_cached_answer(query_vector, doc_keys)
+    if cached_answer is not None:
+        yield cached_answer
+        return
+    if not llm.ALEM_API_KEY:
+        yield llm.MISSING_KEY_MESSAGE
+        return
+
+    prompt_template = llm.build_rag_prompt(user_question, found_contexts_list)
+    payload = llm._completion_payload(prompt_template, stream=True)
+    completion = llm.CompletionStream(prompt_template, query_vector, doc_keys, tracer.current_trace_id())
+    try:
+        # Same breaker, endpoint health and scheduler slot as every other upstream call
+        response = await post_json("llm", llm.ALEM_LLM_URL, payload, llm.HEADERS, stream=True)
+        try:
+            async for line in response.aiter_lines():
+                delta = llm._parse_sse_line(line)
+                if delta is None:
+                    break
+                if delta:
+                    yield completion.add(delta)
+        finally:
+            await response.aclose()
+    except Exception as e:
+        yield completion.fail(e)
+        return
+    finally:
+        completion.record()
+    completion.complete()
+
+
+async def generate(user_question, found_contexts_list):
+    """Awaitable full answer (async generate_llm_answer())."""
+    chunks = []
+    async for delta in generate_stream(user_question, found_contexts_list):
+        chunks.append(delta)
+    return "".join(chunks)
+
+
+async def answer(query, precomputed_texts, precomputed_vectors, original_data, user_question=None):
+    """
+    Full async turn: retrieve, then generate. Returns (contexts, answer); contexts is None
+    when nothing was found (the caller decides on the Plan C clarification).
+    """
+    contexts = await retrieve(query, precomputed_texts, precomputed_vectors, original_data)
+    if not contexts:
+        return None, None
+    return contexts, await generate(user_question or query, contexts)
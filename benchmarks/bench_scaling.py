@@ -0,0 +1,330 @@
+"""
+Retrieval scaling benchmark on synthetic corpora.
+Generates clustered 1024-d corpora (1k/10k/100k/1M rows by default) as real index directories
+(save_vector_store with int8/float16 copies, BM25 and IVF, as generate_embeddings.py writes them),
+then measures every storage and search mode in a fresh process:
+    legacy   - float64 matrix in RAM, sklearn cosine_similarity + full argsort (the old path)
+    float32  - exact search on the memory-mapped store
+    int8     - int8 first pass, float32 rescoring
+    float16  - float16 first pass, float32 rescoring
+    ivf      - IVF approximate search (nprobe = IVF_NPROBE)
+    hybrid   - float32 exact + BM25 fused with RRF (what find_best_match_alem runs by default)
+Reported per mode: load time (load_vector_store + open_search_index, warm page cache),
+resident memory added by the index (anonymous = private to the process; file = mapped index
+pages, shared by all workers through the page cache; kernels that map large page-cache folios
+count whole neighbourhoods of a touched row here), first-query and p50/p95 single-query latency of the coarse
+search step, batched throughput and recall@k against float32 exact search.
+
+Generation is chunked and memory-mapped; the 1M corpus needs ~15 GB of disk and its IVF training
+takes a while (pass --ivf-lists to shrink it). The legacy mode is skipped when its float64 copy
+would not fit in the available memory.
+
+Usage (from the repository root):
+    python -m benchmarks.bench_scaling --sizes 1000 10000 100000
+    python -m benchmarks.bench_scaling --sizes 1000000 --modes float32 int8 ivf --workdir /data/bench_corpora
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+import numpy as np
+from numpy.lib.format import open_memmap
+
+from search_engine import normalize_rows
+from vector_store import save_vector_store, load_vector_store, content_key, VECTORS_FILE
+from quantization import INT8_CODES_FILE, INT8_SCALE_FILE, FLOAT16_FILE, STORAGE_MODES
+from bm25_index import BM25Index, TOKENIZER_VERSION
+from ann_index import IVFIndex
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODES = ("legacy", "float32", "int8", "float16", "ivf", "hybrid")
+MODEL = "synthetic-1024"
+DIM = 1024
+CHUNK_ROWS = 65536  # Rows generated and quantized at once
+DOCS_PER_CLUSTER = 50
+MAX_CLUSTERS = 20000
+VOCABULARY_SIZE = 20000
+LETTERS = "абвгдежзиклмнопрстуфхцчшэюя"
+
+
+def rss_mb():
+    """
+    Current resident memory as (anonymous MB, file-backed MB). Anonymous memory is private to the
+    process; file-backed pages are the memory-mapped index, shared through the page cache by all
+    workers and reclaimable. Without /proc, the peak RSS is reported as anonymous.
+    """
+    fields = {}
+    try:
+        with open("/proc/self/status", encoding="ascii") as f:
+            for line in f:
+                if line.startswith(("RssAnon:", "RssFile:")):
+                    fields[line.split(":")[0]] = int(line.split()[1]) / 1024
+        return fields["RssAnon"], fields["RssFile"]
+    except (OSError, KeyError):
+        pass
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return (peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024), 0.0
+
+
+def available_memory_bytes():
+    try:
+        with open("/proc/meminfo", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def synthetic_texts(n_docs, n_words, rng):
+    """Letters-only pseudo-words with a Zipf-like frequency, so BM25 sees realistic postings."""
+    vocabulary = ["".join(rng.choice(list(LETTERS), size=rng.integers(3, 10))) for _ in range(VOCABULARY_SIZE)]
+    texts = []
+    for start in range(0, n_docs, CHUNK_ROWS):
+        words = (rng.zipf(1.3, size=(min(CHUNK_ROWS, n_docs - start), n_words)) - 1) % VOCABULARY_SIZE
+        texts.extend(" ".join(vocabulary[w] for w in row) for row in words)
+    return texts
+
+
+def generate_corpus(path, n_docs, dim, n_words, ivf_lists, seed=0):
+    """
+    Writes a synthetic index directory of `n_docs` clustered unit vectors with the same
+    side files generate_embeddings.py builds. Vectors never have to fit in memory at once.
+    """
+    rng = np.random.default_rng(seed)
+    scratch = path.rstrip("/\\") + ".src"
+    os.makedirs(scratch, exist_ok=True)
+
+    # Clustered like benchmarks/quantization_report.py: closer to real embeddings than noise
+    centers = rng.standard_normal((max(1, min(n_docs // DOCS_PER_CLUSTER, MAX_CLUSTERS)), dim)).astype(np.float32)
+    vectors = open_memmap(os.path.join(scratch, "vectors.npy"), mode="w+", dtype=np.float32, shape=(n_docs, dim))
+    max_abs = np.zeros(dim, dtype=np.float32)
+    for start in range(0, n_docs, CHUNK_ROWS):
+        rows = min(CHUNK_ROWS, n_docs - start)
+        chunk = centers[rng.integers(0, len(centers), rows)] + 0.6 * rng.standard_normal((rows, dim), dtype=np.float32)
+        vectors[start:start + rows] = chunk = normalize_rows(chunk)
+        max_abs = np.maximum(max_abs, np.abs(chunk).max(axis=0))
+
+    # Same codes as quantization.quantized_arrays(), computed chunk by chunk
+    scale = max_abs / 127.0
+    scale[scale == 0] = 1.0
+    codes = open_memmap(os.path.join(scratch, "int8.npy"), mode="w+", dtype=np.int8, shape=(n_docs, dim))
+    halves = open_memmap(os.path.join(scratch, "f16.npy"), mode="w+", dtype=np.float16, shape=(n_docs, dim))
+    for start in range(0, n_docs, CHUNK_ROWS):
+        chunk = np.asarray(vectors[start:start + CHUNK_ROWS])
+        codes[start:start + len(chunk)] = np.clip(np.rint(chunk / scale), -127, 127)
+        halves[start:start + len(chunk)] = chunk
+    extra_arrays = {INT8_CODES_FILE: codes, INT8_SCALE_FILE: scale.astype(np.float32), FLOAT16_FILE: halves}
+    # Rows are unit length already; normalize=False avoids a full in-memory copy
+    extra_header = {"quantized": list(STORAGE_MODES), "normalized": True}
+
+    texts = synthetic_texts(n_docs, n_words, rng)
+    extra_arrays.update(BM25Index.build(texts).arrays())
+    extra_header["bm25_tokenizer"] = TOKENIZER_VERSION
+    ivf_index = IVFIndex.build(vectors, n_lists=ivf_lists)
+    extra_arrays.update(ivf_index.arrays())
+    extra_header["ann"] = {"type": "ivf", "n_lists": ivf_index.n_lists}
+
+    keys = [content_key(text, MODEL) for text in texts]
+    rows = [{"questions": text, "answers": "", "classes": ""} for text in texts]
+    save_vector_store(path, MODEL, keys, texts, vectors, rows, normalize=False,
+                      extra_arrays=extra_arrays, extra_header=extra_header)
+    del vectors, codes, halves
+    shutil.rmtree(scratch)
+
+
+def read_rows(path, ids):
+    """Rows of an .npy matrix read with plain file reads, so the benchmark's own query setup
+    does not map index pages into the measured process."""
+    with open(path, "rb") as f:
+        read_header = {(1, 0): np.lib.format.read_array_header_1_0}.get(
+            np.lib.format.read_magic(f), np.lib.format.read_array_header_2_0)
+        shape, _, dtype = read_header(f)
+        offset, row_bytes = f.tell(), shape[1] * np.dtype(dtype).itemsize
+        rows = []
+        for i in ids:
+            f.seek(offset + int(i) * row_bytes)
+            rows.append(np.frombuffer(f.read(row_bytes), dtype=dtype))
+    return np.stack(rows).astype(np.float32)
+
+
+def make_queries(store, n_queries, seed):
+    """Noisy copies of random corpus rows, with a few of their words as the query text."""
+    rng = np.random.default_rng(seed + 1)
+    ids = np.sort(rng.choice(len(store), size=min(n_queries, len(store)), replace=False))
+    vectors = read_rows(os.path.join(store.path, VECTORS_FILE), ids)
+    vectors = normalize_rows(vectors + 0.02 * rng.standard_normal(vectors.shape, dtype=np.float32))
+    texts = [" ".join(store.texts[int(i)].split()[:4]) for i in ids]
+    return texts, vectors
+
+
+def measure(path, mode, n_queries, k, batch_size, seed):
+    """Runs in a fresh process (see main): loads one mode, times it and prints a RESULT line."""
+    for key in ("EMBED_API_KEY", "RERANK_API_KEY"):
+        os.environ.setdefault(key, "offline-benchmark")
+    import chatbot_logic_alem as logic
+    from tracing import tracer
+    from benchmarks.bench_search import legacy_search
+    tracer.path = None
+
+    anon_before, file_before = rss_mb()
+    start = time.perf_counter()
+    store = load_vector_store(path)
+    if mode == "legacy":
+        matrix = np.array(store.vectors, dtype=np.float64)  # The pickle was loaded fully into RAM
+
+        def search(text, vector):
+            return legacy_search(vector, matrix, k)
+
+        def batch_search(texts, vectors):
+            return [legacy_search(vector, matrix, k) for vector in vectors]
+    else:
+        logic.SEARCH_BACKEND = "ivf" if mode == "ivf" else "exact"
+        logic.VECTOR_STORAGE = mode if mode in STORAGE_MODES else "float32"
+        logic.HYBRID_SEARCH = mode == "hybrid"
+        index = logic.open_search_index(store)
+
+        def search(text, vector):
+            return logic.coarse_search(text, vector, index, top_k=k)[0]
+
+        def batch_search(texts, vectors):
+            if mode == "hybrid":  # BM25 has no batched form: one fused search per query
+                return [search(text, vector) for text, vector in zip(texts, vectors)]
+            return index.search(vectors, k)[0]
+    load_ms = (time.perf_counter() - start) * 1000
+
+    texts, vectors = make_queries(store, n_queries, seed)
+    start = time.perf_counter()
+    found = [search(texts[0], vectors[0])]
+    first_ms = (time.perf_counter() - start) * 1000
+    latencies = []
+    for text, vector in zip(texts[1:], vectors[1:]):
+        start = time.perf_counter()
+        found.append(search(text, vector))
+        latencies.append((time.perf_counter() - start) * 1000)
+    latencies.sort()
+
+    batch = vectors[:batch_size]
+    start = time.perf_counter()
+    batch_search(texts[:batch_size], batch)
+    batch_qps = len(batch) / (time.perf_counter() - start)
+
+    print("RESULT " + json.dumps({
+        "mode": mode,
+        "load_ms": load_ms,
+        "anon_mb": rss_mb()[0] - anon_before,
+        "file_mb": rss_mb()[1] - file_before,
+        "first_query_ms": first_ms,
+        "p50_ms": latencies[len(latencies) // 2] if latencies else first_ms,
+        "p95_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] if latencies else first_ms,
+        "batch_qps": batch_qps,
+        "ids": [[int(i) for i in ids] for ids in found],
+    }))
+
+
+def run_mode(path, workdir, mode, args):
+    """Measures one mode in a child process, so load time and memory are not shared between modes."""
+    command = [sys.executable, "-m", "benchmarks.bench_scaling", "--measure", path, "--mode", mode,
+               "--queries", str(args.queries), "--k", str(args.k), "--batch", str(args.batch),
+               "--seed", str(args.seed)]
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [ROOT, os.environ.get("PYTHONPATH")])))
+    # The pipeline writes its caches to the working directory: keep them out of the repository
+    completed = subprocess.run(command, cwd=workdir, env=env, capture_output=True, text=True)
+    for line in completed.stdout.splitlines():
+        if line.startswith("RESULT "):
+            return json.loads(line[len("RESULT "):])
+    print(f"  {mode}: ошибка (код {completed.returncode})\n{completed.stderr[-2000:]}")
+    return None
+
+
+def recall_at_k(found, reference):
+    return float(np.mean([len(set(f) & set(r)) / max(1, len(r)) for f, r in zip(found, reference)]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000, 1000000])
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES))
+    parser.add_argument("--dim", type=int, default=DIM)
+    parser.add_argument("--k", type=int, default=20, help="Candidates per query (TOP_K_RETRIEVAL)")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--batch", type=int, default=64, help="Queries per batched search call")
+    parser.add_argument("--words", type=int, default=12, help="Words per synthetic document (BM25)")
+    parser.add_argument("--ivf-lists", type=int, help="IVF lists (default ~4*sqrt(N), as generate_embeddings.py)")
+    parser.add_argument("--budget-ms", type=float, default=50.0, help="Acceptable p95 of the coarse search step")
+    parser.add_argument("--workdir", help="Where corpora are generated and kept for reuse (default: temporary)")
+    parser.add_argument("--json", help="Write all measurements to this file")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--measure", help=argparse.SUPPRESS)
+    parser.add_argument("--mode", choices=MODES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        measure(args.measure, args.mode, args.queries, args.k, args.batch, args.seed)
+        return
+
+    workdir = os.path.abspath(args.workdir or tempfile.mkdtemp(prefix="aitu-scaling-"))
+    os.makedirs(workdir, exist_ok=True)
+    results = []
+    for n_docs in sorted(args.sizes):
+        path = os.path.join(workdir, f"corpus_{n_docs}_{args.dim}")
+        store = load_vector_store(path)
+        if store is None or len(store) != n_docs:
+            print(f"\nГенерирую корпус {n_docs} x {args.dim} в {path}...")
+            start = time.perf_counter()
+            generate_corpus(path, n_docs, args.dim, args.words, args.ivf_lists, seed=args.seed)
+            print(f"Готово за {time.perf_counter() - start:.1f} с.")
+
+        print(f"\nN = {n_docs}")
+        print(f"{'mode':>8} | {'load ms':>8} | {'anon MB':>8} | {'file MB':>8} | {'1st ms':>8} | {'p50 ms':>8} | "
+              f"{'p95 ms':>8} | {'batch q/s':>9} | {'recall@k':>8}")
+        reference = None
+        measured = {}
+        for mode in sorted(args.modes, key=lambda m: m != "float32"):  # float32 first: recall reference
+            available = available_memory_bytes()
+            if mode == "legacy" and available is not None and n_docs * args.dim * 8 * 2 > available:
+                print(f"{mode:>8} | пропущен: копия float64 ({n_docs * args.dim * 8 / 2 ** 30:.1f} GB) "
+                      f"не помещается в память")
+                continue
+            result = run_mode(path, workdir, mode, args)
+            if result is None:
+                continue
+            ids = result.pop("ids")
+            if mode == "float32":
+                reference = ids
+            # Hybrid ranks by fused cosine + BM25 on purpose: recall against cosine is not meaningful
+            result["recall"] = recall_at_k(ids, reference) if reference is not None and mode != "hybrid" else None
+            result["n_docs"] = n_docs
+            measured[mode] = result
+            recall_cell = "-" if result["recall"] is None else f"{result['recall']:.3f}"
+            print(f"{mode:>8} | {result['load_ms']:>8.1f} | {result['anon_mb']:>8.1f} | {result['file_mb']:>8.1f} | "
+                  f"{result['first_query_ms']:>8.2f} | {result['p50_ms']:>8.3f} | {result['p95_ms']:>8.3f} | "
+                  f"{result['batch_qps']:>9.0f} | {recall_cell:>8}")
+        results.extend(measured[mode] for mode in args.modes if mode in measured)
+
+    print(f"\nНаибольший N, при котором p95 coarse search <= {args.budget_ms:.0f} мс:")
+    for mode in args.modes:
+        rows = [row for row in results if row["mode"] == mode]
+        within = [row["n_docs"] for row in rows if row["p95_ms"] <= args.budget_ms]
+        over = [row["n_docs"] for row in rows if row["p95_ms"] > args.budget_ms]
+        verdict = f"{max(within)}" if within else "ни при одном"
+        if over:
+            verdict += f" (превышен при {min(over)})"
+        print(f"  {mode:>8}: {verdict}" if rows else f"  {mode:>8}: не измерен")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"Сохранено в {args.json}")
+    if not args.workdir:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
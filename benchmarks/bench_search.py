@@ -0,0 +1,70 @@
+"""
+Micro-benchmark of the coarse search step.
+Compares the old sklearn cosine_similarity + full argsort path with ExactSearchIndex
+on random corpora of growing size.
+
+Usage (from the repository root):
+    python -m benchmarks.bench_search --sizes 1000 10000 100000 --k 20
+"""
+import argparse
+import time
+import numpy as np
+from sklearn.metrics.pairwise import cosine_similarity
+
+from search_engine import ExactSearchIndex
+
+DIM = 1024
+
+
+def legacy_search(query_vector, vectors, k):
+    scores = cosine_similarity(query_vector.reshape(1, -1), vectors)
+    return np.argsort(scores[0])[-k:][::-1]
+
+
+def time_per_query(fn, queries, repeats):
+    start = time.perf_counter()
+    for _ in range(repeats):
+        for q in queries:
+            fn(q)
+    return (time.perf_counter() - start) / (repeats * len(queries)) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--k", type=int, default=20)
+    parser.add_argument("--queries", type=int, default=20)
+    parser.add_argument("--batch", type=int, default=64)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--skip-legacy", action="store_true", help="Do not time the sklearn + argsort path")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    queries = rng.standard_normal((args.queries, DIM)).astype(np.float32)
+    batch = rng.standard_normal((args.batch, DIM)).astype(np.float32)
+
+    print(f"{'N':>9} | {'legacy ms/q':>11} | {'exact ms/q':>10} | {'batched ms/q':>12} | {'speedup':>7}")
+    for n in args.sizes:
+        corpus = rng.standard_normal((n, DIM)).astype(np.float32)
+        index = ExactSearchIndex(corpus)
+
+        exact_ms = time_per_query(lambda q: index.search(q, args.k), queries, args.repeats)
+
+        start = time.perf_counter()
+        for _ in range(args.repeats):
+            index.search(batch, args.k)
+        batched_ms = (time.perf_counter() - start) / (args.repeats * args.batch) * 1000
+
+        if args.skip_legacy:
+            legacy_cell, speedup_cell = "-", "-"
+        else:
+            corpus64 = corpus.astype(np.float64)
+            legacy_ms = time_per_query(lambda q: legacy_search(q, corpus64, args.k), queries, args.repeats)
+            legacy_cell, speedup_cell = f"{legacy_ms:.3f}", f"{legacy_ms / exact_ms:.1f}x"
+            del corpus64
+
+        print(f"{n:>9} | {legacy_cell:>11} | {exact_ms:>10.3f} | {batched_ms:>12.4f} | {speedup_cell:>7}")
+
+
+if __name__ == "__main__":
+    main()
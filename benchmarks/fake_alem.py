@@ -0,0 +1,226 @@
+"""
+Local stand-in for the Alem APIs, for offline benchmarks.
+Implements POST /v1/embeddings, /v1/rerank and /v1/chat/completions (plain and SSE streaming)
+with configurable latency distributions and error rates.
+
+Embeddings are deterministic: character trigrams hashed into DIM signed buckets, so the
+same text always gets the same vector and paraphrases land close to each other.
+The reranker scores documents with the same vectors and, like a relevance threshold, drops
+those below --rerank-min-score, so off-topic queries get no results.
+
+Standalone usage (from the repository root):
+    python -m benchmarks.fake_alem --port 8900 --embed-latency 40,200 --error-rate 0.01
+    ALEM_BASE_URL=http://127.0.0.1:8900 ALEM_RERANKER_BASE_URL=http://127.0.0.1:8900 streamlit run app.py
+"""
+import json
+import time
+import random
+import hashlib
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import numpy as np
+
+DIM = 1024
+
+
+class LatencyModel:
+    """Log-normal latency given its median and p99 in milliseconds (p99 <= median means constant)."""
+
+    def __init__(self, median_ms, p99_ms=None):
+        self.median = median_ms / 1000.0
+        p99 = (p99_ms or median_ms) / 1000.0
+        self.sigma = np.log(p99 / self.median) / 2.326 if p99 > self.median > 0 else 0.0
+
+    @classmethod
+    def parse(cls, spec):
+        """Parses "40" or "40,200" (median[,p99] in ms)."""
+        parts = [float(part) for part in spec.split(",")]
+        return cls(*parts[:2])
+
+    def sample(self, rng):
+        if self.median <= 0:
+            return 0.0
+        return self.median * float(np.exp(rng.normalvariate(0.0, self.sigma))) if self.sigma else self.median
+
+
+def hashed_embedding(text, dim=DIM):
+    """Deterministic unit vector of the character trigrams of `text`."""
+    vector = np.zeros(dim, dtype=np.float32)
+    normalized = " ".join(text.lower().split())
+    for i in range(max(1, len(normalized) - 2)):
+        digest = hashlib.md5(normalized[i:i + 3].encode("utf-8")).digest()
+        bucket = int.from_bytes(digest[:4], "little") % dim
+        vector[bucket] += 1.0 if digest[4] & 1 else -1.0
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class FakeAlemConfig:
+    def __init__(self, embed_latency=None, rerank_latency=None, llm_latency=None,
+                 token_interval_ms=20.0, rerank_per_document_ms=2.0, rerank_min_score=0.25, error_rate=0.0,
+                 dim=DIM, seed=0):
+        self.latency = {
+            "embeddings": embed_latency or LatencyModel(30, 120),
+            "rerank": rerank_latency or LatencyModel(80, 300),
+            "completions": llm_latency or LatencyModel(400, 1500),  # Time to first token
+        }
+        self.token_interval = token_interval_ms / 1000.0
+        self.rerank_per_document = rerank_per_document_ms / 1000.0  # Bigger payloads take longer
+        self.rerank_min_score = rerank_min_score  # Less relevant documents are not returned
+        self.error_rate = error_rate
+        self.dim = dim
+        self.rng = random.Random(seed)
+        self.rng_lock = threading.Lock()
+        self.requests = {name: 0 for name in self.latency}
+        self.errors = {name: 0 for name in self.latency}
+
+
+class FakeAlemHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    config = None  # FakeAlemConfig, set by FakeAlemServer
+
+    def log_message(self, *args):
+        pass
+
+    def _send_json(self, status, body):
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_chunk(self, data):
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        endpoint = self.path.rstrip("/").rsplit("/", 1)[-1]
+        if endpoint not in self.config.latency:
+            self._send_json(404, {"error": f"unknown endpoint {self.path}"})
+            return
+
+        with self.config.rng_lock:
+            self.config.requests[endpoint] += 1
+            delay = self.config.latency[endpoint].sample(self.config.rng)
+            if endpoint == "rerank":
+                delay += self.config.rerank_per_document * len(payload.get("documents", []))
+            failed = self.config.rng.random() < self.config.error_rate
+            if failed:
+                self.config.errors[endpoint] += 1
+        time.sleep(delay)
+        if failed:
+            self._send_json(503, {"error": "injected failure"})
+            return
+
+        if endpoint == "embeddings":
+            self._embeddings(payload)
+        elif endpoint == "rerank":
+            self._rerank(payload)
+        else:
+            self._completions(payload)
+
+    def _embeddings(self, payload):
+        texts = payload["input"] if isinstance(payload["input"], list) else [payload["input"]]
+        data = [{"index": i, "embedding": hashed_embedding(text, self.config.dim).tolist()}
+                for i, text in enumerate(texts)]
+        self._send_json(200, {"data": data, "model": payload.get("model")})
+
+    def _rerank(self, payload):
+        query = hashed_embedding(payload["query"], self.config.dim)
+        documents = payload["documents"]
+        scores = [float(hashed_embedding(doc, self.config.dim) @ query) for doc in documents]
+        relevant = [i for i in range(len(documents)) if scores[i] >= self.config.rerank_min_score]
+        order = sorted(relevant, key=lambda i: -scores[i])[:payload.get("top_n", len(documents))]
+        results = [{"index": i, "relevance_score": scores[i], "document": {"text": documents[i]}} for i in order]
+        self._send_json(200, {"results": results})
+
+    def _completions(self, payload):
+        prompt = payload["messages"][-1]["content"]
+        words = ("Ответ (тестовый сервер): " + " ".join(prompt.split()[-40:])).split(" ")
+        if not payload.get("stream"):
+            time.sleep(self.config.token_interval * len(words))
+            self._send_json(200, {"choices": [{"message": {"role": "assistant", "content": " ".join(words)}}]})
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for i, word in enumerate(words):
+            if i:
+                time.sleep(self.config.token_interval)
+            chunk = {"choices": [{"delta": {"content": word if i == 0 else " " + word}}]}
+            self._send_chunk(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+        self._send_chunk(b"data: [DONE]\n\n")
+        self.wfile.write(b"0\r\n\r\n")
+
+
+class FakeAlemServer:
+    """Runs the stand-in in a background thread of the current process."""
+
+    def __init__(self, config=None, host="127.0.0.1", port=0):
+        self.config = config or FakeAlemConfig()
+        handler = type("Handler", (FakeAlemHandler,), {"config": self.config})
+        self._server = ThreadingHTTPServer((host, port), handler)
+        self._server.daemon_threads = True
+        self.base_url = f"http://{host}:{self._server.server_port}"
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, name="fake-alem", daemon=True).start()
+        return self.base_url
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def stats(self):
+        return {"requests": dict(self.config.requests), "errors": dict(self.config.errors)}
+
+
+def add_server_arguments(parser):
+    """Latency/error options shared by the benchmarks that start a FakeAlemServer."""
+    parser.add_argument("--embed-latency", type=LatencyModel.parse, default=LatencyModel(30, 120),
+                        help="Embedder latency, median[,p99] in ms")
+    parser.add_argument("--rerank-latency", type=LatencyModel.parse, default=LatencyModel(80, 300),
+                        help="Reranker latency, median[,p99] in ms")
+    parser.add_argument("--llm-latency", type=LatencyModel.parse, default=LatencyModel(400, 1500),
+                        help="LLM time to first token, median[,p99] in ms")
+    parser.add_argument("--rerank-per-doc", type=float, default=2.0,
+                        help="Extra reranker latency per document sent, in ms")
+    parser.add_argument("--rerank-min-score", type=float, default=0.25,
+                        help="Reranker drops documents scored below this (off-topic queries get no results)")
+    parser.add_argument("--token-interval", type=float, default=20.0, help="LLM ms between streamed tokens")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests answered with 503")
+    parser.add_argument("--dim", type=int, default=DIM)
+    parser.add_argument("--seed", type=int, default=0)
+
+
+def config_from_args(args):
+    return FakeAlemConfig(args.embed_latency, args.rerank_latency, args.llm_latency,
+                          token_interval_ms=args.token_interval, rerank_per_document_ms=args.rerank_per_doc,
+                          rerank_min_score=args.rerank_min_score,
+                          error_rate=args.error_rate,
+                          dim=args.dim, seed=args.seed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    add_server_arguments(parser)
+    args = parser.parse_args()
+
+    server = FakeAlemServer(config_from_args(args), host=args.host, port=args.port)
+    print(f"Fake Alem server on {server.base_url} (Ctrl+C to stop)")
+    server.start()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
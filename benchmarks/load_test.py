@@ -0,0 +1,259 @@
+"""
+Offline end-to-end load benchmark.
+Starts the local Alem stand-in (benchmarks/fake_alem.py), points the pipeline at it through
+ALEM_BASE_URL / ALEM_RERANKER_BASE_URL, builds the index with generate_embeddings.py and replays
+a query workload (paraphrased FAQ questions, part of them repeated) at a fixed concurrency.
+Reports throughput, outcomes and p50/p95/p99 per pipeline stage (tracing.py spans).
+
+Everything the run writes (index, caches, traces.jsonl) goes to a temporary working directory.
+
+Usage (from the repository root):
+    python -m benchmarks.load_test --requests 300 --concurrency 16
+    python -m benchmarks.load_test --mode async --save-baseline bench_baseline.json
+    python -m benchmarks.load_test --baseline bench_baseline.json --max-regression 0.2   # exit 1 on regression
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import random
+import asyncio
+import argparse
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.fake_alem import FakeAlemServer, add_server_arguments, config_from_args
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_DIR = "data"
+STAGES = ("turn", "retrieve", "embed", "coarse_search", "rerank", "map_contexts",
+          "prompt_build", "llm_first_token", "llm", "answer_stream")
+REGRESSION_FLOOR_MS = 1.0  # p99 growth below this is noise, whatever the ratio
+FILLERS = ("", "", "подскажите, ", "скажите пожалуйста, ", "хочу узнать: ")
+
+
+def paraphrase(question, rng):
+    """Cheap paraphrase of an FAQ question: case, punctuation, filler words, one dropped word."""
+    words = question.replace("?", "").split()
+    if len(words) > 4 and rng.random() < 0.5:
+        del words[rng.randrange(1, len(words))]
+    text = rng.choice(FILLERS) + " ".join(words)
+    return text.lower() if rng.random() < 0.5 else text
+
+
+def build_workload(rows, n_requests, repeat_ratio, rng):
+    """`n_requests` queries; a `repeat_ratio` share repeats earlier ones (cache traffic)."""
+    questions = [row["questions"] for row in rows if row.get("questions")]
+    workload = []
+    for _ in range(n_requests):
+        if workload and rng.random() < repeat_ratio:
+            workload.append(rng.choice(workload))
+        else:
+            workload.append(paraphrase(rng.choice(questions), rng))
+    return workload
+
+
+def prepare_pipeline(base_url, workdir, index_requests_per_second=50.0, unlimited_quota=False):
+    """
+    Sets up an offline pipeline against `base_url` inside `workdir` and builds its index.
+    Must run before anything imports the pipeline modules (they read the env at import).
+    Returns (logic module, llm module, (texts, vectors, data), index build seconds).
+    """
+    os.environ["ALEM_BASE_URL"] = base_url
+    os.environ["ALEM_RERANKER_BASE_URL"] = base_url
+    os.environ.setdefault("TRACE_FILE", "traces.jsonl")
+    for key in ("EMBED_API_KEY", "RERANK_API_KEY", "ALEM_API_KEY"):
+        os.environ.setdefault(key, "offline-benchmark")
+
+    # Relative paths of the pipeline (index, caches, traces) resolve inside workdir
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+    try:
+        os.symlink(os.path.join(ROOT, DATA_DIR), os.path.join(workdir, DATA_DIR))
+    except OSError:
+        shutil.copytree(os.path.join(ROOT, DATA_DIR), os.path.join(workdir, DATA_DIR))
+    os.chdir(workdir)
+
+    import generate_embeddings
+    import chatbot_logic_alem as logic
+    import alem_llm_handler as llm
+    from rate_limiter import RateLimiter, TokenBucket
+    from upstream_scheduler import schedulers, PRIORITIES
+
+    # The indexer's own pace protects the real quota; offline it only slows the setup down
+    generate_embeddings.rate_limiter = RateLimiter(index_requests_per_second)
+    if unlimited_quota:
+        for scheduler in schedulers.values():
+            scheduler.max_concurrent = scheduler.batch_max_concurrent = 10000
+            scheduler.request_bucket = TokenBucket(1e9, 1e9)
+            scheduler.token_bucket = None
+        for config in PRIORITIES.values():
+            config["max_queue"] = 10 ** 9
+
+    start = time.perf_counter()
+    generate_embeddings.main_generate()
+    index_seconds = time.perf_counter() - start
+
+    texts, vectors, data = logic.load_precomputed_data()
+    if texts is None:
+        raise SystemExit("Index build against the fake server failed")
+    deadline = time.monotonic() + 60
+    while logic.LEXICAL_FALLBACK and not logic.lexical_fallback.ready and time.monotonic() < deadline:
+        time.sleep(0.1)
+    return logic, llm, (texts, vectors, data), index_seconds
+
+
+def run_sync(logic, llm, index, workload, concurrency):
+    """Streamlit-like path: find_best_match_alem + streamed generate_llm_answer per thread."""
+    from tracing import tracer
+
+    def turn(question):
+        with tracer.span("turn", source="benchmark") as span:
+            contexts = logic.find_best_match_alem(question, *index)
+            if not contexts:
+                span.set(plan="C")
+                return "C"
+            span.set(plan="A", served_by=contexts.served_by)
+            "".join(llm.generate_llm_answer(question, contexts, stream=True))
+            return contexts.served_by
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        return list(executor.map(turn, workload))
+
+
+def run_async(index, workload, concurrency):
+    """API path: async_pipeline.answer() with `concurrency` turns in flight."""
+    import async_pipeline
+    from tracing import tracer
+
+    async def replay():
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def turn(question):
+            async with semaphore:
+                with tracer.span("turn", source="benchmark") as span:
+                    contexts, _ = await async_pipeline.answer(question, *index)
+                    if not contexts:
+                        span.set(plan="C")
+                        return "C"
+                    span.set(plan="A", served_by=contexts.served_by)
+                    return contexts.served_by
+
+        try:
+            return await asyncio.gather(*(turn(question) for question in workload))
+        finally:
+            await async_pipeline.close_async_client()
+
+    return asyncio.run(replay())
+
+
+def check_regression(result, baseline, tolerance):
+    """Failures of `result` against `baseline`: throughput drop or p99 growth above `tolerance`."""
+    failures = []
+    if result["throughput_rps"] < baseline["throughput_rps"] * (1 - tolerance):
+        failures.append(f"throughput {result['throughput_rps']:.2f} rps < baseline "
+                        f"{baseline['throughput_rps']:.2f} rps")
+    for stage, reference in baseline["stages"].items():
+        current = result["stages"].get(stage)
+        if (current and current["p99_ms"] > reference["p99_ms"] * (1 + tolerance)
+                and current["p99_ms"] - reference["p99_ms"] > REGRESSION_FLOOR_MS):
+            failures.append(f"{stage}: p99 {current['p99_ms']:.1f} ms > baseline {reference['p99_ms']:.1f} ms")
+    return failures
+
+
+def print_report(result):
+    print(f"\nMode {result['config']['mode']}, concurrency {result['config']['concurrency']}: "
+          f"{result['requests']} turns in {result['wall_seconds']:.2f} s = {result['throughput_rps']:.2f} turns/s "
+          f"(index built in {result['index_seconds']:.2f} s)")
+    print("Outcomes: " + ", ".join(f"{name}={count}" for name, count in sorted(result["outcomes"].items())))
+    print(f"\n{'stage':>16} | {'count':>6} | {'p50 ms':>9} | {'p95 ms':>9} | {'p99 ms':>9}")
+    for stage in STAGES:
+        stats = result["stages"].get(stage)
+        if stats:
+            print(f"{stage:>16} | {stats['count']:>6} | {stats['p50_ms']:>9.1f} | "
+                  f"{stats['p95_ms']:>9.1f} | {stats['p99_ms']:>9.1f}")
+    print(f"\nFake server: {result['server']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", choices=("sync", "async"), default="sync")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--warmup", type=int, default=10, help="Turns run before measuring")
+    parser.add_argument("--repeat-ratio", type=float, default=0.3, help="Share of repeated queries")
+    parser.add_argument("--unlimited-quota", action="store_true",
+                        help="Lift the upstream_scheduler quotas (measure the pipeline, not the quota)")
+    parser.add_argument("--json", help="Write the result to this file")
+    parser.add_argument("--save-baseline", help="Write the result as a baseline file")
+    parser.add_argument("--baseline", help="Compare against this baseline and exit 1 on regression")
+    parser.add_argument("--max-regression", type=float, default=0.2,
+                        help="Allowed relative throughput drop / p99 growth against the baseline")
+    add_server_arguments(parser)
+    args = parser.parse_args()
+    for option in ("json", "save_baseline", "baseline"):
+        if getattr(args, option):
+            setattr(args, option, os.path.abspath(getattr(args, option)))
+
+    server = FakeAlemServer(config_from_args(args))
+    server.start()
+    workdir = tempfile.mkdtemp(prefix="aitu-bench-")
+    cwd = os.getcwd()
+    try:
+        logic, llm, index, index_seconds = prepare_pipeline(server.base_url, workdir,
+                                                            unlimited_quota=args.unlimited_quota)
+        from tracing import tracer
+
+        rng = random.Random(args.seed)
+        workload = build_workload(index[2], args.requests, args.repeat_ratio, rng)
+        warmup = build_workload(index[2], args.warmup, 0.0, rng)
+
+        run = (lambda queries: run_sync(logic, llm, index, queries, args.concurrency)) if args.mode == "sync" \
+            else (lambda queries: run_async(index, queries, args.concurrency))
+        if warmup:
+            run(warmup)
+        tracer.reset()
+
+        start = time.perf_counter()
+        outcomes = run(workload)
+        wall_seconds = time.perf_counter() - start
+    finally:
+        os.chdir(cwd)
+        server.stop()
+
+    result = {
+        "config": {"mode": args.mode, "concurrency": args.concurrency, "repeat_ratio": args.repeat_ratio,
+                   "error_rate": args.error_rate, "unlimited_quota": args.unlimited_quota},
+        "requests": len(workload),
+        "wall_seconds": wall_seconds,
+        "throughput_rps": len(workload) / wall_seconds,
+        "index_seconds": index_seconds,
+        "outcomes": {name: outcomes.count(name) for name in set(outcomes)},
+        "stages": tracer.metrics(),
+        "server": server.stats(),
+        "traces": os.path.join(workdir, os.environ["TRACE_FILE"]),
+    }
+    print_report(result)
+    print(f"Spans: {result['traces']}")
+
+    for path in (args.json, args.save_baseline):
+        if path:
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(result, f, ensure_ascii=False, indent=2)
+            print(f"Saved {path}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        failures = check_regression(result, baseline, args.max_regression)
+        if failures:
+            print(f"\nREGRESSION against {args.baseline} (tolerance {args.max_regression:.0%}):")
+            for failure in failures:
+                print(f"  - {failure}")
+            sys.exit(1)
+        print(f"\nNo regression against {args.baseline} (tolerance {args.max_regression:.0%}).")
+
+
+if __name__ == "__main__":
+    main()
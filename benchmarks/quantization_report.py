@@ -0,0 +1,102 @@
+"""
+Memory, latency and recall@k report for the vector storage modes.
+The reference is the old path: float64 vectors with exact cosine scoring.
+Per mode: bytes stored for the scanned matrix, peak temporary memory allocated by one query
+(tracemalloc, which sees numpy buffers), single-query p50/p95 latency, batched ms per query
+and recall@k. Resident memory of the memory-mapped modes is measured by benchmarks/bench_scaling.py.
+
+Usage (from the repository root):
+    python -m benchmarks.quantization_report                  # synthetic clustered corpus
+    python -m benchmarks.quantization_report --index alem_index
+"""
+import argparse
+import time
+import tracemalloc
+import numpy as np
+
+from search_engine import ExactSearchIndex, normalize_rows, top_k_from_scores
+from quantization import QuantizedSearchIndex, quantize_int8
+from vector_store import load_vector_store
+
+
+def synthetic_corpus(n_docs, dim, n_queries, seed=0):
+    """Clustered unit vectors, closer to real embeddings than isotropic noise."""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((max(1, n_docs // 50), dim))
+    docs = centers[rng.integers(0, len(centers), n_docs)] + 0.6 * rng.standard_normal((n_docs, dim))
+    queries = centers[rng.integers(0, len(centers), n_queries)] + 0.6 * rng.standard_normal((n_queries, dim))
+    return docs, queries
+
+
+def recall_at_k(found, reference):
+    return float(np.mean([len(set(f) & set(r)) / len(r) for f, r in zip(found, reference)]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--index", help="Index directory to evaluate instead of a synthetic corpus")
+    parser.add_argument("--docs", type=int, default=50000)
+    parser.add_argument("--dim", type=int, default=1024)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=20)
+    args = parser.parse_args()
+
+    if args.index:
+        store = load_vector_store(args.index)
+        docs = np.asarray(store.vectors, dtype=np.float64)
+        # Held-out queries are not available offline: perturbed documents stand in for them
+        rng = np.random.default_rng(0)
+        picks = rng.choice(len(docs), size=min(args.queries, len(docs)), replace=False)
+        queries = docs[picks] + 0.02 * rng.standard_normal((len(picks), docs.shape[1]))
+    else:
+        docs, queries = synthetic_corpus(args.docs, args.dim, args.queries)
+
+    # Reference: float64, exact cosine, as sklearn's cosine_similarity computed it
+    docs64 = docs / np.linalg.norm(docs, axis=1, keepdims=True)
+    queries64 = queries / np.linalg.norm(queries, axis=1, keepdims=True)
+    reference, _ = top_k_from_scores(queries64 @ docs64.T, args.k)
+
+    docs32 = normalize_rows(docs)
+    codes, scale = quantize_int8(docs32)
+    modes = [
+        ("float64 (old)", docs64.nbytes, None),
+        ("float32", docs32.nbytes, ExactSearchIndex(docs32, normalized=True)),
+        ("float16 + rescore", docs32.astype(np.float16).nbytes,
+         QuantizedSearchIndex(docs32.astype(np.float16), docs32)),
+        ("int8 + rescore", codes.nbytes + scale.nbytes, QuantizedSearchIndex(codes, docs32, scale=scale)),
+        ("int8, no rescore", codes.nbytes + scale.nbytes, QuantizedSearchIndex(codes, docs32, scale=scale,
+                                                                                rescore_factor=1)),
+    ]
+
+    print(f"Корпус: {docs.shape[0]} x {docs.shape[1]}, запросов: {len(queries)}, k={args.k}")
+    print(f"{'mode':<18} | {'stored MB':>9} | {'vs f64':>6} | {'peak MB/q':>9} | {'p50 ms':>7} | "
+          f"{'p95 ms':>7} | {'batch ms/q':>10} | {'recall@k':>8}")
+    for name, nbytes, index in modes:
+        if index is None:
+            print(f"{name:<18} | {nbytes / 2**20:>9.1f} | {1.0:>6.0%} | {'-':>9} | {'-':>7} | {'-':>7} | "
+                  f"{'-':>10} | {1.0:>8.3f}")
+            continue
+        query32 = queries[0].astype(np.float32)
+        tracemalloc.start()
+        index.search(query32, args.k)
+        peak_mb = tracemalloc.get_traced_memory()[1] / 2**20
+        tracemalloc.stop()
+
+        found, latencies = [], []
+        for query in queries.astype(np.float32):
+            start = time.perf_counter()
+            ids, _ = index.search(query, args.k)
+            latencies.append((time.perf_counter() - start) * 1000)
+            found.append(ids)
+        latencies.sort()
+        start = time.perf_counter()
+        index.search(queries.astype(np.float32), args.k)
+        batch_ms = (time.perf_counter() - start) / len(queries) * 1000
+
+        print(f"{name:<18} | {nbytes / 2**20:>9.1f} | {nbytes / docs64.nbytes:>6.0%} | {peak_mb:>9.1f} | "
+              f"{latencies[len(latencies) // 2]:>7.3f} | {latencies[int(len(latencies) * 0.95)]:>7.3f} | "
+              f"{batch_ms:>10.3f} | {recall_at_k(found, reference):>8.3f}")
+    print("Для режимов с пересчетом float32-векторы остаются на диске (mmap); в памяти читается только шортлист.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,280 @@
+"""
+Retrieval quality vs. cost harness for TOP_K_RETRIEVAL and TOP_N_RERANK.
+Builds a labeled query set from data/QA_addmissionAitu.csv (paraphrased questions mapped to the
+row ids carrying that question), embeds it once and measures, for every k and n of the sweep:
+  - recall@k and MRR of the coarse cosine search and of the cosine + BM25 fusion,
+  - recall@n and MRR after reranking the k fused candidates, with the reranker latency,
+    its payload bytes and the size of the RAG prompt built from the n contexts.
+Prints the quality/cost Pareto frontier and the cheapest (k, n) whose recall stays within
+--recall-tolerance of the best one.
+
+By default everything runs offline against benchmarks/fake_alem.py; its hashed-trigram vectors
+exercise the harness, not the production models. --live uses the configured Alem endpoints and
+the existing alem_index instead.
+
+Usage (from the repository root):
+    python -m benchmarks.tune_retrieval --k 5 10 20 30 --n 1 3 5
+    python -m benchmarks.tune_retrieval --live --queries 200 --save-queries labeled_queries.jsonl
+    python -m benchmarks.tune_retrieval --live --queries-file labeled_queries.jsonl
+"""
+import os
+import json
+import time
+import random
+import argparse
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+from benchmarks.fake_alem import FakeAlemServer, add_server_arguments, config_from_args
+from benchmarks.load_test import prepare_pipeline, paraphrase
+
+EMBED_BATCH_SIZE = 32
+
+
+def question_key(question):
+    return " ".join(question.lower().replace("?", "").split())
+
+
+def build_labeled_queries(rows, n_queries, rng):
+    """
+    Paraphrased questions of randomly chosen rows. Every query is labeled with all row ids
+    that carry the same question, so duplicated FAQ entries all count as relevant.
+    """
+    ids_by_question = {}
+    for doc_id, row in enumerate(rows):
+        if row.get("questions"):
+            ids_by_question.setdefault(question_key(row["questions"]), []).append(doc_id)
+    groups = list(ids_by_question.values())
+    chosen = rng.sample(groups, n_queries) if n_queries <= len(groups) else \
+        [rng.choice(groups) for _ in range(n_queries)]
+    return [{"query": paraphrase(rows[ids[0]]["questions"], rng), "relevant": ids} for ids in chosen]
+
+
+def load_queries(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def save_queries(path, labeled):
+    with open(path, "w", encoding="utf-8") as f:
+        for item in labeled:
+            f.write(json.dumps(item, ensure_ascii=False) + "\n")
+
+
+def rank_quality(ranked_ids, relevant):
+    """(hit, reciprocal rank) of the first relevant id in `ranked_ids`."""
+    relevant = set(relevant)
+    for rank, doc_id in enumerate(ranked_ids, start=1):
+        if int(doc_id) in relevant:
+            return 1.0, 1.0 / rank
+    return 0.0, 0.0
+
+
+def quality(rankings, labeled, depth):
+    """recall@depth and MRR@depth over aligned lists of rankings and labeled queries."""
+    pairs = [rank_quality(ranked[:depth], item["relevant"]) for ranked, item in zip(rankings, labeled)]
+    return float(np.mean([hit for hit, _ in pairs])), float(np.mean([rr for _, rr in pairs]))
+
+
+def embed_queries(logic, labeled):
+    vectors = []
+    for start in range(0, len(labeled), EMBED_BATCH_SIZE):
+        batch = [item["query"] for item in labeled[start:start + EMBED_BATCH_SIZE]]
+        vectors.extend(logic.get_embeddings_for_queries(batch))
+    return np.asarray(vectors, dtype=np.float32)
+
+
+def coarse_rankings(search_index, labeled, query_vectors, depth):
+    """Cosine and (when the index is hybrid) fused rankings of `depth` ids, plus mean ms per query."""
+    vector_index = getattr(search_index, "vector_index", search_index)
+    cosine, fused = [], []
+    start = time.perf_counter()
+    for item, vector in zip(labeled, query_vectors):
+        cosine.append([int(i) for i in vector_index.search(vector, depth)[0]])
+    cosine_ms = (time.perf_counter() - start) / len(labeled) * 1000
+
+    fused_ms = None
+    if hasattr(search_index, "hybrid_search"):
+        start = time.perf_counter()
+        for item, vector in zip(labeled, query_vectors):
+            fused.append([int(i) for i in search_index.hybrid_search(item["query"], vector, depth)[0]])
+        fused_ms = (time.perf_counter() - start) / len(labeled) * 1000
+    return cosine, cosine_ms, fused or None, fused_ms
+
+
+def rerank_once(logic, query, candidate_ids, texts, top_n):
+    """One uncached reranker call: (ranked ids, seconds, payload bytes), ranked ids None on error."""
+    from http_client import post_json
+    from upstream_scheduler import BATCH
+
+    documents = [texts[i] for i in candidate_ids]
+    payload = {"query": query, "documents": documents, "top_n": top_n}
+    payload_bytes = len(json.dumps(payload, ensure_ascii=False).encode("utf-8"))
+    start = time.perf_counter()
+    try:
+        response = post_json("rerank", logic.RERANKER_URL, payload, logic.RERANKER_HEADERS, priority=BATCH)
+        results = response.json().get("results", [])
+    except Exception as e:
+        print(f"Reranker: ошибка ({e})")
+        return None, time.perf_counter() - start, payload_bytes
+    ranked = [doc_id for doc_id, _ in logic.map_rerank_results(results, candidate_ids, documents)]
+    return ranked, time.perf_counter() - start, payload_bytes
+
+
+def sweep_rerank(logic, llm, labeled, candidates, texts, rows, ks, ns, concurrency):
+    """
+    Reranks the top-k candidates of every query for each k and scores the top n of the result.
+    Returns one row per (k, n) with n <= k.
+    """
+    results = []
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for k in ks:
+            fitting = [n for n in ns if n <= k]
+            if not fitting:
+                print(f"k={k}: все значения n больше k, пропускаю.")
+                continue
+            top_n = max(fitting)
+            calls = list(executor.map(lambda pair: rerank_once(logic, pair[0]["query"], pair[1][:k], texts, top_n),
+                                      zip(labeled, candidates)))
+            ok = [(item, ranked) for item, (ranked, _, _) in zip(labeled, calls) if ranked is not None]
+            latencies = sorted(seconds * 1000 for ranked, seconds, _ in calls if ranked is not None)
+            if not ok:
+                print(f"k={k}: все вызовы Reranker завершились ошибкой, пропускаю.")
+                continue
+            payload_bytes = float(np.mean([size for _, _, size in calls]))
+            for n in ns:
+                if n > k:
+                    continue
+                recall, mrr = quality([ranked for _, ranked in ok], [item for item, _ in ok], n)
+                prompt_bytes = float(np.mean([
+                    len(llm.build_rag_prompt(item["query"], [rows[i] for i in ranked[:n]]).encode("utf-8"))
+                    for item, ranked in ok]))
+                results.append({
+                    "k": k, "n": n, "recall": recall, "mrr": mrr,
+                    "rerank_p50_ms": latencies[len(latencies) // 2],
+                    "rerank_p95_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+                    "payload_bytes": payload_bytes, "prompt_bytes": prompt_bytes,
+                    "errors": len(calls) - len(ok),
+                })
+    return results
+
+
+def pareto_frontier(rows):
+    """Settings not beaten on recall, MRR, reranker p50 and bytes sent at once by another one."""
+    def costs(row):
+        return (-row["recall"], -row["mrr"], row["rerank_p50_ms"], row["payload_bytes"] + row["prompt_bytes"])
+
+    frontier = []
+    for row in rows:
+        mine = costs(row)
+        dominated = any(
+            all(a <= b for a, b in zip(costs(other), mine)) and costs(other) != mine
+            for other in rows)
+        if not dominated:
+            frontier.append(row)
+    return frontier
+
+
+def cheapest_holding_recall(rows, tolerance):
+    """Fewest bytes (then fastest) among settings within `tolerance` of the best recall."""
+    best = max(row["recall"] for row in rows)
+    eligible = [row for row in rows if row["recall"] >= best - tolerance]
+    return min(eligible, key=lambda row: (row["payload_bytes"] + row["prompt_bytes"], row["rerank_p50_ms"]))
+
+
+def print_quality_table(title, rankings, labeled, depths, ms_per_query):
+    print(f"\n{title} ({ms_per_query:.2f} ms/запрос)")
+    print(f"{'k':>4} | {'recall@k':>8} | {'MRR':>6}")
+    for k in depths:
+        recall, mrr = quality(rankings, labeled, k)
+        print(f"{k:>4} | {recall:>8.3f} | {mrr:>6.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--k", type=int, nargs="+", default=[5, 10, 20, 30], help="TOP_K_RETRIEVAL values")
+    parser.add_argument("--n", type=int, nargs="+", default=[1, 3, 5], help="TOP_N_RERANK values")
+    parser.add_argument("--queries", type=int, default=150, help="Size of the generated query set")
+    parser.add_argument("--queries-file", help="Labeled JSONL set ({\"query\", \"relevant\"}) instead of paraphrases")
+    parser.add_argument("--save-queries", help="Write the labeled query set as JSONL")
+    parser.add_argument("--concurrency", type=int, default=4, help="Reranker calls in flight")
+    parser.add_argument("--recall-tolerance", type=float, default=0.01,
+                        help="Recall a cheaper setting may lose against the best one")
+    parser.add_argument("--live", action="store_true", help="Use the configured Alem endpoints and alem_index")
+    parser.add_argument("--json", help="Write all measurements to this file")
+    add_server_arguments(parser)
+    args = parser.parse_args()
+    for option in ("queries_file", "save_queries", "json"):
+        if getattr(args, option):
+            setattr(args, option, os.path.abspath(getattr(args, option)))
+    ks, ns = sorted(set(args.k)), sorted(set(args.n))
+
+    server = None
+    cwd = os.getcwd()
+    try:
+        if args.live:
+            import chatbot_logic_alem as logic
+            import alem_llm_handler as llm
+            texts, search_index, rows = logic.load_precomputed_data()
+            if texts is None:
+                raise SystemExit("Индекс не найден: сначала запустите generate_embeddings.py")
+        else:
+            server = FakeAlemServer(config_from_args(args))
+            server.start()
+            logic, llm, (texts, search_index, rows), _ = prepare_pipeline(
+                server.base_url, tempfile.mkdtemp(prefix="aitu-tune-"), unlimited_quota=True)
+        from tracing import tracer
+        tracer.path = None  # prompt_build spans of the sweep are not production traces
+
+        labeled = load_queries(args.queries_file) if args.queries_file else \
+            build_labeled_queries(rows, args.queries, random.Random(args.seed))
+        if args.save_queries:
+            save_queries(args.save_queries, labeled)
+            print(f"Набор запросов сохранен в {args.save_queries}")
+        print(f"\n{len(labeled)} размеченных запросов, корпус {len(texts)} документов.")
+
+        query_vectors = embed_queries(logic, labeled)
+        cosine, cosine_ms, fused, fused_ms = coarse_rankings(search_index, labeled, query_vectors, max(ks))
+        print_quality_table("Coarse search (cosine)", cosine, labeled, ks, cosine_ms)
+        if fused is not None:
+            print_quality_table("Fusion (cosine + BM25, RRF)", fused, labeled, ks, fused_ms)
+
+        candidates = fused if fused is not None else cosine
+        sweep = sweep_rerank(logic, llm, labeled, candidates, texts, rows, ks, ns, args.concurrency)
+        current = (logic.TOP_K_RETRIEVAL, logic.TOP_N_RERANK)
+    finally:
+        os.chdir(cwd)
+        if server is not None:
+            server.stop()
+
+    if not sweep:
+        raise SystemExit("Нет результатов Reranker для сравнения.")
+    frontier = pareto_frontier(sweep)
+    choice = cheapest_holding_recall(sweep, args.recall_tolerance)
+
+    print("\nReranker: качество против стоимости (* = Парето-фронт, > = текущие настройки)")
+    print(f"  {'k':>3} | {'n':>2} | {'recall@n':>8} | {'MRR':>6} | {'p50 ms':>7} | {'p95 ms':>7} | "
+          f"{'payload B':>9} | {'prompt B':>8} | {'errors':>6}")
+    for row in sweep:
+        mark = (">" if (row["k"], row["n"]) == current else " ") + ("*" if row in frontier else " ")
+        print(f"{mark}{row['k']:>3} | {row['n']:>2} | {row['recall']:>8.3f} | {row['mrr']:>6.3f} | "
+              f"{row['rerank_p50_ms']:>7.1f} | {row['rerank_p95_ms']:>7.1f} | {row['payload_bytes']:>9.0f} | "
+              f"{row['prompt_bytes']:>8.0f} | {row['errors']:>6}")
+    print(f"\nСамая дешевая настройка с recall не ниже лучшего - {args.recall_tolerance}: "
+          f"TOP_K_RETRIEVAL = {choice['k']}, TOP_N_RERANK = {choice['n']} "
+          f"(recall {choice['recall']:.3f}, MRR {choice['mrr']:.3f}); сейчас {current[0]} / {current[1]}.")
+
+    if args.json:
+        report = {"queries": len(labeled), "live": args.live, "current": {"k": current[0], "n": current[1]},
+                  "coarse": {str(k): dict(zip(("recall", "mrr"), quality(cosine, labeled, k))) for k in ks},
+                  "fusion": None if fused is None else
+                  {str(k): dict(zip(("recall", "mrr"), quality(fused, labeled, k))) for k in ks},
+                  "rerank": sweep, "frontier": frontier, "choice": choice}
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"Сохранено в {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,208 @@
+import os
+import re
+import sys
+import numpy as np
+
+from data_handler import STOP_WORDS, load_data_from_csv
+from search_engine import top_k_from_scores
+
+# BM25 files stored next to vectors.npy in the index directory.
+# Postings are kept in CSR form: for term t, its documents and precomputed BM25 weights
+# are docs[offsets[t]:offsets[t+1]] and weights[offsets[t]:offsets[t+1]].
+BM25_VOCAB_FILE = "bm25_vocab.npy"
+BM25_OFFSETS_FILE = "bm25_offsets.npy"
+BM25_DOCS_FILE = "bm25_docs.npy"
+BM25_WEIGHTS_FILE = "bm25_weights.npy"
+
+BM25_K1 = 1.5
+BM25_B = 0.75
+RRF_K = 60  # Standard reciprocal-rank-fusion constant
+
+
+# Stored in the index header: a persisted BM25 index built by another tokenizer is rebuilt
+TOKENIZER_VERSION = 2
+# Digits, Latin and the full Russian + Kazakh alphabet (ё, ә, ғ, қ, ң, ө, ұ, ү, һ, і)
+TOKEN_PATTERN = re.compile(r"[0-9a-zа-яёәғқңөұүһі]+")
+# Cyrillic look-alikes typed inside codes ("6В06102" with a Cyrillic В)
+CODE_HOMOGLYPHS = str.maketrans("авекмнорстух", "abekmhopctyx")
+
+
+def tokenize(text):
+    """
+    Lowercase word tokens without stopwords, like preprocess_text(), but keeping numbers,
+    program codes (6B06102) and Kazakh letters. Tokens with digits are folded to Latin.
+    """
+    if not isinstance(text, str):
+        return []
+    tokens = []
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        if token in STOP_WORDS:
+            continue
+        if any(char.isdigit() for char in token):
+            token = token.translate(CODE_HOMOGLYPHS)
+        tokens.append(token)
+    return tokens
+
+
+class BM25Index:
+    """
+    In-memory inverted index with Okapi BM25 scoring.
+    Per-posting weights idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * dl / avgdl)) are
+    precomputed at build time, so a query is a sum of posting weights for its terms.
+    """
+
+    def __init__(self, vocab, offsets, docs, weights, n_docs):
+        self.term_ids = {term: i for i, term in enumerate(vocab)}
+        self.offsets = offsets
+        self.docs = docs
+        self.weights = weights
+        self.n_docs = n_docs
+
+    @classmethod
+    def build(cls, texts, k1=BM25_K1, b=BM25_B):
+        term_ids = {}
+        postings = []  # term id -> {doc id: tf}
+        doc_lengths = np.zeros(len(texts), dtype=np.float32)
+        for doc_id, text in enumerate(texts):
+            tokens = tokenize(text)
+            doc_lengths[doc_id] = len(tokens)
+            for token in tokens:
+                term_id = term_ids.setdefault(token, len(term_ids))
+                if term_id == len(postings):
+                    postings.append({})
+                postings[term_id][doc_id] = postings[term_id].get(doc_id, 0) + 1
+
+        n_docs = len(texts)
+        avg_length = float(doc_lengths.mean()) if n_docs and doc_lengths.mean() > 0 else 1.0
+        offsets = np.zeros(len(postings) + 1, dtype=np.int64)
+        docs, weights = [], []
+        for term_id, term_postings in enumerate(postings):
+            ids = np.fromiter(term_postings.keys(), dtype=np.int32, count=len(term_postings))
+            tf = np.fromiter(term_postings.values(), dtype=np.float32, count=len(term_postings))
+            idf = np.log(1.0 + (n_docs - len(ids) + 0.5) / (len(ids) + 0.5))
+            norm = k1 * (1.0 - b + b * doc_lengths[ids] / avg_length)
+            docs.append(ids)
+            weights.append((idf * tf * (k1 + 1.0) / (tf + norm)).astype(np.float32))
+            offsets[term_id + 1] = offsets[term_id] + len(ids)
+
+        vocab = sorted(term_ids, key=term_ids.get)
+        return cls(
+            vocab,
+            offsets,
+            np.concatenate(docs) if docs else np.zeros(0, dtype=np.int32),
+            np.concatenate(weights) if weights else np.zeros(0, dtype=np.float32),
+            n_docs,
+        )
+
+    def __len__(self):
+        return self.n_docs
+
+    def scores(self, query):
+        """BM25 score of every document for a raw query string."""
+        scores = np.zeros(self.n_docs, dtype=np.float32)
+        for token in tokenize(query):
+            term_id = self.term_ids.get(token)
+            if term_id is None:
+                continue
+            start, end = self.offsets[term_id], self.offsets[term_id + 1]
+            # Doc ids are unique within one posting list, so fancy-index += is safe
+            scores[self.docs[start:end]] += self.weights[start:end]
+        return scores
+
+    def search(self, query, k):
+        """Top-k documents with a positive BM25 score: (indices, scores), best first."""
+        scores = self.scores(query)
+        indices, top_scores = top_k_from_scores(scores, k)
+        found = top_scores[0] > 0
+        return indices[0][found], top_scores[0][found]
+
+    def arrays(self):
+        """Files to persist in the index directory, see vector_store.save_vector_store()."""
+        vocab = sorted(self.term_ids, key=self.term_ids.get)
+        return {
+            BM25_VOCAB_FILE: np.array(vocab, dtype=str),
+            BM25_OFFSETS_FILE: self.offsets,
+            BM25_DOCS_FILE: self.docs,
+            BM25_WEIGHTS_FILE: self.weights,
+        }
+
+
+def load_bm25_index(path, n_docs, tokenizer_version=None):
+    """
+    Opens a persisted BM25 index. Returns None if the index directory has none or it was
+    built with another tokenizer (`tokenizer_version` from the index header).
+    """
+    if not os.path.exists(os.path.join(path, BM25_VOCAB_FILE)) or tokenizer_version != TOKENIZER_VERSION:
+        return None
+    return BM25Index(
+        np.load(os.path.join(path, BM25_VOCAB_FILE)).tolist(),
+        np.load(os.path.join(path, BM25_OFFSETS_FILE), mmap_mode='r'),
+        np.load(os.path.join(path, BM25_DOCS_FILE), mmap_mode='r'),
+        np.load(os.path.join(path, BM25_WEIGHTS_FILE), mmap_mode='r'),
+        n_docs,
+    )
+
+
+def reciprocal_rank_fusion(rankings, k=RRF_K):
+    """
+    Fuses several ranked id lists: score(d) = sum over lists of 1 / (k + rank of d).
+    Returns (ids, fused scores), best first.
+    """
+    fused = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking):
+            fused[int(doc_id)] = fused.get(int(doc_id), 0.0) + 1.0 / (k + rank + 1)
+    ordered = sorted(fused.items(), key=lambda item: -item[1])
+    return np.array([doc_id for doc_id, _ in ordered], dtype=np.int64), np.array([s for _, s in ordered])
+
+
+class HybridSearchIndex:
+    """
+    Vector index + BM25 fused with reciprocal-rank fusion.
+    search() keeps the plain vector contract; hybrid_search() needs the query text too.
+    """
+
+    def __init__(self, vector_index, bm25_index, candidates_per_retriever=30, rrf_k=RRF_K):
+        self.vector_index = vector_index
+        self.bm25_index = bm25_index
+        self.candidates_per_retriever = candidates_per_retriever
+        self.rrf_k = rrf_k
+
+    @property
+    def vectors(self):
+        return self.vector_index.vectors
+
+    def __len__(self):
+        return len(self.vector_index)
+
+    def search(self, query_vectors, k):
+        return self.vector_index.search(query_vectors, k)
+
+    def hybrid_search(self, query, query_vector, k):
+        """Top-k ids after fusing the cosine and BM25 rankings: (ids, rrf scores)."""
+        vector_ids, _ = self.vector_index.search(query_vector, self.candidates_per_retriever)
+        lexical_ids, _ = self.bm25_index.search(query, self.candidates_per_retriever)
+        fused_ids, fused_scores = reciprocal_rank_fusion([vector_ids, lexical_ids], k=self.rrf_k)
+        return fused_ids[:k], fused_scores[:k]
+
+
+if __name__ == "__main__":
+    # Check: every program code in the FAQ ranks a row that contains it first.
+    # Usage: python bm25_index.py [data/QA_addmissionAitu.csv]
+    rows = load_data_from_csv(sys.argv[1] if len(sys.argv) > 1 else "data/QA_addmissionAitu.csv")
+    if rows is None:
+        sys.exit(1)
+    texts = [f"Вопрос: {row['questions']} Ответ: {row['answers']}" for row in rows]
+    index = BM25Index.build(texts)
+    print(tokenize("2 500 000 тенге, код 6B06102, Қазақ тілі, ёлка"))
+
+    codes = sorted({token for text in texts for token in tokenize(text) if re.fullmatch(r"\d[a-z]\d{5}", token)})
+    failed = []
+    for code in codes:
+        indices, _ = index.search(f"что за программа {code.upper()}", k=1)
+        if len(indices) == 0 or code not in tokenize(texts[indices[0]]):
+            failed.append(code)
+    print(f"Коды программ: {len(codes) - len(failed)}/{len(codes)} найдены первой строкой.")
+    if failed:
+        print(f"Не найдены: {', '.join(failed)}")
+        sys.exit(1)
@@ -1,10 +1,25 @@
 import os
-import requests
-import pickle
+import time
+import contextvars
 import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeout
 from dotenv import load_dotenv
 
+from vector_store import load_vector_store, content_key, DocumentTexts
+from search_engine import ExactSearchIndex, as_search_index, score_candidates
+from ann_index import load_ivf_index
+from quantization import load_quantized_index
+from bm25_index import BM25Index, HybridSearchIndex, load_bm25_index
+from embedding_cache import QueryEmbeddingCache, normalize_query
+from rerank_cache import RerankCache
+from http_client import post_json
+from embed_batcher import EmbeddingMicroBatcher
+from single_flight import SingleFlight
+from rerank_policy import RerankPolicy, SKIP
+from lexical_fallback import LexicalFallback
+from tracing import tracer
+from stages import run_stage
+
 # Load API keys from .env
 load_dotenv()
 EMBED_API_KEY = os.getenv("EMBED_API_KEY")
@@ -14,115 +29,484 @@ if not EMBED_API_KEY or not RERANK_API_KEY:
     raise ValueError("EMBED_API_KEY или RERANK_API_KEY не найдены в .env файле!")
 
 # Configuration
-EMBEDDINGS_FILE = "alem_embeddings.pkl"
-TOP_K_RETRIEVAL = 20  # Number of candidates for coarse search
+INDEX_DIR = "alem_index"  # Memory-mapped vector store built by generate_embeddings.py
+TOP_K_RETRIEVAL = 20  # Number of candidates for coarse search (sent to the reranker)
 TOP_N_RERANK = 3  # Number of final results after reranking
 
+# Coarse search backend: "exact", "ivf" (ANN, needs an index built by generate_embeddings.py)
+# or "auto" (IVF when available and the corpus has at least ANN_MIN_DOCS documents)
+SEARCH_BACKEND = "auto"
+ANN_MIN_DOCS = 10000
+IVF_NPROBE = 8  # IVF lists scanned per query: higher = better recall, slower search
+# Hybrid coarse search: cosine and BM25 rankings fused with reciprocal-rank fusion
+HYBRID_SEARCH = True
+HYBRID_CANDIDATES = 30  # Candidates taken from each ranking before fusion
+# Vectors scanned by exact search: "float32", or "int8"/"float16" with float32 rescoring of the shortlist.
+# int8 keeps a quarter of the pages resident at ~1.2x the per-query latency; float16 is much slower
+VECTOR_STORAGE = "float32"
+
+# Adaptive reranking: skip the reranker or send fewer candidates when the cosine scores are decisive
+ADAPTIVE_RERANK = True
+RERANK_SKIP_MIN_SCORE = 0.75  # Top-1 cosine needed to skip the reranker...
+RERANK_SKIP_MARGIN = 0.1  # ...together with this lead over the second candidate
+RERANK_SHORT_MAX_ENTROPY = 0.5  # Normalized softmax entropy below which only RERANK_SHORT_K are sent
+RERANK_SHORT_K = 5
+RERANK_SOFTMAX_TEMPERATURE = 0.05
+
+rerank_policy = RerankPolicy(
+    skip_min_score=RERANK_SKIP_MIN_SCORE,
+    skip_margin=RERANK_SKIP_MARGIN,
+    short_max_entropy=RERANK_SHORT_MAX_ENTROPY,
+    short_k=RERANK_SHORT_K,
+    temperature=RERANK_SOFTMAX_TEMPERATURE,
+)
+
+# Degraded mode: per-turn latency budget for the upstream stages (embed + rerank).
+# A stage that misses it is abandoned (it finishes in the background and still fills the caches):
+# a late reranker -> cosine order of the coarse candidates, a late embedder -> local TF-IDF search.
+RETRIEVAL_DEADLINE_SECONDS = 4.0
+LEXICAL_FALLBACK = True
+UPSTREAM_WORKERS = 32  # Threads running embed/rerank calls under the deadline
+
+# RetrievalResult.served_by values
+SERVED_BY_ALEM = "alem"  # Normal pipeline (reranker, or coarse ranking chosen by rerank_policy)
+SERVED_BY_COARSE = "coarse"  # Reranker late or down: cosine order of the coarse candidates
+SERVED_BY_LEXICAL = "lexical"  # Embedder late or down: local TF-IDF over character n-grams
+# RetrievalResult.degraded values: why a degraded path served the result
+DEGRADED_TIMEOUT = "timeout"  # The upstream missed RETRIEVAL_DEADLINE_SECONDS
+DEGRADED_ERROR = "error"  # The upstream call failed
+
+upstream_executor = ThreadPoolExecutor(max_workers=UPSTREAM_WORKERS, thread_name_prefix="upstream")
+lexical_fallback = LexicalFallback()
+
+# Alem base URLs; override (env or .env) to point the pipeline at another deployment
+# or at the local stand-in server of benchmarks/fake_alem.py
+ALEM_BASE_URL = os.getenv("ALEM_BASE_URL", "https://llm.alem.ai")
+ALEM_RERANKER_BASE_URL = os.getenv("ALEM_RERANKER_BASE_URL", "https://reranker-llm.alem.ai")
+
 # Embedder API configuration
-EMBEDDER_URL = "https://llm.alem.ai/v1/embeddings"
+EMBEDDER_URL = f"{ALEM_BASE_URL}/v1/embeddings"
 EMBEDDER_MODEL = "text-1024"
 EMBEDDER_HEADERS = {
     "Authorization": f"Bearer {EMBED_API_KEY}",
     "Content-Type": "application/json"
 }
 
+# Cross-request micro-batching of query embeddings (concurrent sessions share one request)
+QUERY_BATCHING = True
+QUERY_BATCH_WINDOW_SECONDS = 0.005  # Max extra latency added to the first query of a batch
+QUERY_BATCH_MAX_SIZE = 32
+QUERY_EMBED_TIMEOUT_SECONDS = 60.0  # Upper bound on a query embedding wait (the embed retries fit in it)
+
+# Query embedding cache: in-process LRU + optional SQLite tier shared by workers (None disables it)
+QUERY_CACHE_SIZE = 10000
+QUERY_CACHE_TTL_SECONDS = 7 * 24 * 3600
+QUERY_CACHE_DB = "query_embeddings_cache.sqlite"
+
+query_embedding_cache = QueryEmbeddingCache(
+    max_size=QUERY_CACHE_SIZE,
+    ttl_seconds=QUERY_CACHE_TTL_SECONDS,
+    db_path=QUERY_CACHE_DB,
+)
+
+# Reranker result cache, invalidated when the index version changes
+RERANK_CACHE_SIZE = 5000
+RERANK_CACHE_TTL_SECONDS = 24 * 3600
+
+rerank_cache = RerankCache(max_size=RERANK_CACHE_SIZE, ttl_seconds=RERANK_CACHE_TTL_SECONDS)
+
+# Concurrent identical queries share one retrieval run
+retrieval_flight = SingleFlight()
+
 # Reranker API configuration
-RERANKER_URL = "https://reranker-llm.alem.ai/v1/rerank"
+RERANKER_URL = f"{ALEM_RERANKER_BASE_URL}/v1/rerank"
 RERANKER_HEADERS = {
     "Authorization": f"Bearer {RERANK_API_KEY}",
     "Content-Type": "application/json"
 }
 
+class RetrievalResult(list):
+    """
+    List of context dictionaries (what find_best_match_alem always returned) that also carries
+    retrieval metadata for later stages: the query vector, document ids and content keys.
+    `served_by` tells which path produced it (SERVED_BY_* constants) and `degraded` why a
+    degraded path was used (DEGRADED_* constants, None for the normal pipeline).
+    """
+
+    def __init__(self, contexts, query_vector=None, doc_ids=(), doc_keys=(), scores=(), rerank_branch=None,
+                 served_by=SERVED_BY_ALEM, degraded=None):
+        super().__init__(contexts)
+        self.query_vector = query_vector
+        self.doc_ids = list(doc_ids)
+        self.doc_keys = list(doc_keys)
+        self.scores = list(scores)
+        self.rerank_branch = rerank_branch
+        self.served_by = served_by
+        self.degraded = degraded
+
 def load_precomputed_data():
     """
-    Loads precomputed embeddings and original data from pickle file.
+    Opens the memory-mapped vector store built by generate_embeddings.py.
+    Texts and rows are decoded lazily and vectors are float32 pages shared via the OS page cache,
+    so this is near-instant regardless of corpus size.
+    Vectors are returned wrapped in a search index (see SEARCH_BACKEND) ready for find_best_match_alem.
     Note: Caching is handled in app.py using @st.cache_resource.
     """
     print("Загружаю пред-рассчитанные векторы (Alem)...")
     try:
-        with open(EMBEDDINGS_FILE, "rb") as f:
-            data = pickle.load(f)
-        return data["texts"], data["vectors"], data["original_data"]
-    except FileNotFoundError:
-        print(f"ОШИБКА: Файл {EMBEDDINGS_FILE} не найден!")
+        store = load_vector_store(INDEX_DIR)
+    except ValueError as e:
+        print(f"ОШИБКА: {e}")
+        store = None
+    if store is None:
+        print(f"ОШИБКА: Индекс {INDEX_DIR} не найден!")
         print("Пожалуйста, сначала запустите generate_embeddings.py")
         return None, None, None
+    if store.model != EMBEDDER_MODEL:
+        print(f"ВНИМАНИЕ: индекс построен моделью '{store.model}', а запросы векторизуются '{EMBEDDER_MODEL}'.")
+    print(f"Индекс {store.index_version}: {len(store)} документов, размерность {store.header['dim']}.")
+    rerank_cache.set_index_version(store.index_version)
+    if LEXICAL_FALLBACK:
+        lexical_fallback.start_build(store.texts, store.index_version)
+    return store.texts, open_search_index(store), store.rows
 
-def get_embedding_for_query(text):
+def open_search_index(store):
     """
-    Calls Alem Embedder API to get embedding for a single user query.
+    Chooses the coarse search backend for a vector store and adds BM25 when HYBRID_SEARCH is on.
     """
-    payload = {"model": EMBEDDER_MODEL, "input": text}
-    try:
-        response = requests.post(EMBEDDER_URL, json=payload, headers=EMBEDDER_HEADERS, timeout=60)
-        response.raise_for_status()
-        data = response.json()
-        return data["data"][0]["embedding"]
-    except Exception as e:
-        print(f"Ошибка при получении вектора для запроса: {e}")
-        return None
+    vector_index = open_vector_index(store)
+    if not HYBRID_SEARCH:
+        return vector_index
+    bm25_index = load_bm25_index(store.path, len(store), store.header.get("bm25_tokenizer"))
+    if bm25_index is None:
+        # Index built before BM25 was added or with an older tokenizer: build it in memory from the stored texts
+        print("Поиск: BM25-индекс не найден или устарел, строю в памяти...")
+        bm25_index = BM25Index.build(store.texts)
+    return HybridSearchIndex(vector_index, bm25_index, candidates_per_retriever=HYBRID_CANDIDATES)
 
-def rerank_documents(query, documents_list):
+def open_vector_index(store):
     """
-    Calls Alem Reranker API to rerank list of documents based on query relevance.
+    Chooses the vector search backend for a vector store.
+    Falls back to exact search on small corpora or when no ANN index was built.
     """
-    payload = {
+    if SEARCH_BACKEND != "exact" and (SEARCH_BACKEND == "ivf" or len(store) >= ANN_MIN_DOCS):
+        ivf_index = load_ivf_index(store.path, store.vectors, nprobe=IVF_NPROBE)
+        if ivf_index is not None:
+            print(f"Поиск: IVF ({ivf_index.n_lists} списков, nprobe={IVF_NPROBE}).")
+            return ivf_index
+        print("Поиск: IVF-индекс не найден, использую точный поиск.")
+    if VECTOR_STORAGE != "float32" and store.normalized:
+        quantized_index = load_quantized_index(store.path, store.vectors, VECTOR_STORAGE)
+        if quantized_index is not None:
+            print(f"Поиск: точный, {VECTOR_STORAGE} с пересчетом в float32.")
+            return quantized_index
+        print(f"Поиск: {VECTOR_STORAGE}-копия не найдена, использую float32.")
+    return ExactSearchIndex(store.vectors, normalized=store.normalized)
+
+def embed_payload(texts):
+    return {"model": EMBEDDER_MODEL, "input": list(texts)}
+
+def parse_embeddings(data):
+    """Vectors of an embedder response, in input order."""
+    # Results carry their input position; do not rely on response order
+    items = sorted(data["data"], key=lambda item: item.get("index", 0))
+    return [item["embedding"] for item in items]
+
+def get_embeddings_for_queries(texts):
+    """
+    Calls Alem Embedder API once for a list of queries.
+    Returns vectors in the same order as `texts`; raises on errors.
+    """
+    response = post_json("embed", EMBEDDER_URL, embed_payload(texts), EMBEDDER_HEADERS)
+    return parse_embeddings(response.json())
+
+query_embedder = EmbeddingMicroBatcher(
+    get_embeddings_for_queries,
+    window_seconds=QUERY_BATCH_WINDOW_SECONDS,
+    max_batch_size=QUERY_BATCH_MAX_SIZE,
+    timeout_seconds=QUERY_EMBED_TIMEOUT_SECONDS,
+)
+
+def embed_query_steps(text):
+    """
+    Query embedding as a stage (see stages.py), shared with async_pipeline.embed():
+    query_embedding_cache, then one ("embed", text) step -> vector. Returns the vector, or None on error.
+    """
+    with tracer.span("embed", chars=len(text)) as span:
+        cached_vector = query_embedding_cache.get(text, EMBEDDER_MODEL)
+        span.set(cache_hit=cached_vector is not None)
+        if cached_vector is not None:
+            return cached_vector
+
+        try:
+            vector = yield ("embed", text)
+        except Exception as e:
+            print(f"Ошибка при получении вектора для запроса: {e}")
+            span.set(error=type(e).__name__)
+            return None
+
+        query_embedding_cache.put(text, EMBEDDER_MODEL, vector)
+        return vector
+
+def _embed_query(text):
+    if QUERY_BATCHING:
+        return query_embedder.embed(text)
+    return get_embeddings_for_queries([text])[0]
+
+def get_embedding_for_query(text):
+    """
+    Calls Alem Embedder API to get embedding for a single user query.
+    Repeated queries (after normalization) are served from query_embedding_cache;
+    misses from concurrent sessions are merged into one request by query_embedder.
+    """
+    return run_stage(embed_query_steps(text), {"embed": _embed_query})
+
+def get_cache_stats():
+    """Counters of the retrieval caches (hits = upstream API calls saved)."""
+    return {
+        "query_embeddings": query_embedding_cache.stats(),
+        "rerank": rerank_cache.stats(),
+        "query_batching": query_embedder.stats(),
+        "retrieval_single_flight": retrieval_flight.stats(),
+    }
+
+def rerank_payload(query, documents_list):
+    return {
         "query": query,
         "documents": documents_list,
         "top_n": TOP_N_RERANK
     }
-    
+
+def _request_rerank(query, documents_list):
+    """Raw reranker results (best first); raises on errors."""
+    response = post_json("rerank", RERANKER_URL, rerank_payload(query, documents_list), RERANKER_HEADERS)
+    return response.json().get("results", [])
+
+def rerank_steps(query, candidate_ids, candidate_texts):
+    """
+    Reranking as a stage (see stages.py), shared with async_pipeline.rerank(): rerank_cache,
+    then one ("rerank", query, texts) step -> raw results. Returns like rerank_candidates().
+    """
+    payload_bytes = sum(len(text.encode("utf-8")) for text in candidate_texts)
+    with tracer.span("rerank", candidates=len(candidate_ids), payload_bytes=payload_bytes) as span:
+        cached = rerank_cache.get(query, candidate_ids, TOP_N_RERANK)
+        span.set(cache_hit=cached is not None)
+        if cached is not None:
+            print("Alem-Поиск: Reranker (кэш).")
+            return cached
+
+        try:
+            results = yield ("rerank", query, candidate_texts)
+        except Exception as e:
+            print(f"Ошибка при вызове Reranker API: {e}")
+            span.set(error=type(e).__name__)
+            return None
+
+        ranked = map_rerank_results(results, candidate_ids, candidate_texts)
+        rerank_cache.put(query, candidate_ids, TOP_N_RERANK, ranked)
+        return ranked
+
+def rerank_candidates(query, candidate_ids, candidate_texts):
+    """
+    Reranks coarse-search candidates, served from rerank_cache when the same normalized
+    query was already ranked over the same candidates.
+    Returns list of (doc_id, relevance_score), best first ([] when nothing is relevant),
+    or None when the reranker call failed.
+    """
+    return run_stage(rerank_steps(query, candidate_ids, candidate_texts), {"rerank": _request_rerank})
+
+def map_rerank_results(results, candidate_ids, candidate_texts):
+    """
+    Parses Reranker response: maps each result's `index` (its position in the request's
+    documents) back to the candidate's doc id, so duplicate or re-whitespaced texts are
+    neither merged nor dropped. Results without an index fall back to exact text matching.
+    Returns list of (doc_id, relevance_score), best first.
+    """
+    positions_by_text = None
+    ranked, seen = [], set()
+    for result in results:
+        position = result.get("index")
+        if position is None:
+            if positions_by_text is None:
+                positions_by_text = {}
+                for i, text in enumerate(candidate_texts):
+                    positions_by_text.setdefault(text, []).append(i)
+            text = (result.get("document") or {}).get("text")
+            position = next((i for i in positions_by_text.get(text, ()) if i not in seen), None)
+        if position is None or not 0 <= position < len(candidate_ids) or position in seen:
+            print(f"Alem-Поиск: Reranker вернул неизвестный документ ({result.get('index')}), пропускаю.")
+            continue
+        seen.add(position)
+        ranked.append((int(candidate_ids[position]), float(result.get("relevance_score", 0.0))))
+    return ranked
+
+def coarse_search(query, query_vector, precomputed_vectors, top_k=TOP_K_RETRIEVAL):
+    """
+    Local top-k over the corpus: cosine + BM25 fused with RRF for a hybrid index,
+    cosine only otherwise. Returns (candidate ids, scores).
+    """
+    search_index = as_search_index(precomputed_vectors)
+    query_vector = np.asarray(query_vector, dtype=np.float32)
+    with tracer.span("coarse_search", k=top_k, backend=type(search_index).__name__) as span:
+        if hasattr(search_index, "hybrid_search"):
+            ids, scores = search_index.hybrid_search(query, query_vector, top_k)
+        else:
+            ids, scores = search_index.search(query_vector, top_k)
+        span.set(candidates=len(ids))
+        return ids, scores
+
+def plan_rerank(query_vector, precomputed_vectors, candidate_ids):
+    """
+    Applies rerank_policy to the cosine scores of the coarse candidates.
+    Every branch keeps the coarse order of `candidate_ids` (RRF-fused for hybrid search):
+    SHORT sends its head, SKIP and the fallbacks serve it.
+    Returns (branch, ids to send to the reranker, candidates in coarse order as (doc_id, cosine)).
+    """
+    search_index = as_search_index(precomputed_vectors)
+    cosine = score_candidates(search_index.vectors, query_vector, candidate_ids)
+    coarse_ranked = [(int(doc_id), float(score)) for doc_id, score in zip(candidate_ids, cosine)]
+
+    if not ADAPTIVE_RERANK:
+        return "full", list(candidate_ids), coarse_ranked
+    branch, n_candidates, features = rerank_policy.decide(cosine, len(candidate_ids))
+    print(f"Alem-Поиск: политика Reranker -> {branch} ({n_candidates} канд.), "
+          + ", ".join(f"{name}={value:.3f}" for name, value in features.items()))
+    return branch, list(candidate_ids[:n_candidates]), coarse_ranked
+
+def call_before_deadline(deadline, fn, *args):
+    """
+    Runs fn(*args) in upstream_executor and waits for it until the time.monotonic() `deadline`.
+    Returns (result, True), or (None, False) if the deadline passed first.
+    """
+    # copy_context(): spans opened by fn stay in the caller's trace
+    future = upstream_executor.submit(contextvars.copy_context().run, fn, *args)
     try:
-        response = requests.post(RERANKER_URL, json=payload, headers=RERANKER_HEADERS, timeout=60)
-        response.raise_for_status()
-        data = response.json()
-        
-        # Parse Reranker response
-        reranked_texts = [result["document"]["text"] for result in data.get("results", [])]
-        return reranked_texts
-
-    except Exception as e:
-        print(f"Ошибка при вызове Reranker API: {e}")
-        return []
+        return future.result(timeout=max(0.0, deadline - time.monotonic())), True
+    except FuturesTimeout:
+        return None, False
+
+def lexical_search(query, precomputed_texts, original_data, degraded=DEGRADED_ERROR):
+    """
+    Degraded retrieval without any upstream call: TF-IDF over character n-grams.
+    Returns RetrievalResult (served_by=SERVED_BY_LEXICAL), or None.
+    """
+    if not LEXICAL_FALLBACK or not lexical_fallback.ready:
+        print("Резервный поиск: TF-IDF индекс недоступен.")
+        return None
+    ids, scores = lexical_fallback.search(query, TOP_N_RERANK)
+    if len(ids) == 0:
+        print("Резервный поиск: ничего не найдено.")
+        return None
+    print(f"Резервный поиск: TF-IDF нашел {len(ids)} документов.")
+    reranked = [(int(doc_id), float(score)) for doc_id, score in zip(ids, scores)]
+    return build_retrieval_result(None, reranked, precomputed_texts, original_data,
+                                  served_by=SERVED_BY_LEXICAL, degraded=degraded)
+
+def finish_retrieval(query_vector, branch, reranked, on_time, coarse_ranked, precomputed_texts, original_data):
+    """
+    Last step of the sync and async pipelines: turns the outcome of the rerank step into the result.
+    A failed (None) or late reranker call -> coarse order, served_by=SERVED_BY_COARSE;
+    an empty ranking -> None, so the caller asks for clarification (Plan C).
+    """
+    if reranked is None or not on_time:
+        degraded = DEGRADED_ERROR if on_time else DEGRADED_TIMEOUT
+        reason = "недоступен" if on_time else f"не уложился в {RETRIEVAL_DEADLINE_SECONDS} с"
+        print(f"Alem-Поиск: Reranker {reason}, использую порядок Coarse Search.")
+        return build_retrieval_result(query_vector, coarse_ranked[:TOP_N_RERANK], precomputed_texts, original_data,
+                                      rerank_branch=branch, served_by=SERVED_BY_COARSE, degraded=degraded)
+    if not reranked:
+        print("Alem-Поиск: Reranker не нашел релевантных документов.")
+        return None
+    if branch == SKIP:
+        print(f"Alem-Поиск: Reranker пропущен ({branch}), беру {len(reranked)} лучших из Coarse Search.")
+    else:
+        print(f"Alem-Поиск: Reranker ({branch}) вернул {len(reranked)} лучших.")
+    return build_retrieval_result(query_vector, reranked, precomputed_texts, original_data, rerank_branch=branch)
+
+def document_key(precomputed_texts, doc_id):
+    """Content key of a document: read from the index (keys.npy), computed only for plain text lists."""
+    if isinstance(precomputed_texts, DocumentTexts):
+        return precomputed_texts.key(doc_id)
+    return content_key(precomputed_texts[doc_id], EMBEDDER_MODEL)
+
+def build_retrieval_result(query_vector, reranked, precomputed_texts, original_data, rerank_branch=None,
+                           served_by=SERVED_BY_ALEM, degraded=None):
+    """
+    Maps reranked ids back to original data dictionaries.
+    """
+    with tracer.span("map_contexts", documents=len(reranked)):
+        doc_ids = [doc_id for doc_id, _ in reranked]
+        return RetrievalResult(
+            [original_data[doc_id] for doc_id in doc_ids],
+            query_vector=None if query_vector is None else np.asarray(query_vector, dtype=np.float32),
+            doc_ids=doc_ids,
+            doc_keys=[document_key(precomputed_texts, doc_id) for doc_id in doc_ids],
+            scores=[score for _, score in reranked],
+            rerank_branch=rerank_branch,
+            served_by=served_by,
+            degraded=degraded,
+        )
 
 def find_best_match_alem(query, precomputed_texts, precomputed_vectors, original_data):
     """
-    Full retrieval pipeline: Embed Query -> Coarse Search (k=20) -> Rerank (k=3).
-    Returns list of context dictionaries for RAG.
+    Full retrieval pipeline: Embed Query -> Coarse Search (cosine + BM25, k=20) -> Rerank (k=3).
+    `precomputed_vectors` is a search index from load_precomputed_data (a raw matrix also works,
+    but is then normalized on every call).
+    Concurrent calls with the same normalized query share one run and one (read-only) result.
+    Upstream calls share a RETRIEVAL_DEADLINE_SECONDS budget; when it runs out the result is
+    served by a degraded path (see RetrievalResult.served_by) instead of waiting.
+    Returns RetrievalResult (a list of context dictionaries for RAG), or None.
+    """
+    with tracer.span("retrieve") as span:
+        result = retrieval_flight.do(normalize_query(query), _find_best_match_alem,
+                                     query, precomputed_texts, precomputed_vectors, original_data)
+        span.set(found=bool(result), served_by=getattr(result, "served_by", None),
+                 rerank_branch=getattr(result, "rerank_branch", None))
+        return result
+
+def retrieval_steps(query, precomputed_texts, precomputed_vectors, original_data):
+    """
+    Single retrieval run as a stage (see stages.py), driven by _find_best_match_alem() and
+    async_pipeline._retrieve(). Upstream steps get the shared time.monotonic() deadline:
+        ("embed", query, deadline)                -> (vector or None, on time)
+        ("rerank", query, ids, texts, deadline)   -> (ranking or None, on time)
+        ("local", fn, *args)                      -> fn(*args), local CPU work
     """
-    
+    deadline = time.monotonic() + RETRIEVAL_DEADLINE_SECONDS
+
     # Step 1: Embed user query
     print(f"Alem-Поиск: Векторизую запрос '{query}'...")
-    query_vector = get_embedding_for_query(query)
+    query_vector, on_time = yield ("embed", query, deadline)
     if query_vector is None:
-        return None
+        reason = "ошибка" if on_time else f"не уложился в {RETRIEVAL_DEADLINE_SECONDS} с"
+        print(f"Alem-Поиск: Embedder недоступен ({reason}), перехожу на резервный поиск.")
+        return (yield ("local", lexical_search, query, precomputed_texts, original_data,
+                       DEGRADED_ERROR if on_time else DEGRADED_TIMEOUT))
 
-    query_vector = np.array(query_vector).reshape(1, -1)
-    
     # Step 2: Coarse search using cosine similarity (local computation)
     print(f"Alem-Поиск: Ищу {TOP_K_RETRIEVAL} кандидатов (Coarse Search)...")
-    scores = cosine_similarity(query_vector, precomputed_vectors)
-    
-    top_k_indices = np.argsort(scores[0])[-TOP_K_RETRIEVAL:][::-1]
-    
-    candidate_texts_for_reranker = [precomputed_texts[i] for i in top_k_indices]
-    
-    # Step 3: Fine search using Reranker API
-    print(f"Alem-Поиск: Отправляю {len(candidate_texts_for_reranker)} кандидатов в Reranker...")
-    reranked_texts = rerank_documents(query, candidate_texts_for_reranker)
-    
-    if not reranked_texts:
-        print("Alem-Поиск: Reranker ничего не вернул.")
+    top_k_indices, _ = yield ("local", coarse_search, query, query_vector, precomputed_vectors)
+    if len(top_k_indices) == 0:
         return None
-    
-    print(f"Alem-Поиск: Reranker вернул {len(reranked_texts)} лучших.")
-
-    # Step 4: Map reranked texts back to original data dictionaries
-    text_to_dict_map = {precomputed_texts[i]: original_data[i] for i in range(len(original_data))}
-    
-    final_contexts_list = []
-    for text in reranked_texts:
-        if text in text_to_dict_map:
-            final_contexts_list.append(text_to_dict_map[text])
-        
-    return final_contexts_list
\ No newline at end of file
+
+    # Step 3: Fine search using Reranker API (skipped or shortened by rerank_policy)
+    branch, rerank_ids, coarse_ranked = plan_rerank(query_vector, precomputed_vectors, top_k_indices)
+    if branch == SKIP:
+        reranked, on_time = coarse_ranked[:TOP_N_RERANK], True
+    else:
+        candidate_texts_for_reranker = [precomputed_texts[i] for i in rerank_ids]
+        print(f"Alem-Поиск: Отправляю {len(candidate_texts_for_reranker)} кандидатов в Reranker...")
+        reranked, on_time = yield ("rerank", query, rerank_ids, candidate_texts_for_reranker, deadline)
+
+    # Step 4: Map reranked ids back to original data dictionaries (or degrade / Plan C)
+    return finish_retrieval(query_vector, branch, reranked, on_time, coarse_ranked,
+                            precomputed_texts, original_data)
+
+def _find_best_match_alem(query, precomputed_texts, precomputed_vectors, original_data):
+    """Single retrieval run behind find_best_match_alem(); upstream calls run in upstream_executor."""
+    return run_stage(retrieval_steps(query, precomputed_texts, precomputed_vectors, original_data), {
+        "embed": lambda text, deadline: call_before_deadline(deadline, get_embedding_for_query, text),
+        "rerank": lambda text, ids, texts, deadline: call_before_deadline(deadline, rerank_candidates,
+                                                                          text, ids, texts),
+        "local": lambda fn, *args: fn(*args),
+    })
@@ -8,6 +8,8 @@ import os
 
 load_dotenv()
 
+GEMINI_MIN_INTERVAL_SECONDS = 1.1  # Pace of the Gemini calls (free-tier quota)
+
 # Configure API key (same as llm_handler)
 try:
     YOUR_API_KEY = os.getenv("GOOGLE_API_KEY")
@@ -19,6 +21,15 @@ except Exception as e:
     YOUR_API_KEY = None
 
 model = genai.GenerativeModel(model_name="gemini-2.0-flash")
+_last_call = None
+
+def generate_content(prompt):
+    """Gemini call, at most one per GEMINI_MIN_INTERVAL_SECONDS (calls are sequential)."""
+    global _last_call
+    if _last_call is not None:
+        time.sleep(max(0.0, _last_call + GEMINI_MIN_INTERVAL_SECONDS - time.monotonic()))
+    _last_call = time.monotonic()
+    return model.generate_content(prompt)
 
 def create_golden_list_prompt(dirty_tag_list):
     """
@@ -84,7 +95,7 @@ def generate_golden_list(dirty_tag_list):
     """
     prompt = create_golden_list_prompt(dirty_tag_list)
     try:
-        response = model.generate_content(prompt)
+        response = generate_content(prompt)
         # Clean LLM response: keep only words, commas, and spaces
         clean_list_string = re.sub(r'[^\w\s,]', '', response.text).strip()
         print(f"--- LLM СГЕНЕРИРОВАЛ 'ЗОЛОТОЙ СПИСОК' ---\n{clean_list_string}\n----------------------------------")
@@ -102,7 +113,7 @@ def clean_tag_with_llm(dirty_tag, golden_list_string):
     
     prompt = create_cleaning_prompt(dirty_tag, golden_list_string)
     try:
-        response = model.generate_content(prompt)
+        response = generate_content(prompt)
         clean_tag = response.text.strip().strip('"')
         return clean_tag
     except Exception as e:
@@ -149,7 +160,6 @@ def main_cleaner():
     for tag in tqdm(unique_dirty_tags):
         clean_version = clean_tag_with_llm(tag, golden_list_string)
         mapping[tag] = clean_version
-        time.sleep(1.1)  # Rate limiting for API
 
     # Apply mapping to entire dataset
     print("Очистка завершена. Применяю маппинг к файлу...")
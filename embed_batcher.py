@@ -0,0 +1,103 @@
+import time
+import queue
+import asyncio
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FuturesTimeout
+
+
+class EmbeddingMicroBatcher:
+    """
+    Collects query embeddings requested by concurrent callers (Streamlit session threads or
+    the API event loop) during a short window and sends them as one embedder request.
+    The first query of a batch waits at most `window_seconds`; a batch is flushed early once
+    it reaches `max_batch_size`. Each caller gets its own vector back through a Future;
+    a caller that gives up (cancels or times out after `timeout_seconds`) leaves the others unaffected.
+    """
+
+    def __init__(self, embed_batch_fn, window_seconds=0.005, max_batch_size=32, max_concurrent_batches=4,
+                 timeout_seconds=60.0):
+        self.embed_batch_fn = embed_batch_fn
+        self.timeout_seconds = timeout_seconds
+        self.window_seconds = window_seconds
+        self.max_batch_size = max_batch_size
+        self._queue = queue.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrent_batches,
+                                            thread_name_prefix="embed-batch")
+        self._worker = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.batches = 0
+        self.queries = 0
+
+    def _ensure_worker(self):
+        with self._start_lock:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._collect_loop, name="embed-batcher", daemon=True)
+                self._worker.start()
+
+    def submit(self, text):
+        """Queues one text; returns a Future resolved with its vector."""
+        self._ensure_worker()
+        future = Future()
+        self._queue.put((text, future))
+        return future
+
+    def embed(self, text, timeout=None):
+        """
+        Blocking: returns the vector for `text`. Raises if the batch request failed, or
+        TimeoutError after `timeout` (default timeout_seconds).
+        """
+        future = self.submit(text)
+        try:
+            return future.result(timeout=self.timeout_seconds if timeout is None else timeout)
+        except FuturesTimeout:
+            future.cancel()
+            raise
+
+    async def embed_async(self, text, timeout=None):
+        """Awaitable version of embed()."""
+        return await asyncio.wait_for(asyncio.wrap_future(self.submit(text)),
+                                      self.timeout_seconds if timeout is None else timeout)
+
+    def stats(self):
+        return {
+            "batches": self.batches,
+            "queries": self.queries,
+            "avg_batch_size": self.queries / self.batches if self.batches else 0.0,
+        }
+
+    def _collect_loop(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.window_seconds
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._executor.submit(self._run_batch, batch)
+
+    def _run_batch(self, batch):
+        # Callers that gave up while queued are dropped; the rest can no longer be cancelled
+        batch = [(text, future) for text, future in batch if future.set_running_or_notify_cancel()]
+        if not batch:
+            return
+        # Identical texts in one window are embedded once
+        unique_texts = list(dict.fromkeys(text for text, _ in batch))
+        with self._stats_lock:
+            self.batches += 1
+            self.queries += len(batch)
+        try:
+            vectors = self.embed_batch_fn(unique_texts)
+            if len(vectors) != len(unique_texts):
+                raise ValueError(f"Embedder вернул {len(vectors)} векторов на {len(unique_texts)} запросов")
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        by_text = dict(zip(unique_texts, vectors))
+        for text, future in batch:
+            future.set_result(by_text[text])
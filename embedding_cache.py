@@ -0,0 +1,141 @@
+import re
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+import numpy as np
+
+
+def normalize_query(text):
+    """
+    Canonical form of a user query for cache keys:
+    lowercase, ё -> е, collapsed whitespace, no surrounding punctuation.
+    """
+    text = text.lower().replace("ё", "е")
+    text = re.sub(r"\s+", " ", text)
+    return text.strip(" \t\n?!.,;:\"'«»()")
+
+
+class QueryEmbeddingCache:
+    """
+    Two-tier cache of query embeddings keyed by (normalized query, embedder model).
+    Tier 1: in-process LRU bounded by `max_size`. Tier 2 (optional): SQLite file that survives
+    restarts and is shared by all Streamlit workers on the host. Entries expire after `ttl_seconds`.
+    """
+
+    # Expired disk rows are pruned on every N-th write
+    PRUNE_EVERY = 500
+
+    def __init__(self, max_size=10000, ttl_seconds=7 * 24 * 3600, db_path=None, max_disk_entries=200000):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.max_disk_entries = max_disk_entries
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._writes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self._db = None
+        if db_path:
+            try:
+                self._db = sqlite3.connect(db_path, timeout=5, check_same_thread=False)
+                self._db.execute("PRAGMA journal_mode=WAL")
+                self._db.execute(
+                    "CREATE TABLE IF NOT EXISTS query_embeddings "
+                    "(key TEXT PRIMARY KEY, created REAL NOT NULL, vector BLOB NOT NULL)"
+                )
+                self._db.commit()
+            except sqlite3.Error as e:
+                print(f"Кэш векторов: не удалось открыть {db_path} ({e}), работаю только в памяти.")
+                self._db = None
+
+    @staticmethod
+    def make_key(query, model):
+        return hashlib.sha256(f"{model}\n{normalize_query(query)}".encode("utf-8")).hexdigest()
+
+    def get(self, query, model):
+        """Returns the cached float32 vector or None."""
+        key = self.make_key(query, model)
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                created, vector = entry
+                if now - created < self.ttl_seconds:
+                    self._memory.move_to_end(key)
+                    self.hits += 1
+                    return vector
+                del self._memory[key]
+
+            vector = self._disk_get(key, now)
+            if vector is not None:
+                self._memory_put(key, now, vector)
+                self.hits += 1
+                self.disk_hits += 1
+                return vector
+
+            self.misses += 1
+            return None
+
+    def put(self, query, model, vector):
+        key = self.make_key(query, model)
+        vector = np.asarray(vector, dtype=np.float32)
+        now = time.time()
+        with self._lock:
+            self._memory_put(key, now, vector)
+            self._disk_put(key, now, vector)
+
+    def stats(self):
+        """Hit/miss counters; every hit is one embedder API call saved."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "size": len(self._memory),
+            }
+
+    def _memory_put(self, key, created, vector):
+        self._memory[key] = (created, vector)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_size:
+            self._memory.popitem(last=False)
+
+    def _disk_get(self, key, now):
+        if self._db is None:
+            return None
+        try:
+            row = self._db.execute(
+                "SELECT created, vector FROM query_embeddings WHERE key = ?", (key,)
+            ).fetchone()
+        except sqlite3.Error as e:
+            print(f"Кэш векторов: ошибка чтения SQLite: {e}")
+            return None
+        if row is None or now - row[0] >= self.ttl_seconds:
+            return None
+        return np.frombuffer(row[1], dtype=np.float32)
+
+    def _disk_put(self, key, created, vector):
+        if self._db is None:
+            return
+        try:
+            self._db.execute(
+                "INSERT OR REPLACE INTO query_embeddings (key, created, vector) VALUES (?, ?, ?)",
+                (key, created, vector.tobytes()),
+            )
+            self._writes += 1
+            if self._writes % self.PRUNE_EVERY == 0:
+                self._db.execute("DELETE FROM query_embeddings WHERE created < ?", (created - self.ttl_seconds,))
+                self._db.execute(
+                    "DELETE FROM query_embeddings WHERE key IN (SELECT key FROM query_embeddings "
+                    "ORDER BY created DESC LIMIT -1 OFFSET ?)",
+                    (self.max_disk_entries,),
+                )
+            self._db.commit()
+        except sqlite3.Error as e:
+            print(f"Кэш векторов: ошибка записи SQLite: {e}")
@@ -0,0 +1,148 @@
+import os
+import json
+import time
+import threading
+import numpy as np
+
+# Progress log of generate_embeddings.py: <path>.keys is the small key -> row index,
+# the vectors live in a binary float32 file named in its header.
+INDEX_SUFFIX = ".keys"
+COPY_CHUNK_ROWS = 4096  # Rows copied at once while compacting
+
+
+class EmbeddingLog:
+    """
+    Append-only log of document embeddings, so an interrupted indexing run resumes where it stopped.
+    Vectors are raw float32 rows in a binary file; the index file is a JSON header line
+    {"dim", "vectors"} followed by one content key per row. A batch of rows is synced before
+    its keys are written, so every complete key line points to a complete row, and a torn tail
+    left by an interrupted write is cut off on open. Only the keys are held in memory.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.index_path = path + INDEX_SUFFIX
+        self.dim = None
+        self.vectors_path = None
+        self.rows = {}  # content key -> row in the vectors file (last write wins)
+        self._count = 0
+        self._lock = threading.Lock()
+        self._vectors_file = None
+        self._index_file = None
+        if os.path.exists(self.index_path):
+            self._load()
+
+    def _load(self):
+        with open(self.index_path, mode='rb') as f:
+            lines = f.read().split(b"\n")
+        # The piece after the last newline is empty or a torn line
+        try:
+            header = json.loads(lines[0]) if len(lines) > 1 else None
+            self.dim = int(header["dim"])
+            self.vectors_path = os.path.join(os.path.dirname(os.path.abspath(self.index_path)), header["vectors"])
+        except (TypeError, ValueError, KeyError):
+            print(f"Кэш векторов '{self.index_path}' поврежден, начинаю заново.")
+            os.remove(self.index_path)
+            self.dim = self.vectors_path = None
+            return
+
+        row_bytes = self.dim * np.dtype(np.float32).itemsize
+        stored_rows = os.path.getsize(self.vectors_path) // row_bytes if os.path.exists(self.vectors_path) else 0
+        keys = lines[1:-1][:stored_rows]
+        for row, key in enumerate(keys):
+            self.rows[key.decode('ascii')] = row
+        self._count = len(keys)
+
+        # Drop rows without a key and keys without a row, so appends stay aligned
+        with open(self.index_path, mode='r+b') as f:
+            f.truncate(len(lines[0]) + 1 + sum(len(key) + 1 for key in keys))
+        if os.path.exists(self.vectors_path):
+            with open(self.vectors_path, mode='r+b') as f:
+                f.truncate(self._count * row_bytes)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __contains__(self, key):
+        return key in self.rows
+
+    def _new_vectors_path(self):
+        return f"{self.path}.{time.time_ns():x}.f32"
+
+    def _write_index(self, path, keys):
+        header = {"dim": self.dim, "vectors": os.path.basename(self.vectors_path)}
+        with open(path, mode='wb') as f:
+            f.write((json.dumps(header) + "\n").encode('ascii'))
+            f.write("".join(key + "\n" for key in keys).encode('ascii'))
+            f.flush()
+            os.fsync(f.fileno())
+
+    def append(self, keys, vectors):
+        """Appends one batch durably: rows first, then their keys."""
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        with self._lock:
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+                self.vectors_path = self._new_vectors_path()
+                self._write_index(self.index_path, [])
+            if vectors.shape[1] != self.dim:
+                raise ValueError(f"Размерность {vectors.shape[1]} не совпадает с кэшем ({self.dim})")
+            if self._vectors_file is None:
+                self._vectors_file = open(self.vectors_path, mode='ab')
+                self._index_file = open(self.index_path, mode='ab')
+
+            self._vectors_file.write(vectors.tobytes())
+            self._vectors_file.flush()
+            os.fsync(self._vectors_file.fileno())
+            self._index_file.write("".join(key + "\n" for key in keys).encode('ascii'))
+            self._index_file.flush()
+            os.fsync(self._index_file.fileno())
+            for key in keys:
+                self.rows[key] = self._count
+                self._count += 1
+
+    def close(self):
+        with self._lock:
+            for f in (self._vectors_file, self._index_file):
+                if f is not None:
+                    f.close()
+            self._vectors_file = self._index_file = None
+
+    def _stored_vectors(self):
+        return np.memmap(self.vectors_path, dtype=np.float32, mode='r', shape=(self._count, self.dim))
+
+    def vectors(self, keys):
+        """float32 matrix of the vectors of `keys`, in that order (all must be present)."""
+        return np.array(self._stored_vectors()[[self.rows[key] for key in keys]], dtype=np.float32)
+
+    def compact(self, keep_keys):
+        """
+        Rewrites the log with only `keep_keys`, dropping vectors of deleted or changed rows.
+        The new vectors go to a new file and the index is swapped in atomically, so an
+        interruption leaves either the old log or the new one. Nothing is rewritten when
+        every stored row is still kept.
+        """
+        self.close()
+        if self.dim is None:
+            return
+        keys = list(dict.fromkeys(key for key in keep_keys if key in self.rows))
+        # Rows overwritten by a later append of the same key count as stale too
+        if len(keys) == self._count:
+            return
+        old_vectors_path, stored = self.vectors_path, self._stored_vectors()
+        self.vectors_path = self._new_vectors_path()
+        with open(self.vectors_path, mode='wb') as f:
+            for start in range(0, len(keys), COPY_CHUNK_ROWS):
+                rows = [self.rows[key] for key in keys[start:start + COPY_CHUNK_ROWS]]
+                f.write(np.ascontiguousarray(stored[rows]).tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        del stored
+
+        tmp_path = self.index_path + ".tmp"
+        self._write_index(tmp_path, keys)
+        os.replace(tmp_path, self.index_path)
+        os.remove(old_vectors_path)
+        self.rows = {key: row for row, key in enumerate(keys)}
+        self._count = len(keys)
+
@@ -1,12 +1,18 @@
 import os
-import requests
-import time
-import pickle
-import numpy as np
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from tqdm import tqdm
 from dotenv import load_dotenv
 
 from data_handler import load_data_from_csv
+from rate_limiter import RateLimiter, estimate_tokens
+from http_client import post_json
+from upstream_scheduler import BATCH
+from vector_store import content_key as _content_key, save_vector_store
+from search_engine import normalize_rows
+from embedding_log import EmbeddingLog
+from ann_index import IVFIndex
+from quantization import quantized_arrays
+from bm25_index import BM25Index, TOKENIZER_VERSION
 
 # Load embedder API key from .env
 load_dotenv()
@@ -16,38 +22,103 @@ if not EMBED_API_KEY:
     raise ValueError("EMBED_API_KEY не найден в вашем .env файле!")
 
 # Configuration
-EMBEDDER_URL = "https://llm.alem.ai/v1/embeddings"
+ALEM_BASE_URL = os.getenv("ALEM_BASE_URL", "https://llm.alem.ai")  # Overridable (env or .env)
+EMBEDDER_URL = f"{ALEM_BASE_URL}/v1/embeddings"
 EMBEDDER_MODEL = "text-1024"
-OUTPUT_FILE = "alem_embeddings.pkl"
+OUTPUT_DIR = "alem_index"  # Memory-mapped vector store, see vector_store.py
+CACHE_PATH = "alem_embeddings.cache"  # Append-only progress log: float32 vectors + key index, see embedding_log.py
+ANN_MIN_DOCS = 10000  # Build the IVF ANN index only for corpora at least this large
+ANN_N_LISTS = None  # Number of IVF lists; None means ~4*sqrt(N)
+QUANTIZED_MODES = ("int8", "float16")  # Compact copies for first-pass scoring, see quantization.py
+
+# Batching and quota configuration
+BATCH_SIZE = 32  # Number of texts sent in one embedder request
+MAX_CONCURRENT_REQUESTS = 4  # Number of embedder requests in flight
+REQUESTS_PER_SECOND = 1.0  # Pace of this job, below the embedder quota so chat traffic keeps headroom
+TOKENS_PER_MINUTE = 200000  # Token pace of this job
 
 EMBEDDER_HEADERS = {
     "Authorization": f"Bearer {EMBED_API_KEY}",
     "Content-Type": "application/json"
 }
 
-def get_embedding(text):
+rate_limiter = RateLimiter(REQUESTS_PER_SECOND, TOKENS_PER_MINUTE)
+
+def get_embeddings_batch(texts):
     """
-    Calls Alem Embedder API to get embedding for a single text.
+    Calls Alem Embedder API to get embeddings for a list of texts in one request.
+    Waits for the rate limiter before every attempt and is admitted by the shared embedder
+    scheduler with BATCH priority, behind interactive queries of the same process;
+    429/5xx and network errors are retried by http_client (endpoint "embed_batch").
+    Returns list of vectors in the same order as `texts`, or None on failure.
     """
     payload = {
         "model": EMBEDDER_MODEL,
-        "input": text
+        "input": texts
     }
+    token_cost = sum(estimate_tokens(text) for text in texts)
 
     try:
-        response = requests.post(EMBEDDER_URL, json=payload, headers=EMBEDDER_HEADERS, timeout=60)
-        response.raise_for_status()
+        response = post_json("embed_batch", EMBEDDER_URL, payload, EMBEDDER_HEADERS,
+                             before_attempt=lambda: rate_limiter.acquire(token_cost),
+                             priority=BATCH, token_cost=token_cost)
         data = response.json()
-        embedding = data["data"][0]["embedding"]
-        return embedding
+        # Results carry their input position; do not rely on response order
+        items = sorted(data["data"], key=lambda item: item.get("index", 0))
+        return [item["embedding"] for item in items]
     except Exception as e:
-        print(f"Ошибка при получении вектора для текста: '{text[:20]}...': {e}")
+        print(f"Ошибка при получении векторов для {len(texts)} текстов: {e}")
         return None
 
+def get_embedding(text):
+    """
+    Calls Alem Embedder API to get embedding for a single text.
+    """
+    vectors = get_embeddings_batch([text])
+    if not vectors:
+        print(f"Ошибка при получении вектора для текста: '{text[:20]}...'")
+        return None
+    return vectors[0]
+
+def content_key(text):
+    """Content key of a document for the configured embedder model."""
+    return _content_key(text, EMBEDDER_MODEL)
+
+def embed_texts(texts, on_batch=None):
+    """
+    Embeds texts in batches of BATCH_SIZE with up to MAX_CONCURRENT_REQUESTS requests in parallel.
+    Throughput is bounded by the rate limiter, not by a serial loop.
+    `on_batch(batch_texts, batch_vectors)` is called for every successful batch as it completes.
+    Returns list aligned with `texts`; entries are None for batches that failed.
+    """
+    vectors = [None] * len(texts)
+    batch_starts = range(0, len(texts), BATCH_SIZE)
+
+    with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_REQUESTS) as executor:
+        futures = {
+            executor.submit(get_embeddings_batch, texts[start:start + BATCH_SIZE]): start
+            for start in batch_starts
+        }
+        with tqdm(total=len(texts)) as progress:
+            for future in as_completed(futures):
+                start = futures[future]
+                batch_vectors = future.result()
+                batch_len = min(BATCH_SIZE, len(texts) - start)
+                if batch_vectors and len(batch_vectors) == batch_len:
+                    vectors[start:start + batch_len] = batch_vectors
+                    if on_batch is not None:
+                        on_batch(texts[start:start + batch_len], batch_vectors)
+                else:
+                    print(f"Ошибка: пакет {start}-{start + batch_len} не получил векторов.")
+                progress.update(batch_len)
+
+    return vectors
+
 def main_generate():
     """
     Main function to generate embeddings for all FAQ documents.
-    Combines questions and answers, gets embeddings via API, and saves to pickle file.
+    Combines questions and answers and embeds only rows whose content key is not cached yet.
+    Progress is appended to the CACHE_PATH log per batch, so an interrupted run resumes where it stopped.
     """
     print("--- Запуск скрипта генерации векторов (Alem Embedder) ---")
     
@@ -65,34 +136,59 @@ def main_generate():
         a = item.get('answers', '')
         combined_texts.append(f"Вопрос: {q} Ответ: {a}")
 
-    print(f"Получаю векторы для {len(combined_texts)} документов. Это может занять время...")
-    
-    all_vectors = []
-    texts_with_vectors = []
-    
-    for text in tqdm(combined_texts):
-        vector = get_embedding(text)
-        if vector:
-            all_vectors.append(vector)
-            texts_with_vectors.append(text)
-        
-        # Rate limiting for API
-        time.sleep(1.1) 
+    keys = [content_key(text) for text in combined_texts]
+    cache = EmbeddingLog(CACHE_PATH)
+
+    # Only new or changed texts go to the API; duplicates are embedded once
+    missing = {}
+    for key, text in zip(keys, combined_texts):
+        if key not in cache:
+            missing[key] = text
+    unique_count = len(set(keys))
+    print(f"В кэше {unique_count - len(missing)} из {unique_count} уникальных документов, "
+          f"осталось получить {len(missing)}.")
 
-    if not all_vectors:
-        print("Ошибка: не получено ни одного вектора.")
+    if missing:
+        print(f"Получаю векторы для {len(missing)} документов "
+              f"(пакеты по {BATCH_SIZE}, до {MAX_CONCURRENT_REQUESTS} запросов параллельно)...")
+
+        def save_batch(batch_texts, batch_vectors):
+            cache.append([content_key(text) for text in batch_texts], batch_vectors)
+
+        embed_texts(list(missing.values()), on_batch=save_batch)
+        cache.close()
+
+    still_missing = sum(1 for key in keys if key not in cache)
+    if still_missing:
+        print(f"Ошибка: {still_missing} документов остались без векторов. "
+              f"Прогресс сохранен в '{cache.index_path}', запустите скрипт еще раз.")
         return
 
-    embeddings_matrix = np.array(all_vectors)
+    # Drop vectors of rows that were deleted or changed since the last build (no-op if none)
+    cache.compact(keys)
+
+    embeddings_matrix = normalize_rows(cache.vectors(keys))
+
+    # Small corpora are served by exact search; the ANN index only pays off at scale
+    extra_arrays = quantized_arrays(embeddings_matrix, QUANTIZED_MODES)
+    extra_header = {"quantized": list(QUANTIZED_MODES)}
+
+    # Lexical side of hybrid search, built from the same rows as the vectors
+    print("Строю BM25-индекс...")
+    extra_arrays.update(BM25Index.build(combined_texts).arrays())
+    extra_header["bm25_tokenizer"] = TOKENIZER_VERSION
+    if len(keys) >= ANN_MIN_DOCS:
+        print(f"Строю IVF-индекс для {len(keys)} документов...")
+        ivf_index = IVFIndex.build(embeddings_matrix, n_lists=ANN_N_LISTS)
+        extra_arrays.update(ivf_index.arrays())
+        extra_header["ann"] = {"type": "ivf", "n_lists": ivf_index.n_lists}
 
-    with open(OUTPUT_FILE, "wb") as f:
-        pickle.dump({
-            "texts": texts_with_vectors,
-            "vectors": embeddings_matrix,
-            "original_data": faq_data
-        }, f)
+    header = save_vector_store(OUTPUT_DIR, EMBEDDER_MODEL, keys, combined_texts,
+                               embeddings_matrix, faq_data, normalize=True,
+                               extra_arrays=extra_arrays, extra_header=extra_header)
         
-    print(f"\nГотово! Векторы ({embeddings_matrix.shape}) сохранены в '{OUTPUT_FILE}'")
+    print(f"\nГотово! Векторы ({header['count']}, {header['dim']}) сохранены в '{OUTPUT_DIR}' "
+          f"(версия индекса {header['index_version']})")
 
 if __name__ == "__main__":
-    main_generate()
\ No newline at end of file
+    main_generate()
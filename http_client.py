@@ -0,0 +1,392 @@
+import time
+import random
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import requests
+from requests.adapters import HTTPAdapter
+
+from upstream_scheduler import INTERACTIVE, schedulers
+from stages import run_stage
+
+# Shared HTTP client for all Alem upstreams (embedder, reranker, LLM).
+# One requests.Session keeps a keep-alive connection pool per host, so TCP+TLS
+# handshakes are paid once per connection instead of once per call.
+POOL_CONNECTIONS = 8  # Number of per-host pools kept
+POOL_MAXSIZE = 32  # Keep-alive connections per host (>= concurrent sessions per process)
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+RETRY_BACKOFF_SECONDS = 0.5
+RETRY_BACKOFF_MAX_SECONDS = 30.0
+
+# Hedging: once an attempt has been running longer than the endpoint's observed p95 latency,
+# a duplicate request is sent and whichever answers first is used.
+HEDGE_PERCENTILE = 95
+HEDGE_MIN_SAMPLES = 20  # No hedging until this many latencies were observed
+HEDGE_MIN_DELAY_SECONDS = 0.05
+HEDGE_WORKERS = 16
+LATENCY_WINDOW = 500  # Recent latencies kept per endpoint
+
+# Circuit breaker: after BREAKER_FAILURE_THRESHOLD consecutive failures (network errors, 5xx)
+# calls fail fast for BREAKER_RESET_SECONDS, then a single probe decides whether to close again.
+BREAKER_FAILURE_THRESHOLD = 5
+BREAKER_RESET_SECONDS = 30.0
+
+# Per-endpoint timeouts (seconds), retry and hedging policy, and the upstream_scheduler
+# quota the endpoint draws from.
+# Only idempotent calls (embeddings, rerank) are retried or hedged; LLM completions are not.
+# Bulk indexing (embed_batch) is not hedged to avoid spending quota on duplicates.
+ENDPOINTS = {
+    "embed": {"connect_timeout": 3.05, "read_timeout": 15, "retries": 2, "idempotent": True, "hedge": True,
+              "upstream": "embedder"},
+    "embed_batch": {"connect_timeout": 3.05, "read_timeout": 60, "retries": 5, "idempotent": True, "hedge": False,
+                    "upstream": "embedder"},
+    "rerank": {"connect_timeout": 3.05, "read_timeout": 20, "retries": 2, "idempotent": True, "hedge": True,
+               "upstream": "reranker"},
+    "llm": {"connect_timeout": 3.05, "read_timeout": 60, "retries": 0, "idempotent": False, "hedge": False,
+            "upstream": "llm"},
+}
+
+
+class CircuitOpenError(requests.exceptions.RequestException):
+    """Raised instead of calling an upstream whose circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """
+    Closed -> open after `failure_threshold` consecutive failures.
+    Open -> half-open after `reset_seconds`: one probe call is let through,
+    its success closes the breaker, its failure opens it again. A probe that never
+    reports back is replaced by a new one after another `reset_seconds`.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name, failure_threshold=BREAKER_FAILURE_THRESHOLD, reset_seconds=BREAKER_RESET_SECONDS):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.rejected = 0
+        self.opens = 0
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        """Raises CircuitOpenError if the call must not be made."""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return
+            # A half-open probe whose outcome was never recorded (e.g. it was shed before
+            # being sent) does not block the breaker: another probe goes after reset_seconds
+            if self.state != self.CLOSED and time.monotonic() - self.opened_at >= self.reset_seconds:
+                self.state = self.HALF_OPEN
+                self.opened_at = time.monotonic()
+                print(f"HTTP [{self.name}]: пробный запрос после паузы...")
+                return
+            self.rejected += 1
+        raise CircuitOpenError(f"{self.name}: upstream недоступен (circuit breaker открыт)")
+
+    def record_success(self):
+        with self._lock:
+            if self.state != self.CLOSED:
+                print(f"HTTP [{self.name}]: upstream восстановился, circuit breaker закрыт.")
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or (self.state == self.CLOSED and self.failures >= self.failure_threshold):
+                if self.state == self.CLOSED:
+                    self.opens += 1
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+                print(f"HTTP [{self.name}]: {self.failures} ошибок подряд, circuit breaker открыт "
+                      f"на {self.reset_seconds:.0f} с.")
+
+
+class UpstreamHealth:
+    """Per-endpoint latency window, circuit breaker and hedging counters."""
+
+    def __init__(self, name):
+        self.name = name
+        self.breaker = CircuitBreaker(name)
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.requests = 0
+        self.failures = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self._lock = threading.Lock()
+
+    def record(self, status_code, seconds):
+        """Records one finished HTTP exchange; 5xx counts as a breaker failure."""
+        with self._lock:
+            self.requests += 1
+            if status_code < 500:
+                self.latencies.append(seconds)
+            else:
+                self.failures += 1
+        if status_code < 500:
+            self.breaker.record_success()
+        else:
+            self.breaker.record_failure()
+
+    def record_error(self):
+        """Records a network error or timeout."""
+        with self._lock:
+            self.requests += 1
+            self.failures += 1
+        self.breaker.record_failure()
+
+    def record_hedge_sent(self):
+        with self._lock:
+            self.hedged += 1
+
+    def record_hedge_win(self):
+        """The duplicate answered before the original request."""
+        with self._lock:
+            self.hedge_wins += 1
+
+    def percentile(self, p):
+        with self._lock:
+            if not self.latencies:
+                return None
+            return float(sorted(self.latencies)[min(len(self.latencies) - 1, int(len(self.latencies) * p / 100))])
+
+    def hedge_delay(self):
+        """Seconds to wait before sending a duplicate, or None while there are too few samples."""
+        if len(self.latencies) < HEDGE_MIN_SAMPLES:
+            return None
+        return max(HEDGE_MIN_DELAY_SECONDS, self.percentile(HEDGE_PERCENTILE))
+
+    def stats(self):
+        p50, p95 = self.percentile(50), self.percentile(95)
+        return {
+            "requests": self.requests,
+            "failures": self.failures,
+            "hedged": self.hedged,
+            "hedge_wins": self.hedge_wins,
+            "latency_p50": p50,
+            "latency_p95": p95,
+            "breaker": self.breaker.state,
+            "breaker_opens": self.breaker.opens,
+            "breaker_rejected": self.breaker.rejected,
+        }
+
+
+health = {name: UpstreamHealth(name) for name in ENDPOINTS}
+_hedge_executor = ThreadPoolExecutor(max_workers=HEDGE_WORKERS, thread_name_prefix="http-hedge")
+
+
+def upstream_stats():
+    """Latency, hedging and circuit breaker counters per endpoint."""
+    return {name: endpoint_health.stats() for name, endpoint_health in health.items()}
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """Returns the process-wide pooled session, creating it on first use."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _session = session
+        return _session
+
+
+def retry_delay(attempt, response=None):
+    """
+    Exponential backoff with full jitter. Honors Retry-After when the upstream sends it.
+    """
+    if response is not None:
+        retry_after = response.headers.get("Retry-After")
+        if retry_after:
+            try:
+                return min(float(retry_after), RETRY_BACKOFF_MAX_SECONDS)
+            except ValueError:
+                pass
+    return random.uniform(0, min(RETRY_BACKOFF_MAX_SECONDS, RETRY_BACKOFF_SECONDS * (2 ** attempt)))
+
+
+def _send(endpoint_health, session, url, payload, headers, timeout, stream):
+    """One timed HTTP attempt, recorded in endpoint_health."""
+    start = time.perf_counter()
+    try:
+        response = session.post(url, json=payload, headers=headers, timeout=timeout, stream=stream)
+    except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+        endpoint_health.record_error()
+        raise
+    endpoint_health.record(response.status_code, time.perf_counter() - start)
+    return response
+
+
+def _close_response(future):
+    if future.exception() is None:
+        future.result().close()
+
+
+def hedged_send_steps(endpoint_health, scheduler, priority, token_cost):
+    """
+    Hedging policy as a stage (see stages.py), shared with async_pipeline: sends the request;
+    if no answer arrives within the endpoint's hedge delay, sends a duplicate and returns
+    whichever response comes first. The duplicate takes its own `scheduler` permit; when none
+    is free right away, it is not sent. Steps:
+        ("send",)                    -> response of a single attempt
+        ("start",)                   -> handle of an attempt running in the background
+        ("wait", handles, timeout)   -> (done, pending) once one finished or `timeout` passed
+        ("discard", handle)          -> the losing attempt is dropped (its response closed)
+    """
+    delay = endpoint_health.hedge_delay()
+    if delay is None:
+        return (yield ("send",))
+
+    primary = yield ("start",)
+    pending, backup, error = {primary}, None, None
+    try:
+        done, pending = yield ("wait", pending, delay)
+        if not done:
+            backup_permit = scheduler.try_acquire(priority, token_cost)
+            if backup_permit is not None:
+                endpoint_health.record_hedge_sent()
+                backup = yield ("start",)
+                backup.add_done_callback(lambda _: backup_permit.release())
+                pending.add(backup)
+        while True:
+            for handle in done:
+                if handle.exception() is None:
+                    if handle is backup:
+                        endpoint_health.record_hedge_win()
+                    for other in pending:
+                        yield ("discard", other)
+                    pending = set()
+                    return handle.result()
+                error = handle.exception()
+            if not pending:
+                raise error
+            done, pending = yield ("wait", pending, None)
+    except GeneratorExit:
+        # The caller gave up: no step can run any more, stop what is still in flight
+        for handle in pending:
+            handle.cancel()
+        raise
+
+
+def _release_on_close(response, permit):
+    """Keeps a streamed response's scheduler slot until the caller closes the response."""
+    close = response.close
+
+    def close_and_release():
+        try:
+            close()
+        finally:
+            permit.release()
+
+    response.close = close_and_release
+
+
+def post_json_steps(endpoint, stream=False, before_attempt=None,
+                    transport_errors=(requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+    """
+    Admission, circuit breaker and retry policy of one post_json() call as a stage (see stages.py),
+    shared with async_pipeline.post_json(). `transport_errors` are the network errors that are
+    retried. Steps:
+        ("acquire",)                  -> upstream_scheduler permit (raises SchedulerBusyError)
+        ("send", hedge)               -> response of one attempt, hedged when `hedge`
+        ("hold", response, permit)    -> a streamed response keeps the permit until it is closed
+        ("close", response)
+        ("sleep", seconds)
+    Returns the response; raises once retries are exhausted.
+    """
+    config = ENDPOINTS[endpoint]
+    retries = config["retries"] if config["idempotent"] else 0
+    endpoint_health = health[endpoint]
+    hedge = config["hedge"] and not stream
+
+    for attempt in range(retries + 1):
+        if before_attempt is not None:
+            before_attempt()
+        # Admission first: a half-open probe must not be shed after the breaker let it through
+        permit = yield ("acquire",)
+        try:
+            endpoint_health.breaker.before_call()
+            response = yield ("send", hedge)
+        except transport_errors as e:
+            permit.release()
+            if attempt < retries:
+                delay = retry_delay(attempt)
+                print(f"HTTP [{endpoint}]: сетевая ошибка ({e}), повтор через {delay:.1f} с...")
+                yield ("sleep", delay)
+                continue
+            raise
+        except BaseException:
+            # Including GeneratorExit: a cancelled caller gives its slot back
+            permit.release()
+            raise
+
+        if stream and response.status_code < 400:
+            yield ("hold", response, permit)
+            return response
+        permit.release()
+
+        retry = response.status_code in RETRY_STATUS_CODES and attempt < retries
+        if stream or retry:
+            # Give the pooled connection back: nobody else will close this response
+            yield ("close", response)
+        if retry:
+            delay = retry_delay(attempt, response)
+            print(f"HTTP [{endpoint}]: статус {response.status_code}, повтор через {delay:.1f} с...")
+            yield ("sleep", delay)
+            continue
+
+        response.raise_for_status()
+        return response
+
+
+def post_json(endpoint, url, payload, headers, stream=False, before_attempt=None,
+              priority=INTERACTIVE, token_cost=0):
+    """
+    POSTs a JSON payload through the pooled session using the `endpoint` policy from ENDPOINTS.
+    Every attempt is admitted by the endpoint's upstream_scheduler with `priority` and
+    `token_cost`; raises SchedulerBusyError when the upstream is saturated.
+    Idempotent endpoints are retried on network errors and 429/5xx with jittered backoff,
+    and hedged when ENDPOINTS enables it. Fails fast with CircuitOpenError while the
+    endpoint's circuit breaker is open.
+    `before_attempt()` is called before every attempt.
+    Returns the response (a streamed one holds its scheduler slot until closed);
+    raises requests exceptions once retries are exhausted.
+    """
+    config = ENDPOINTS[endpoint]
+    timeout = (config["connect_timeout"], config["read_timeout"])
+    session = get_session()
+    endpoint_health = health[endpoint]
+    scheduler = schedulers[config["upstream"]]
+
+    def attempt():
+        return _send(endpoint_health, session, url, payload, headers, timeout, False)
+
+    def send(hedge):
+        if not hedge:
+            return _send(endpoint_health, session, url, payload, headers, timeout, stream)
+        return run_stage(hedged_send_steps(endpoint_health, scheduler, priority, token_cost), {
+            "send": attempt,
+            "start": lambda: _hedge_executor.submit(attempt),
+            "wait": lambda handles, seconds: wait(handles, timeout=seconds, return_when=FIRST_COMPLETED),
+            "discard": lambda future: future.add_done_callback(_close_response),
+        })
+
+    return run_stage(post_json_steps(endpoint, stream, before_attempt), {
+        "acquire": lambda: scheduler.acquire(priority, token_cost),
+        "send": send,
+        "hold": _release_on_close,
+        "close": lambda response: response.close(),
+        "sleep": time.sleep,
+    })
@@ -0,0 +1,76 @@
+import threading
+import numpy as np
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+from data_handler import preprocess_text
+from search_engine import top_k_from_scores
+
+# In-process retrieval used when the Alem embedder/reranker miss the per-turn deadline.
+# Same idea as the original TF-IDF bot (old/chatbot_logic.py), but over character n-grams,
+# which tolerate typos and Russian/Kazakh word forms without a stemmer.
+NGRAM_RANGE = (2, 4)
+MIN_SCORE = 0.2  # Same similarity threshold as old/chatbot_logic.py
+
+
+class LexicalFallbackIndex:
+    """TF-IDF over character n-grams (within word boundaries) of preprocess_text() output."""
+
+    def __init__(self, texts, ngram_range=NGRAM_RANGE):
+        self.vectorizer = TfidfVectorizer(analyzer='char_wb', ngram_range=ngram_range, sublinear_tf=True)
+        self.matrix = self.vectorizer.fit_transform(preprocess_text(text) for text in texts)
+
+    def __len__(self):
+        return self.matrix.shape[0]
+
+    def search(self, query, k, min_score=MIN_SCORE):
+        """Top-k documents with cosine similarity >= min_score: (indices, scores), best first."""
+        query_vector = self.vectorizer.transform([preprocess_text(query)])
+        # Rows are L2-normalized by TfidfVectorizer, so the dot product is the cosine
+        scores = (self.matrix @ query_vector.T).toarray().ravel()
+        indices, top_scores = top_k_from_scores(scores, k)
+        found = top_scores[0] >= min_score
+        return indices[0][found], top_scores[0][found]
+
+
+class LexicalFallback:
+    """
+    Holds the fallback index for the currently loaded vector store.
+    The index is built in a background thread so loading the app is not delayed;
+    search() returns nothing until it is ready.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._index = None
+        self._version = None
+
+    def start_build(self, texts, version):
+        """Builds the index for store `version` once; repeated calls with the same version are no-ops."""
+        with self._lock:
+            if self._version == version:
+                return
+            self._version = version
+            self._index = None
+        threading.Thread(target=self._build, args=(list(texts), version),
+                         name="lexical-fallback-build", daemon=True).start()
+
+    def _build(self, texts, version):
+        try:
+            index = LexicalFallbackIndex(texts)
+        except Exception as e:
+            print(f"Резервный поиск: не удалось построить TF-IDF индекс: {e}")
+            return
+        with self._lock:
+            if self._version == version:
+                self._index = index
+        print(f"Резервный поиск: TF-IDF индекс готов ({len(index)} документов).")
+
+    @property
+    def ready(self):
+        return self._index is not None
+
+    def search(self, query, k):
+        index = self._index
+        if index is None:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        return index.search(query, k)
@@ -0,0 +1,110 @@
+import os
+import numpy as np
+
+from search_engine import normalize_rows, top_k_from_scores
+
+# Quantized copies stored next to vectors.npy in the index directory
+INT8_CODES_FILE = "vectors_int8.npy"
+INT8_SCALE_FILE = "int8_scale.npy"
+FLOAT16_FILE = "vectors_f16.npy"
+
+STORAGE_MODES = ("int8", "float16")
+# Rows dequantized at once while scoring, into one reused float32 buffer (16 MB at dim 1024).
+# Bigger chunks fall out of the CPU cache and make single queries slower, not faster.
+SCORE_CHUNK_SIZE = 4096
+RESCORE_FACTOR = 4  # Shortlist size = k * RESCORE_FACTOR
+
+
+def quantize_int8(vectors):
+    """
+    Symmetric scalar quantization with one scale per dimension.
+    Returns (codes int8 (N, dim), scale float32 (dim,)), vectors ~= codes * scale.
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    scale = np.abs(vectors).max(axis=0) / 127.0
+    scale[scale == 0] = 1.0
+    codes = np.clip(np.rint(vectors / scale), -127, 127).astype(np.int8)
+    return codes, scale.astype(np.float32)
+
+
+def quantized_arrays(vectors, modes):
+    """Files to persist in the index directory for the requested storage modes."""
+    arrays = {}
+    if "int8" in modes:
+        codes, scale = quantize_int8(vectors)
+        arrays[INT8_CODES_FILE] = codes
+        arrays[INT8_SCALE_FILE] = scale
+    if "float16" in modes:
+        arrays[FLOAT16_FILE] = np.asarray(vectors, dtype=np.float16)
+    return arrays
+
+
+class QuantizedSearchIndex:
+    """
+    Two-pass search: approximate scores on int8 or float16 vectors select a shortlist of
+    k * RESCORE_FACTOR rows, which are rescored exactly on the float32 vectors.
+    Only the compact matrix is scanned per query; float32 pages are read for the shortlist only.
+    The win is memory (1/4 or 1/2 of the float32 pages resident), not speed: int8 scores about
+    as fast as float32, float16 is several times slower because numpy has no fast float16 cast.
+    """
+
+    def __init__(self, codes, full_vectors, scale=None, rescore_factor=RESCORE_FACTOR):
+        self.codes = codes
+        self.scale = scale
+        self.vectors = full_vectors
+        self.rescore_factor = rescore_factor
+        self.mode = "int8" if scale is not None else "float16"
+
+    def __len__(self):
+        return self.codes.shape[0]
+
+    def approximate_scores(self, queries):
+        """Scores (batch, N) computed on the quantized matrix, chunk by chunk."""
+        if self.scale is not None:
+            # (codes * scale) @ q == codes @ (q * scale)
+            queries = queries * self.scale
+        scores = np.empty((len(queries), len(self)), dtype=np.float32)
+        buffer = np.empty((min(SCORE_CHUNK_SIZE, len(self)), self.codes.shape[1]), dtype=np.float32)
+        for start in range(0, len(self), SCORE_CHUNK_SIZE):
+            codes = self.codes[start:start + SCORE_CHUNK_SIZE]
+            chunk = buffer[:len(codes)]
+            np.copyto(chunk, codes, casting='unsafe')
+            scores[:, start:start + len(codes)] = queries @ chunk.T
+        return scores
+
+    def search(self, query_vectors, k):
+        """Same contract as ExactSearchIndex.search()."""
+        queries = np.asarray(query_vectors, dtype=np.float32)
+        single = queries.ndim == 1
+        queries = normalize_rows(np.atleast_2d(queries))
+
+        shortlist, _ = top_k_from_scores(self.approximate_scores(queries), k * self.rescore_factor)
+        all_indices = np.empty((len(queries), min(k, shortlist.shape[1])), dtype=np.int64)
+        all_scores = np.empty(all_indices.shape, dtype=np.float32)
+        for row, query in enumerate(queries):
+            candidates = np.sort(shortlist[row])
+            exact = np.asarray(self.vectors[candidates], dtype=np.float32) @ query
+            local, top_scores = top_k_from_scores(exact, k)
+            all_indices[row] = candidates[local[0]]
+            all_scores[row] = top_scores[0]
+
+        if single:
+            return all_indices[0], all_scores[0]
+        return all_indices, all_scores
+
+
+def load_quantized_index(path, full_vectors, mode):
+    """Opens the int8 or float16 copy of an index memory-mapped. Returns None if it was not built."""
+    if mode == "int8":
+        if not os.path.exists(os.path.join(path, INT8_CODES_FILE)):
+            return None
+        return QuantizedSearchIndex(
+            np.load(os.path.join(path, INT8_CODES_FILE), mmap_mode='r'),
+            full_vectors,
+            scale=np.load(os.path.join(path, INT8_SCALE_FILE)),
+        )
+    if mode == "float16":
+        if not os.path.exists(os.path.join(path, FLOAT16_FILE)):
+            return None
+        return QuantizedSearchIndex(np.load(os.path.join(path, FLOAT16_FILE), mmap_mode='r'), full_vectors)
+    raise ValueError(f"Неизвестный режим хранения: {mode}")
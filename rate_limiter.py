@@ -0,0 +1,73 @@
+import threading
+import time
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket.
+    Refills `rate` tokens per second up to `capacity`; acquire() blocks until enough tokens are available.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self._tokens = float(capacity)
+        self._last_refill = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._last_refill) * self.rate)
+        self._last_refill = now
+
+    def wait_time(self, tokens=1):
+        """Seconds until `tokens` will be available (0 if they are now), without taking them."""
+        tokens = min(float(tokens), self.capacity)
+        with self._lock:
+            self._refill()
+            return max(0.0, (tokens - self._tokens) / self.rate)
+
+    def try_acquire(self, tokens=1):
+        """
+        Takes tokens without waiting.
+        Returns 0 on success, otherwise the number of seconds until enough tokens will be available.
+        """
+        # A single request larger than the bucket could never pass otherwise
+        tokens = min(float(tokens), self.capacity)
+        with self._lock:
+            self._refill()
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return 0.0
+            return (tokens - self._tokens) / self.rate
+
+    def acquire(self, tokens=1):
+        """Blocks until `tokens` are available and takes them."""
+        while True:
+            wait_time = self.try_acquire(tokens)
+            if wait_time == 0:
+                return
+            time.sleep(wait_time)
+
+
+class RateLimiter:
+    """
+    Combines a requests/sec bucket and a tokens/min bucket for one API quota.
+    """
+
+    def __init__(self, requests_per_second, tokens_per_minute=None):
+        self.request_bucket = TokenBucket(requests_per_second, max(1.0, requests_per_second))
+        self.token_bucket = None
+        if tokens_per_minute:
+            self.token_bucket = TokenBucket(tokens_per_minute / 60.0, tokens_per_minute)
+
+    def acquire(self, token_cost=0):
+        """Blocks until one request carrying `token_cost` tokens fits into the quota."""
+        if self.token_bucket is not None and token_cost:
+            self.token_bucket.acquire(token_cost)
+        self.request_bucket.acquire(1)
+
+
+def estimate_tokens(text):
+    """Rough token estimate for quota accounting (no tokenizer available for the Alem models)."""
+    return len(text) // 3 + 1
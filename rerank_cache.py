@@ -0,0 +1,71 @@
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+from embedding_cache import normalize_query
+
+
+class RerankCache:
+    """
+    LRU cache of reranker results keyed by (normalized query hash, ordered candidate ids, top_n).
+    Values are the reranked document ids with their relevance scores.
+    Candidate ids are only meaningful within one index, so the whole cache is dropped
+    when the index version changes.
+    """
+
+    def __init__(self, max_size=5000, ttl_seconds=24 * 3600):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.index_version = None
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(query, candidate_ids, top_n):
+        query_hash = hashlib.sha256(normalize_query(query).encode("utf-8")).hexdigest()
+        return (query_hash, tuple(int(i) for i in candidate_ids), top_n)
+
+    def set_index_version(self, index_version):
+        """Invalidates all entries if the index was rebuilt."""
+        with self._lock:
+            if index_version != self.index_version:
+                if self._entries:
+                    print(f"Кэш Reranker: индекс изменился ({self.index_version} -> {index_version}), очищаю.")
+                self._entries.clear()
+                self.index_version = index_version
+
+    def get(self, query, candidate_ids, top_n):
+        """Returns list of (doc_id, score) or None."""
+        key = self.make_key(query, candidate_ids, top_n)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.time() - entry[0] < self.ttl_seconds:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return list(entry[1])
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, query, candidate_ids, top_n, ranked):
+        key = self.make_key(query, candidate_ids, top_n)
+        with self._lock:
+            self._entries[key] = (time.time(), tuple(ranked))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "size": len(self._entries),
+                "index_version": self.index_version,
+            }
@@ -0,0 +1,48 @@
+import numpy as np
+
+SKIP = "skip"  # Top candidate dominates on cosine: use the coarse ranking, no reranker call
+SHORT = "short"  # Peaked distribution: rerank only the head of the candidate list
+FULL = "full"  # Flat distribution: rerank all candidates
+
+
+class RerankPolicy:
+    """
+    Decides how much reranking a query needs from the cosine scores of its candidates,
+    given in coarse ranking order (the fused order for hybrid search).
+    Features: cosine of the top-ranked candidate, its margin over the best other candidate
+    (negative when it is not the cosine leader) and the normalized entropy of
+    softmax(scores / temperature) (0 = all mass on one candidate, 1 = uniform).
+    """
+
+    def __init__(self, skip_min_score=0.75, skip_margin=0.1, short_max_entropy=0.5, short_k=5,
+                 temperature=0.05):
+        self.skip_min_score = skip_min_score
+        self.skip_margin = skip_margin
+        self.short_max_entropy = short_max_entropy
+        self.short_k = short_k
+        self.temperature = temperature
+
+    @staticmethod
+    def features(scores, temperature):
+        scores = np.asarray(scores, dtype=np.float64)
+        margin = scores[0] - scores[1:].max() if len(scores) > 1 else scores[0]
+        if len(scores) < 2:
+            return {"top1": float(scores[0]), "margin": float(margin), "entropy": 0.0}
+        logits = (scores - scores.max()) / temperature
+        probs = np.exp(logits)
+        probs /= probs.sum()
+        entropy = -np.sum(probs * np.log(probs + 1e-12)) / np.log(len(scores))
+        return {"top1": float(scores[0]), "margin": float(margin), "entropy": float(entropy)}
+
+    def decide(self, scores, n_candidates):
+        """
+        Returns (branch, number of candidates to send to the reranker, features).
+        """
+        if len(scores) == 0:
+            return FULL, n_candidates, {}
+        features = self.features(scores, self.temperature)
+        if features["top1"] >= self.skip_min_score and features["margin"] >= self.skip_margin:
+            return SKIP, 0, features
+        if features["entropy"] <= self.short_max_entropy:
+            return SHORT, min(self.short_k, n_candidates), features
+        return FULL, n_candidates, features
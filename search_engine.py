@@ -0,0 +1,79 @@
+import numpy as np
+
+
+def normalize_rows(vectors):
+    """L2-normalizes rows of a float32 matrix. Zero rows are left as zeros."""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def top_k_from_scores(scores, k):
+    """
+    Selects the k best scores per row with argpartition (O(N)) and sorts only those k.
+    Returns (indices, scores), both shaped (batch, k), best first.
+    """
+    scores = np.atleast_2d(scores)
+    n = scores.shape[1]
+    k = min(k, n)
+    if k <= 0:
+        empty = np.empty((scores.shape[0], 0))
+        return empty.astype(np.int64), empty.astype(scores.dtype)
+    if k < n:
+        part = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    else:
+        part = np.broadcast_to(np.arange(n), scores.shape).copy()
+    part_scores = np.take_along_axis(scores, part, axis=1)
+    order = np.argsort(-part_scores, axis=1, kind='stable')
+    return np.take_along_axis(part, order, axis=1), np.take_along_axis(part_scores, order, axis=1)
+
+
+class ExactSearchIndex:
+    """
+    Exact cosine top-k search.
+    Corpus vectors are L2-normalized once at construction (or taken as-is from a normalized
+    vector store), so a query costs one BLAS matrix product plus an O(N) argpartition.
+    """
+
+    def __init__(self, vectors, normalized=False):
+        if normalized and getattr(vectors, "dtype", None) == np.float32:
+            # Keep memory-mapped store pages as they are, no copy
+            self.vectors = vectors
+        else:
+            self.vectors = normalize_rows(vectors)
+
+    def __len__(self):
+        return self.vectors.shape[0]
+
+    def score(self, query_vectors):
+        """Cosine scores of normalized queries (batch, dim) against the whole corpus."""
+        return query_vectors @ self.vectors.T
+
+    def search(self, query_vectors, k):
+        """
+        Finds the k most similar corpus rows.
+        Accepts one query (dim,) or a matrix of queries (batch, dim).
+        Returns (indices, scores): shaped (k,) for a single query, (batch, k) for a matrix.
+        """
+        queries = np.asarray(query_vectors, dtype=np.float32)
+        single = queries.ndim == 1
+        queries = normalize_rows(np.atleast_2d(queries))
+
+        indices, scores = top_k_from_scores(self.score(queries), k)
+        if single:
+            return indices[0], scores[0]
+        return indices, scores
+
+
+def score_candidates(vectors, query_vector, candidate_ids):
+    """Cosine scores of a query against selected rows of a normalized corpus matrix."""
+    query = normalize_rows(np.atleast_2d(query_vector))[0]
+    return np.asarray(vectors[np.asarray(candidate_ids, dtype=np.int64)], dtype=np.float32) @ query
+
+
+def as_search_index(vectors):
+    """Returns `vectors` if it already is a search index, otherwise wraps it in ExactSearchIndex."""
+    if hasattr(vectors, "search"):
+        return vectors
+    return ExactSearchIndex(vectors)
@@ -0,0 +1,172 @@
+import asyncio
+import threading
+from concurrent.futures import Future
+
+
+class _SharedStream:
+    """
+    Buffers chunks of one source iterator consumed by a background thread and replays
+    them to any number of subscribers, each from the first chunk.
+    """
+
+    def __init__(self, source, on_done):
+        self._chunks = []
+        self._done = False
+        self._error = None
+        self._cond = threading.Condition()
+        self._on_done = on_done
+        threading.Thread(target=self._pump, args=(source,), name="single-flight-stream", daemon=True).start()
+
+    def _pump(self, source):
+        try:
+            for chunk in source:
+                with self._cond:
+                    self._chunks.append(chunk)
+                    self._cond.notify_all()
+        except Exception as e:
+            self._error = e
+        finally:
+            with self._cond:
+                self._done = True
+                self._cond.notify_all()
+            self._on_done(self)
+
+    def subscribe(self):
+        position = 0
+        while True:
+            with self._cond:
+                while position >= len(self._chunks) and not self._done:
+                    self._cond.wait()
+                if position < len(self._chunks):
+                    chunk = self._chunks[position]
+                    position += 1
+                elif self._error is not None:
+                    raise self._error
+                else:
+                    return
+            yield chunk
+
+
+class _AsyncSharedStream:
+    """Async counterpart of _SharedStream for async generators, driven by a pump task."""
+
+    def __init__(self, source, on_done):
+        self._chunks = []
+        self._done = False
+        self._error = None
+        self._cond = asyncio.Condition()
+        self._on_done = on_done
+        self._task = asyncio.ensure_future(self._pump(source))
+
+    async def _pump(self, source):
+        try:
+            async for chunk in source:
+                async with self._cond:
+                    self._chunks.append(chunk)
+                    self._cond.notify_all()
+        except Exception as e:
+            self._error = e
+        finally:
+            async with self._cond:
+                self._done = True
+                self._cond.notify_all()
+            self._on_done(self)
+
+    async def subscribe(self):
+        position = 0
+        while True:
+            async with self._cond:
+                await self._cond.wait_for(lambda: position < len(self._chunks) or self._done)
+                if position < len(self._chunks):
+                    chunk = self._chunks[position]
+                    position += 1
+                elif self._error is not None:
+                    raise self._error
+                else:
+                    return
+            yield chunk
+
+
+class SingleFlight:
+    """
+    Deduplicates identical in-flight work: while a computation for `key` is running, other
+    callers with the same key wait for it and receive the same result instead of starting
+    their own. Finished keys are forgotten immediately (caching is the caches' job).
+    Results are shared between callers and must be treated as read-only.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._streams = {}
+        self.leaders = 0
+        self.shared = 0
+
+    def _join(self, registry, key, create):
+        """Returns (entry, is_leader) for `key`, creating it with create() if absent."""
+        with self._lock:
+            entry = registry.get(key)
+            if entry is not None:
+                self.shared += 1
+                return entry, False
+            entry = create()
+            registry[key] = entry
+            self.leaders += 1
+            return entry, True
+
+    def _forget(self, registry, key, entry):
+        with self._lock:
+            if registry.get(key) is entry:
+                del registry[key]
+
+    def do(self, key, fn, *args, **kwargs):
+        """Blocking: runs fn(*args, **kwargs) once for all concurrent callers with `key`."""
+        future, leader = self._join(self._calls, key, Future)
+        if not leader:
+            return future.result()
+        try:
+            result = fn(*args, **kwargs)
+            future.set_result(result)
+            return result
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            self._forget(self._calls, key, future)
+
+    async def do_async(self, key, coro_fn):
+        """
+        Awaitable: runs coro_fn() once as a task for all concurrent callers with `key`.
+        A caller being cancelled does not cancel the shared task for the others.
+        """
+        def create():
+            task = asyncio.ensure_future(coro_fn())
+            task.add_done_callback(lambda _: self._forget(self._calls, key, task))
+            return task
+
+        task, _ = self._join(self._calls, key, create)
+        return await asyncio.shield(task)
+
+    def stream(self, key, source_fn):
+        """
+        Returns an iterator over the chunks of source_fn() (a generator), shared by all
+        concurrent callers with `key`; each of them receives the full stream.
+        """
+        def create():
+            return _SharedStream(source_fn(), lambda done: self._forget(self._streams, key, done))
+
+        shared_stream, _ = self._join(self._streams, key, create)
+        return shared_stream.subscribe()
+
+    def stream_async(self, key, source_fn):
+        """Async counterpart of stream() for async generators; returns an async iterator."""
+        def create():
+            return _AsyncSharedStream(source_fn(), lambda done: self._forget(self._streams, key, done))
+
+        shared_stream, _ = self._join(self._streams, key, create)
+        return shared_stream.subscribe()
+
+    def stats(self):
+        """`shared` counts callers served by another caller's computation."""
+        with self._lock:
+            return {"leaders": self.leaders, "shared": self.shared, "in_flight": len(self._calls) + len(self._streams)}
@@ -0,0 +1,50 @@
+import inspect
+
+# Stage logic shared by the blocking pipeline (http_client, chatbot_logic_alem, alem_llm_handler)
+# and async_pipeline. A stage is a generator that yields the I/O it needs as (name, *args) tuples
+# and gets back the result, or has the exception thrown into it; it returns its result.
+# run_stage() performs the steps with blocking handlers, run_stage_async() with coroutine ones,
+# so caching, fallbacks, retries and error mapping exist once for both paths.
+
+
+def run_stage(stage, handlers):
+    """Drives `stage`, performing each yielded step with `handlers[name](*args)`."""
+    result, error = None, None
+    try:
+        while True:
+            try:
+                step = stage.throw(error) if error is not None else stage.send(result)
+            except StopIteration as stop:
+                return stop.value
+            name, *args = step
+            try:
+                result, error = handlers[name](*args), None
+            except Exception as e:
+                result, error = None, e
+    finally:
+        # Interrupted (e.g. cancelled): the stage's own cleanup runs here, not at garbage collection
+        stage.close()
+
+
+async def run_stage_async(stage, handlers):
+    """
+    Async run_stage(): a handler may return a coroutine, which is awaited.
+    Other awaitables (e.g. a started task) are step results themselves.
+    """
+    result, error = None, None
+    try:
+        while True:
+            try:
+                step = stage.throw(error) if error is not None else stage.send(result)
+            except StopIteration as stop:
+                return stop.value
+            name, *args = step
+            try:
+                result = handlers[name](*args)
+                if inspect.iscoroutine(result):
+                    result = await result
+                error = None
+            except Exception as e:
+                result, error = None, e
+    finally:
+        stage.close()
@@ -0,0 +1,141 @@
+import os
+import json
+import time
+import uuid
+import threading
+import contextvars
+from collections import deque
+
+# Per-stage latency tracing for the RAG pipeline.
+# Every span (embed, coarse_search, rerank, map_contexts, prompt_build, llm, llm_first_token, turn)
+# is recorded in an in-process latency window per span name, from which metrics() reports
+# p50/p95/p99 (served by the API at GET /metrics). With TRACE_FILE set, spans are also
+# appended to it as JSON lines; the file is rotated to TRACE_FILE + ".1" at TRACE_MAX_BYTES.
+TRACE_FILE = os.getenv("TRACE_FILE")  # JSON-lines export, off unless set (e.g. TRACE_FILE=traces.jsonl)
+TRACE_MAX_BYTES = 100 * 1024 * 1024  # Size at which the export is rotated
+HISTOGRAM_WINDOW = 10000  # Latest latencies kept per span name
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+class Span:
+    """
+    A timed stage; use as a context manager. Spans opened inside it (in the same thread or
+    task, or in work started with contextvars.copy_context()) share its trace id.
+    """
+
+    def __init__(self, tracer, name, trace_id, attrs):
+        self.tracer = tracer
+        self.name = name
+        self.trace_id = trace_id
+        self.attrs = attrs
+        self._start = None
+        self._token = None
+
+    def set(self, **attrs):
+        """Adds attributes (payload sizes, cache hits, chosen plan...) to the span."""
+        self.attrs.update(attrs)
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _current_span.reset(self._token)
+        if exc_type is not None:
+            self.attrs["error"] = exc_type.__name__
+        self.tracer.record(self.name, time.perf_counter() - self._start, trace_id=self.trace_id, **self.attrs)
+
+
+class Tracer:
+    def __init__(self, path=TRACE_FILE, window=HISTOGRAM_WINDOW):
+        self.path = path
+        self.window = window
+        self._latencies = {}
+        self._lock = threading.Lock()
+        self._file_lock = threading.Lock()  # Export I/O stays off the latency window lock
+        self._file = None
+
+    def span(self, name, trace_id=None, **attrs):
+        """
+        Opens a span; a span without an enclosing one starts a new trace,
+        unless `trace_id` continues an existing one (e.g. in a streamed response body).
+        """
+        if trace_id is None:
+            parent = _current_span.get()
+            trace_id = parent.trace_id if parent is not None else uuid.uuid4().hex[:16]
+        return Span(self, name, trace_id, attrs)
+
+    def annotate(self, **attrs):
+        """Adds attributes to the innermost open span, if any."""
+        span = _current_span.get()
+        if span is not None:
+            span.set(**attrs)
+
+    def current_trace_id(self):
+        span = _current_span.get()
+        return span.trace_id if span is not None else None
+
+    def record(self, name, seconds, trace_id=None, **attrs):
+        """
+        Records a finished stage measured by the caller. Used directly where a `with` block
+        does not fit, e.g. across the yields of a streamed answer.
+        """
+        event = {
+            "ts": round(time.time(), 3),
+            "trace": trace_id or self.current_trace_id(),
+            "span": name,
+            "ms": round(seconds * 1000, 3),
+            **attrs,
+        }
+        with self._lock:
+            latencies = self._latencies.get(name)
+            if latencies is None:
+                latencies = self._latencies[name] = deque(maxlen=self.window)
+            latencies.append(seconds)
+        if self.path:
+            self._export(event)
+
+    def _export(self, event):
+        line = json.dumps(event, ensure_ascii=False, default=str) + "\n"
+        with self._file_lock:
+            if not self.path:
+                return
+            try:
+                if self._file is None:
+                    self._file = open(self.path, "a", encoding="utf-8")
+                self._file.write(line)
+                self._file.flush()
+                if self._file.tell() >= TRACE_MAX_BYTES:
+                    self._file.close()
+                    self._file = None
+                    os.replace(self.path, self.path + ".1")
+            except OSError as e:
+                print(f"Трассировка: не удалось записать {self.path}: {e}")
+                self.path = None
+
+    def reset(self):
+        """Forgets the collected latencies (e.g. after a benchmark warm-up)."""
+        with self._lock:
+            self._latencies.clear()
+
+    def metrics(self):
+        """Latency histogram summary per span name (milliseconds over the latest HISTOGRAM_WINDOW spans)."""
+        with self._lock:
+            snapshot = {name: sorted(latencies) for name, latencies in self._latencies.items()}
+        summary = {}
+        for name, latencies in snapshot.items():
+            def percentile(p):
+                return round(latencies[min(len(latencies) - 1, int(len(latencies) * p / 100))] * 1000, 3)
+            summary[name] = {
+                "count": len(latencies),
+                "mean_ms": round(sum(latencies) / len(latencies) * 1000, 3),
+                "p50_ms": percentile(50),
+                "p95_ms": percentile(95),
+                "p99_ms": percentile(99),
+            }
+        return summary
+
+
+tracer = Tracer()
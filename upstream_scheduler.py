@@ -0,0 +1,243 @@
+import time
+import heapq
+import asyncio
+import itertools
+import threading
+import requests
+
+from rate_limiter import TokenBucket
+
+# Process-wide admission control for the upstream APIs.
+# Every Streamlit session, API request and batch job of the process shares one scheduler
+# per upstream: a concurrency limit plus request/token buckets sized to the upstream quota.
+# Callers wait in a priority queue; interactive chat always goes before batch work.
+
+INTERACTIVE = 0  # Chat turns (Streamlit, API)
+BATCH = 1  # Offline jobs: generate_embeddings.py
+
+# Per-upstream quota. batch_max_concurrent keeps slots free for interactive calls
+# while a batch job is running in the same process.
+UPSTREAMS = {
+    "embedder": {"max_concurrent": 8, "batch_max_concurrent": 4, "requests_per_second": 10.0,
+                 "tokens_per_minute": 200000},
+    "reranker": {"max_concurrent": 8, "batch_max_concurrent": 2, "requests_per_second": 10.0,
+                 "tokens_per_minute": None},
+    "llm": {"max_concurrent": 16, "batch_max_concurrent": 2, "requests_per_second": 5.0,
+            "tokens_per_minute": None},
+}
+
+# Queue limits per priority class: a caller finding max_queue callers already waiting, or
+# waiting longer than max_wait_seconds, gets SchedulerBusyError at once instead of hanging.
+PRIORITIES = {
+    INTERACTIVE: {"max_queue": 64, "max_wait_seconds": 3.0},
+    BATCH: {"max_queue": 256, "max_wait_seconds": None},
+}
+
+
+class SchedulerBusyError(requests.exceptions.RequestException):
+    """The upstream is saturated: the call was shed instead of queued."""
+
+
+class Permit:
+    """One admitted call; release() (or leaving the `with` block) frees its slot."""
+
+    def __init__(self, scheduler, priority):
+        self._scheduler = scheduler
+        self._priority = priority
+        self._released = False
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self._scheduler._release(self._priority)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+class UpstreamScheduler:
+    """
+    Priority queue in front of one upstream. A caller is admitted when it is first in the
+    queue (lowest priority value, then arrival order), a concurrency slot is free for its
+    class, and the request and token buckets can pay for the call.
+    """
+
+    def __init__(self, name, max_concurrent, batch_max_concurrent, requests_per_second,
+                 tokens_per_minute=None, priorities=PRIORITIES):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.batch_max_concurrent = batch_max_concurrent
+        self.priorities = priorities
+        self.request_bucket = TokenBucket(requests_per_second, max(1.0, requests_per_second))
+        self.token_bucket = None
+        if tokens_per_minute:
+            self.token_bucket = TokenBucket(tokens_per_minute / 60.0, tokens_per_minute)
+        self._cond = threading.Condition()
+        self._waiting = []  # heap of (priority, arrival number)
+        self._arrivals = itertools.count()
+        self._queued = {priority: 0 for priority in priorities}
+        self._in_flight = {priority: 0 for priority in priorities}
+        self._async_waiters = {}  # queue entry -> (event loop, asyncio.Event) of acquire_async()
+        self.admitted = 0
+        self.shed = 0
+
+    def _class_limit(self, priority):
+        return self.max_concurrent if priority == INTERACTIVE else self.batch_max_concurrent
+
+    def _quota_wait(self, token_cost):
+        wait = self.request_bucket.wait_time(1)
+        if self.token_bucket is not None and token_cost:
+            wait = max(wait, self.token_bucket.wait_time(token_cost))
+        return wait
+
+    def _shed(self, reason):
+        self.shed += 1
+        raise SchedulerBusyError(f"{self.name}: {reason}")
+
+    def _enqueue(self, priority):
+        """Adds a waiter to the queue (caller holds _cond). Sheds it when the queue is full."""
+        if self._queued[priority] >= self.priorities[priority]["max_queue"]:
+            self._shed("очередь переполнена")
+        entry = (priority, next(self._arrivals))
+        heapq.heappush(self._waiting, entry)
+        self._queued[priority] += 1
+        return entry
+
+    def _dequeue(self, entry):
+        """Removes a waiter, admitted or not (caller holds _cond)."""
+        self._waiting.remove(entry)
+        heapq.heapify(self._waiting)
+        self._queued[entry[0]] -= 1
+        self._async_waiters.pop(entry, None)
+        self._notify()
+
+    def _try_admit(self, entry, token_cost):
+        """
+        Admits the waiter if it is first in line, a slot is free for its class and the buckets
+        can pay (caller holds _cond). Returns 0 when admitted, otherwise the seconds until the
+        quota refills or None when only a release can help.
+        """
+        if self._waiting[0] != entry:
+            return None
+        return self._admit_now(entry[0], token_cost)
+
+    def _admit_now(self, priority, token_cost):
+        """Takes a slot and pays the buckets if possible right now (caller holds _cond); see _try_admit."""
+        if (sum(self._in_flight.values()) >= self.max_concurrent
+                or self._in_flight[priority] >= self._class_limit(priority)):
+            return None
+        quota_wait = self._quota_wait(token_cost)
+        if quota_wait == 0:
+            self.request_bucket.try_acquire(1)
+            if self.token_bucket is not None and token_cost:
+                self.token_bucket.try_acquire(token_cost)
+            self._in_flight[priority] += 1
+            self.admitted += 1
+        return quota_wait
+
+    def _notify(self):
+        """Wakes thread waiters and async waiters (caller holds _cond)."""
+        self._cond.notify_all()
+        for loop, event in self._async_waiters.values():
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:  # Loop already closed; its waiter is gone with it
+                pass
+
+    def _deadline(self, priority):
+        max_wait = self.priorities[priority]["max_wait_seconds"]
+        return None if max_wait is None else time.monotonic() + max_wait
+
+    def acquire(self, priority=INTERACTIVE, token_cost=0):
+        """
+        Blocks until the call is admitted and returns its Permit.
+        Raises SchedulerBusyError when the queue of `priority` is full or its wait limit passes.
+        """
+        deadline = self._deadline(priority)
+        with self._cond:
+            entry = self._enqueue(priority)
+            try:
+                while True:
+                    quota_wait = self._try_admit(entry, token_cost)
+                    if quota_wait == 0:
+                        break
+                    timeout = quota_wait
+                    if deadline is not None:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self._shed("превышено время ожидания в очереди")
+                        timeout = remaining if timeout is None else min(timeout, remaining)
+                    self._cond.wait(timeout)
+            finally:
+                self._dequeue(entry)
+        return Permit(self, priority)
+
+    def try_acquire(self, priority=INTERACTIVE, token_cost=0):
+        """
+        Admits the call only if that needs no waiting and nobody is queued ahead of it.
+        Returns a Permit, or None (e.g. for an optional hedged duplicate).
+        """
+        with self._cond:
+            if self._waiting or self._admit_now(priority, token_cost) != 0:
+                return None
+        return Permit(self, priority)
+
+    async def acquire_async(self, priority=INTERACTIVE, token_cost=0):
+        """
+        Awaitable acquire(): waits in the same queue on an asyncio.Event instead of a thread,
+        so async waiters cost no executor threads and are shed within max_wait_seconds.
+        A cancelled waiter simply leaves the queue.
+        """
+        deadline = self._deadline(priority)
+        event = asyncio.Event()
+        with self._cond:
+            entry = self._enqueue(priority)
+            self._async_waiters[entry] = (asyncio.get_running_loop(), event)
+        try:
+            while True:
+                with self._cond:
+                    quota_wait = self._try_admit(entry, token_cost)
+                    if quota_wait == 0:
+                        break
+                    # Cleared under the lock: any later release sets it again
+                    event.clear()
+                timeout = quota_wait
+                if deadline is not None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        with self._cond:
+                            self._shed("превышено время ожидания в очереди")
+                    timeout = remaining if timeout is None else min(timeout, remaining)
+                try:
+                    await asyncio.wait_for(event.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            with self._cond:
+                self._dequeue(entry)
+        return Permit(self, priority)
+
+    def _release(self, priority):
+        with self._cond:
+            self._in_flight[priority] -= 1
+            self._notify()
+
+    def stats(self):
+        with self._cond:
+            return {
+                "in_flight": sum(self._in_flight.values()),
+                "queued": sum(self._queued.values()),
+                "admitted": self.admitted,
+                "shed": self.shed,
+            }
+
+
+schedulers = {name: UpstreamScheduler(name, **config) for name, config in UPSTREAMS.items()}
+
+
+def scheduler_stats():
+    """Admission counters per upstream."""
+    return {name: scheduler.stats() for name, scheduler in schedulers.items()}
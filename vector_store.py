@@ -0,0 +1,238 @@
+import os
+import sys
+import json
+import mmap
+import shutil
+import hashlib
+import pickle
+import numpy as np
+
+# On-disk layout of an index directory:
+#   header.json      format version, embedder model, shape, dtype, index version
+#   vectors.npy      float32 matrix (N, dim), L2-normalized when header["normalized"]
+#   keys.npy         content keys of documents, sha256 hex (N,)
+#   texts.bin        utf-8 blob of combined Q+A texts, sliced by text_offsets.npy (N+1,)
+#   rows.bin         utf-8 blob of JSON-encoded original CSV rows, sliced by row_offsets.npy (N+1,)
+#   ivf_*.npy        optional ANN index, see ann_index.py
+# Everything except header.json is opened memory-mapped, so loading is O(1)
+# and several worker processes share the same pages through the OS page cache.
+# A document id is its row position in every file, so search, reranking and row lookups
+# pass ids around without per-query text lookups.
+FORMAT_VERSION = 1
+HEADER_FILE = "header.json"
+VECTORS_FILE = "vectors.npy"
+KEYS_FILE = "keys.npy"
+TEXTS_FILE = "texts.bin"
+TEXT_OFFSETS_FILE = "text_offsets.npy"
+ROWS_FILE = "rows.bin"
+ROW_OFFSETS_FILE = "row_offsets.npy"
+
+
+def content_key(text, model):
+    """
+    Content address of a document: hash of the embedder model name and the combined text.
+    Changing either the text or the model produces a new key.
+    """
+    return hashlib.sha256(f"{model}\n{text}".encode("utf-8")).hexdigest()
+
+
+def compute_index_version(model, keys):
+    """Version of an index: changes whenever any document or the embedder model changes."""
+    digest = hashlib.sha256(model.encode("utf-8"))
+    for key in keys:
+        digest.update(key.encode("ascii"))
+    return digest.hexdigest()[:16]
+
+
+class BlobList:
+    """
+    Read-only sequence of strings stored back to back in one memory-mapped blob.
+    Items are decoded on access only.
+    """
+
+    def __init__(self, blob_path, offsets_path):
+        self.offsets = np.load(offsets_path, mmap_mode='r')
+        with open(blob_path, "rb") as f:
+            if os.fstat(f.fileno()).st_size:
+                self._blob = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                self._blob = b""
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("BlobList index out of range")
+        start, end = int(self.offsets[i]), int(self.offsets[i + 1])
+        return self._blob[start:end].decode("utf-8")
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+
+class DocumentTexts(BlobList):
+    """BlobList of combined Q+A texts that also serves their stored content keys (keys.npy)."""
+
+    def __init__(self, blob_path, offsets_path, keys):
+        super().__init__(blob_path, offsets_path)
+        self.keys = keys
+
+    def key(self, i):
+        """Content key of document `i`, as stored when the index was built."""
+        return self.keys[i].decode("ascii")
+
+
+class RowList(BlobList):
+    """BlobList of JSON-encoded CSV rows; items are decoded back into dicts."""
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        return json.loads(super().__getitem__(i))
+
+
+class VectorStore:
+    """
+    Memory-mapped index directory: vectors, content keys, texts and original rows.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, HEADER_FILE), mode='r', encoding='utf-8') as f:
+            self.header = json.load(f)
+        if self.header.get("format_version") != FORMAT_VERSION:
+            raise ValueError(f"Неподдерживаемая версия индекса: {self.header.get('format_version')}")
+
+        self.vectors = np.load(os.path.join(path, VECTORS_FILE), mmap_mode='r')
+        self.keys = np.load(os.path.join(path, KEYS_FILE), mmap_mode='r')
+        self.texts = DocumentTexts(os.path.join(path, TEXTS_FILE), os.path.join(path, TEXT_OFFSETS_FILE), self.keys)
+        self.rows = RowList(os.path.join(path, ROWS_FILE), os.path.join(path, ROW_OFFSETS_FILE))
+
+    @property
+    def model(self):
+        return self.header["model"]
+
+    @property
+    def index_version(self):
+        return self.header["index_version"]
+
+    @property
+    def normalized(self):
+        return self.header["normalized"]
+
+    def __len__(self):
+        return self.header["count"]
+
+
+def _write_blob(blob_path, offsets_path, strings):
+    offsets = np.zeros(len(strings) + 1, dtype=np.int64)
+    with open(blob_path, "wb") as f:
+        for i, s in enumerate(strings):
+            encoded = s.encode("utf-8")
+            f.write(encoded)
+            offsets[i + 1] = offsets[i] + len(encoded)
+    np.save(offsets_path, offsets)
+
+
+def save_vector_store(path, model, keys, texts, vectors, rows, normalize=True,
+                      extra_arrays=None, extra_header=None):
+    """
+    Writes an index directory. The new directory is built next to the old one and swapped in,
+    so readers never see a half-written index.
+    `extra_arrays` ({filename: array}) and `extra_header` let side indexes (e.g. ANN) be
+    persisted atomically with the vectors.
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if normalize:
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        vectors = vectors / norms
+
+    tmp_path = path.rstrip("/\\") + ".tmp"
+    if os.path.exists(tmp_path):
+        shutil.rmtree(tmp_path)
+    os.makedirs(tmp_path)
+
+    np.save(os.path.join(tmp_path, VECTORS_FILE), vectors)
+    np.save(os.path.join(tmp_path, KEYS_FILE), np.array(keys, dtype="S64"))
+    _write_blob(os.path.join(tmp_path, TEXTS_FILE), os.path.join(tmp_path, TEXT_OFFSETS_FILE), texts)
+    _write_blob(os.path.join(tmp_path, ROWS_FILE), os.path.join(tmp_path, ROW_OFFSETS_FILE),
+                [json.dumps(row, ensure_ascii=False) for row in rows])
+    for filename, array in (extra_arrays or {}).items():
+        np.save(os.path.join(tmp_path, filename), array)
+
+    header = {
+        "format_version": FORMAT_VERSION,
+        "model": model,
+        "count": int(vectors.shape[0]),
+        "dim": int(vectors.shape[1]) if vectors.ndim == 2 else 0,
+        "dtype": "float32",
+        "normalized": bool(normalize),
+        "index_version": compute_index_version(model, keys),
+    }
+    header.update(extra_header or {})
+    with open(os.path.join(tmp_path, HEADER_FILE), mode='w', encoding='utf-8') as f:
+        json.dump(header, f, ensure_ascii=False, indent=2)
+
+    old_path = path.rstrip("/\\") + ".old"
+    if os.path.exists(path):
+        if os.path.exists(old_path):
+            shutil.rmtree(old_path)
+        os.replace(path, old_path)
+    os.replace(tmp_path, path)
+    if os.path.exists(old_path):
+        shutil.rmtree(old_path)
+    return header
+
+
+def load_vector_store(path):
+    """Opens an index directory memory-mapped. Returns None if it does not exist."""
+    if not os.path.exists(os.path.join(path, HEADER_FILE)):
+        return None
+    return VectorStore(path)
+
+
+def _match_legacy_rows(texts, original_data):
+    """
+    Original rows of the embedded `texts`. The pickle kept texts and vectors only for rows that
+    were embedded successfully, so rows are matched by their combined Q+A text, not by position.
+    """
+    rows_by_text = {}
+    for row in original_data:
+        rows_by_text.setdefault(f"Вопрос: {row.get('questions', '')} Ответ: {row.get('answers', '')}", row)
+    unmatched = sum(1 for text in texts if text not in rows_by_text)
+    if unmatched:
+        raise ValueError(f"{unmatched} из {len(texts)} текстов не совпадают ни с одной строкой original_data")
+    return [rows_by_text[text] for text in texts]
+
+
+def convert_legacy_pickle(pickle_path, path, model="text-1024"):
+    """Converts an old alem_embeddings.pkl into the memory-mapped index format."""
+    with open(pickle_path, "rb") as f:
+        data = pickle.load(f)
+    model = data.get("model", model)
+    texts = data["texts"]
+    if len(data["vectors"]) != len(texts):
+        raise ValueError(f"В файле {len(data['vectors'])} векторов на {len(texts)} текстов")
+    keys = data.get("keys") or [content_key(text, model) for text in texts]
+    rows = _match_legacy_rows(texts, data["original_data"])
+    return save_vector_store(path, model, keys, texts, data["vectors"], rows)
+
+
+if __name__ == "__main__":
+    # Usage: python vector_store.py alem_embeddings.pkl alem_index
+    if len(sys.argv) != 3:
+        print("Использование: python vector_store.py <legacy.pkl> <index_dir>")
+        sys.exit(1)
+    try:
+        header = convert_legacy_pickle(sys.argv[1], sys.argv[2])
+    except ValueError as e:
+        print(f"Ошибка: {e}")
+        sys.exit(1)
+    print(f"Готово! Индекс ({header['count']}, {header['dim']}) сохранен в '{sys.argv[2]}'")